@@ -0,0 +1,61 @@
+# Analysis Service: one process running X-ray, lab and interpretation stages without HTTP hops
+import os
+import logging
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+from werkzeug.utils import secure_filename
+from instrumentation import install_metrics
+from orchestrator import AnalysisPipeline, local_components, stub_components
+from serving import register_shutdown
+
+app = Flask(__name__)
+CORS(app)
+install_metrics(app, "analysis")
+logging.basicConfig(level=logging.INFO)
+
+# local: import the three services into this process (loads their models)
+# stub:  deterministic offline stand-ins (ANALYZE_STUB_DELAY_MS per stage), for tests and load runs
+ANALYZE_COMPONENTS = os.getenv("ANALYZE_COMPONENTS", "local").lower()
+ANALYZE_WORKERS = int(os.getenv("ANALYZE_WORKERS", 8))
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("ANALYZE_MAX_REQUEST_BYTES", 50 * 1024 * 1024))
+
+if ANALYZE_COMPONENTS == "stub":
+    components = stub_components(float(os.getenv("ANALYZE_STUB_DELAY_MS", 0)))
+else:
+    components = local_components()
+pipeline = AnalysisPipeline(components, max_workers=ANALYZE_WORKERS)
+register_shutdown("analysis-pipeline", pipeline.shutdown)
+logging.info(f"✅ Analysis pipeline ready (components={ANALYZE_COMPONENTS}, workers={ANALYZE_WORKERS})")
+
+def _read_files(*fields):
+    parts = []
+    for field in fields:
+        parts.extend(request.files.getlist(field))
+    return [(f.read(), secure_filename(f.filename or f"upload_{i}")) for i, f in enumerate(parts)]
+
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    """multipart/form-data: `xray` (or `images`) films, `files` lab reports, optional username/language."""
+    try:
+        images = _read_files("xray", "images")
+        lab_files = _read_files("files")
+        if not images and not lab_files:
+            return jsonify({"error": "Provide 'xray' and/or 'files' uploads"}), 400
+
+        username = request.form.get("username", "Patient")
+        language = request.form.get("language", "english")
+        logging.info(f"🧩 /analyze: {len(images)} X-ray, {len(lab_files)} lab files")
+
+        result = pipeline.analyze_sync(images, lab_files, username, language)
+        return jsonify({"message": "Analysis complete", **result}), 200
+    except Exception as e:
+        logging.exception("Error in /analyze route:")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/')
+def health_check():
+    return "Analysis Service is running", 200
+
+if __name__ == "__main__":
+    port = int(os.environ.get("PORT", 5003))
+    app.run(host="0.0.0.0", port=port, debug=os.environ.get("FLASK_DEBUG", "False") == "True")
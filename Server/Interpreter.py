@@ -1,9 +1,14 @@
 #Interpreter.py
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import google.generativeai as genai
-from googletrans import Translator
 from dotenv import load_dotenv
+from gemini_client import FORBIDDEN, QUOTA, build_response_cache, get_client
+from instrumentation import count, install_metrics, stage
+from result_cache import make_key
+from streaming import GreetingFilter, SentenceBuffer, sse_event
+from text_pipeline import PromptTemplate, strip_greetings
+from translation import LANGUAGE_MAP, build_translation_service
 import logging
 import json
 import os
@@ -13,6 +18,7 @@ import os
 # ----------------------------------
 app = Flask(__name__)
 CORS(app)
+install_metrics(app, "interpreter")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 # ----------------------------------
@@ -28,24 +34,56 @@ if not API_KEY:
 
 # Configure Gemini
 genai.configure(api_key=API_KEY)
+gemini = get_client(API_KEY)
 logging.info("✅ Gemini API configured successfully.")
 
+# Model output (pre-greeting) for identical content/mode/language; bump the version when prompts change
+PROMPT_TEMPLATE_VERSION = "interpreter-v1"
+response_cache = build_response_cache("interpreter-llm-cache")
+
 # ----------------------------------
 # Translator + Language Mapping
 # ----------------------------------
-translator = Translator()
-LANGUAGE_MAP = {"english": "en", "telugu": "te", "hindi": "hi"}
+# Segment-cached, batched translation; TRANSLATION_BACKEND picks googletrans, gemini, http or offline,
+# or a fallback order such as "gemini,googletrans"
+translation = build_translation_service(gemini, LANGUAGE_MAP)
 
 # ----------------------------------
-# Core Response Generator
+# Prompt + Post-processing Helpers
 # ----------------------------------
-def generate_health_response(username, content, mode="report", language="english"):
+QUOTA_RESPONSE = (
+    "**[Simulated Analysis]**\n\n"
+    "**Findings:**\n"
+    "The uploaded image appears to be a standard radiological view. Visualized structures show normal alignment. No obvious acute fractures, dislocations, or severe soft tissue abnormalities are detected in this simulated check.\n\n"
+    "**Assessment:**\n"
+    "Appears within normal limits (Simulated).\n\n"
+    "**Suggested Specialist:**\n"
+    "Orthopedist or General Physician if pain persists.\n\n"
+    "**Home Care Tips:**\n"
+    "1. 🧊 **Ice**: Apply cold packs for 15-20 mins if swelling exists.\n"
+    "2. 😴 **Rest**: Avoid straining the affected area.\n"
+    "3. 💊 **Hydration**: Drink plenty of water to aid recovery.\n\n"
+    "*(Note: This is a placeholder because the AI service usage limit was reached.)*"
+)
+FORBIDDEN_RESPONSE = (
+    "**[System Error: Invalid API Key]**\n\n"
+    "Google has blocked your API key because it was reported as **leaked** (publicly exposed).\n\n"
+    "**How to Fix:**\n"
+    "1. Go to [Google AI Studio](https://aistudio.google.com/) and generate a **new** key.\n"
+    "2. Open `Server/.env` file.\n"
+    "3. Paste the new key into `API_KEY=...`.\n"
+    "4. Restart the server."
+)
+UNAVAILABLE_RESPONSE = "Sorry, I'm having trouble connecting to the AI service right now. Please check your internet connection."
+TRANSLATION_FAILED_NOTE = "\n\n(Note: Translation to your selected language failed.)"
+
+
+def build_greeting(username):
     # --- Custom greeting (only once) ---
-    greeting = f"👋 Hello {username}," if username and username.lower() not in ["patient", "none", ""] else "👋 Hello there,"
+    return f"👋 Hello {username}," if username and username.lower() not in ["patient", "none", ""] else "👋 Hello there,"
 
-    # --- Build prompt ---
-    if mode == "report":
-        prompt = f"""
+
+REPORT_PROMPT = PromptTemplate("""
 You are a compassionate medical professional explaining a diagnostic or radiology report.
 
 Report Data:
@@ -61,9 +99,9 @@ Your task:
 5. Give 3–5 brief **home-care and lifestyle tips** (rest 😴, hydration 💧, warm compress 🌿, fresh diet 🍎, etc.).
 6. Encourage professional consultation for confirmation.
 7. Keep it under 10 lines, friendly but professional (💊🩺😊).
-"""
-    else:
-        prompt = f"""
+""")
+
+CHAT_PROMPT = PromptTemplate("""
 You are a friendly medical assistant giving conversational wellness guidance.
 
 The patient says:
@@ -77,101 +115,142 @@ Respond with:
 - 2–3 easy home remedies (hydration 💧, rest 😴, herbal tea 🌿).
 - Mention which doctor to consult if needed.
 - Keep under 6 lines, positive and reassuring.
-"""
+""")
 
-    # --- Direct REST API Call (Bypassing SDK/gRPC) ---
-    import requests
-    import json
 
-    # primary_model = "gemini-flash-latest"
-    # fallback_model = "gemini-pro-latest"
+def build_prompt(content, mode="report", language="english"):
+    template = REPORT_PROMPT if mode == "report" else CHAT_PROMPT
+    return template.render(content, translation.prompt_instruction(language))
 
-    # We will try primary then fallback
-    models_to_try = ["gemini-flash-latest", "gemini-pro-latest"]
 
-    final_response = ""
+def fallback_response(result):
+    """Text served when Gemini gave no usable answer."""
+    if result.status == QUOTA:
+        logging.warning(f"⚠️ {result.model} Quota Exceeded (429). Switching to Mock Response.")
+        count("interpret.mock_response.quota")
+        return QUOTA_RESPONSE
+    if result.status == FORBIDDEN:
+        logging.error(f"❌ {result.model} API Key Invalid/Leaked (403).")
+        count("interpret.mock_response.forbidden")
+        return FORBIDDEN_RESPONSE
+    count("interpret.mock_response.unavailable")
+    return UNAVAILABLE_RESPONSE
 
-    for model_name in models_to_try:
-        try:
-            logging.info(f"🧠 Generating response using {model_name} (REST API) | Mode: {mode}")
 
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={API_KEY}"
-            headers = {'Content-Type': 'application/json'}
-            data = {
-                "contents": [{
-                    "parts": [{"text": prompt}]
-                }]
-            }
+def clean_response(text):
+    # --- Remove any duplicate greetings from model output ---
+    return strip_greetings(text)
 
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-
-            if response.status_code == 200:
-                result = response.json()
-                # Extract text
-                # Structure: candidates[0].content.parts[0].text
-                try:
-                    final_response = result['candidates'][0]['content']['parts'][0]['text']
-                    logging.info("✅ Gemini REST Response received.")
-                    break # Success!
-                except (KeyError, IndexError) as e:
-                    logging.warning(f"⚠️ Unexpected JSON structure from {model_name}: {result}")
-                    continue
-            elif response.status_code == 429:
-                logging.warning(f"⚠️ {model_name} Quota Exceeded (429). Switching to Mock Response.")
-                final_response = (
-                    "**[Simulated Analysis]**\n\n"
-                    "**Findings:**\n"
-                    "The uploaded image appears to be a standard radiological view. Visualized structures show normal alignment. No obvious acute fractures, dislocations, or severe soft tissue abnormalities are detected in this simulated check.\n\n"
-                    "**Assessment:**\n"
-                    "Appears within normal limits (Simulated).\n\n"
-                    "**Suggested Specialist:**\n"
-                    "Orthopedist or General Physician if pain persists.\n\n"
-                    "**Home Care Tips:**\n"
-                    "1. 🧊 **Ice**: Apply cold packs for 15-20 mins if swelling exists.\n"
-                    "2. 😴 **Rest**: Avoid straining the affected area.\n"
-                    "3. 💊 **Hydration**: Drink plenty of water to aid recovery.\n\n"
-                    "*(Note: This is a placeholder because the AI service usage limit was reached.)*"
-                )
-                break
-            elif response.status_code == 403:
-                logging.error(f"❌ {model_name} API Key Invalid/Leaked (403).")
-                final_response = (
-                    "**[System Error: Invalid API Key]**\n\n"
-                    "Google has blocked your API key because it was reported as **leaked** (publicly exposed).\n\n"
-                    "**How to Fix:**\n"
-                    "1. Go to [Google AI Studio](https://aistudio.google.com/) and generate a **new** key.\n"
-                    "2. Open `Server/.env` file.\n"
-                    "3. Paste the new key into `API_KEY=...`.\n"
-                    "4. Restart the server."
-                )
-                break
-            else:
-                logging.warning(f"⚠️ {model_name} REST API failed: {response.status_code} - {response.text}")
-                continue
-
-        except Exception as e:
-             logging.error(f"❌ {model_name} REST Request failed: {e}")
-             continue
-
-    if not final_response:
-        final_response = "Sorry, I'm having trouble connecting to the AI service right now. Please check your internet connection."
 
-    # --- Remove any duplicate greetings from model output ---
-    import re
-    final_response = re.sub(r"(?i)^\s*(hi|hello|hey)[^a-zA-Z]*", "", final_response).strip()
-    final_response = re.sub(r"(?i)(^|\n)\s*(hi|hello|hey|dear)[^\n]*\n?", "", final_response).strip()
+def interpret_cache_key(content, mode, language):
+    # The language instruction is part of the prompt when the translation backend answers natively
+    return make_key("interpret", PROMPT_TEMPLATE_VERSION, mode, language.lower(), content,
+                    translation.prompt_instruction(language))
+
+
+def translate_text(text, language, generated=False):
+    """Returns (text, ok). `generated` marks model output, already in `language` with the gemini backend."""
+    return translation.translate(text, language, generated=generated)
+
+
+# ----------------------------------
+# Core Response Generator
+# ----------------------------------
+def generate_health_response(username, content, mode="report", language="english"):
+    with stage("interpret.prompt"):
+        greeting = build_greeting(username)
+        prompt = build_prompt(content, mode, language)
+        cache_key = interpret_cache_key(content, mode, language)
+
+    # --- Direct REST API Call (Bypassing SDK/gRPC) via the shared pooled client ---
+    # Models are tried in order: gemini-flash-latest, then gemini-pro-latest
+    logging.info(f"🧠 Generating response (REST API) | Mode: {mode}")
+    with stage("interpret.llm"):
+        result = gemini.generate(prompt, cache=response_cache, cache_key=cache_key)
+
+    if result.ok:
+        final_response = result.text
+        logging.info(f"✅ Gemini REST Response received from {result.model}.")
+    else:
+        final_response = fallback_response(result)
+
+    with stage("interpret.cleanup"):
+        final_response = clean_response(final_response)
 
     # --- Translation ---
-    if language.lower() != "english":
-        dest_lang = LANGUAGE_MAP.get(language.lower(), "en")
-        try:
-            translated = translator.translate(final_response, dest=dest_lang)
-            final_response = translated.text
-        except Exception:
-            final_response += "\n\n(Note: Translation to your selected language failed.)"
+    with stage("interpret.translate"):
+        final_response, translated = translate_text(final_response, language, generated=result.ok)
+    if not translated:
+        final_response += TRANSLATION_FAILED_NOTE
 
     return f"{greeting}\n\n{final_response}"
 
+
+def stream_health_response(username, content, mode="report", language="english"):
+    """SSE variant of generate_health_response.
+
+    Emits `greeting` first, then `chunk` events as the model streams (greeting lines
+    filtered on the fly; non-English output translated one sentence at a time), and
+    finally `done` with the full response text.
+    """
+    greeting = build_greeting(username)
+    yield sse_event("greeting", {"text": greeting})
+
+    logging.info(f"🧠 Streaming response (REST API) | Mode: {mode}")
+    cache_key = interpret_cache_key(content, mode, language)
+    prompt = build_prompt(content, mode, language)
+    stream = gemini.stream(prompt, cache=response_cache, cache_key=cache_key)
+    greetings = GreetingFilter()
+    # Native backends stream the target language already; otherwise translate whole sentences
+    sentences = SentenceBuffer() if language.lower() != "english" and not translation.native else None
+    parts = []
+    translation_failed = False
+
+    def emit(text):
+        nonlocal translation_failed
+        if sentences is None:
+            pieces = [text]
+        else:
+            pieces = []
+            for sentence in sentences.feed(text) if text else sentences.flush():
+                with stage("interpret.translate"):
+                    translated, ok = translate_text(sentence, language)
+                translation_failed |= not ok
+                # Keep the sentence's own trailing whitespace/newlines after translation
+                pieces.append(translated.rstrip() + sentence[len(sentence.rstrip()):] if ok else sentence)
+        for piece in pieces:
+            if piece:
+                parts.append(piece)
+                yield sse_event("chunk", {"text": piece})
+
+    for chunk in stream:
+        yield from emit(greetings.feed(chunk))
+    yield from emit(greetings.flush())
+    if sentences is not None:
+        yield from emit("")
+
+    result = stream.result
+    if result.ok:
+        logging.info(f"✅ Gemini stream finished from {result.model}.")
+    elif not parts:
+        # Nothing reached the client; serve the same fallback text as the JSON path
+        text, translated = translate_text(clean_response(fallback_response(result)), language)
+        translation_failed |= not translated
+        parts.append(text)
+        yield sse_event("chunk", {"text": text})
+
+    final_response = "".join(parts).strip()
+    if translation_failed:
+        final_response += TRANSLATION_FAILED_NOTE
+        yield sse_event("chunk", {"text": TRANSLATION_FAILED_NOTE})
+    yield sse_event("done", {"response": f"{greeting}\n\n{final_response}"})
+
+
+def wants_stream(data):
+    flag = str(data.get("stream", "")).lower() in ("true", "1", "yes")
+    accept = request.accept_mimetypes
+    return flag or accept.best_match(["application/json", "text/event-stream"]) == "text/event-stream"
+
 # ----------------------------------
 # API Endpoint: /interpret
 # ----------------------------------
@@ -197,6 +276,13 @@ def interpret():
                 logging.warning("⚠️ Invalid JSON in predictions; using raw text.")
                 content = raw_preds or "No diagnostic data provided."
 
+        if wants_stream(data):
+            return Response(
+                stream_with_context(stream_health_response(username, content, mode, language)),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
         response_text = generate_health_response(username, content, mode, language)
         logging.info("✅ Successfully generated interpreter response.")
         return jsonify({"response": response_text})
@@ -206,6 +292,14 @@ def interpret():
         return jsonify({"error": str(e)}), 500
 
 
+# ----------------------------------
+# Stats Endpoint
+# ----------------------------------
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({"llm_cache": response_cache.stats(), "translation": translation.stats(), "gemini": gemini.stats()})
+
+
 # ----------------------------------
 # Health Check Endpoint
 # ----------------------------------
@@ -220,7 +314,8 @@ def home():
                     "language": "english/telugu/hindi",
                     "type": "report/chat",
                     "predictions": "JSON (for report)",
-                    "query": "string (for chat)"
+                    "query": "string (for chat)",
+                    "stream": "true for Server-Sent Events (or Accept: text/event-stream)"
                 }
             }
         }
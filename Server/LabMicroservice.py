@@ -1,32 +1,130 @@
 # Lab Microservice
-from flask import Flask, request, jsonify
-import os, logging
+from flask import Flask, Response, request, jsonify, stream_with_context
+import os, time, logging, threading
+import numpy as np
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import fitz  # PyMuPDF
 import easyocr
 import google.generativeai as genai
 from flask import Flask
 from flask_cors import CORS
+from lab_extraction import ExtractionPipeline
+from lab_values import extract_lab_values, format_table, remaining_text
+from gemini_client import FORBIDDEN, QUOTA, build_response_cache, get_client
+from instrumentation import count, install_metrics, observe, stage
+from jobs import JobQueue, QueueFull, accepted_response, install_job_routes, queue_full_response, validate_callback_url
+from result_cache import make_key
+from serving import compute_threads, register_shutdown, under_gunicorn
+from streaming import sse_event
 # ----------------- Setup -----------------
 app = Flask(__name__)
 CORS(app)
+install_metrics(app, "lab")
 UPLOAD_FOLDER = './uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploads are processed in memory; bound what a single request/file may hold
+MAX_REQUEST_BYTES = int(os.getenv("LAB_MAX_REQUEST_BYTES", 50 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+MAX_FILE_BYTES = int(os.getenv("LAB_MAX_FILE_BYTES", 20 * 1024 * 1024))
 
 logging.basicConfig(level=logging.INFO)
 
-# Lazy load EasyOCR
+# EasyOCR reader (one per process, built once)
+# OCR_PRELOAD:
+#   background - load + warm up in a thread at startup; /ready flips once done (default)
+#   sync       - load the weights at import time, i.e. before gunicorn forks with GUNICORN_PRELOAD=1,
+#                so workers share them copy-on-write; each process warms up after the fork
+#   off        - load lazily on the first /parse; /ready then only means "process up" (see readiness_check)
+OCR_PRELOAD = os.getenv("OCR_PRELOAD", "background").lower()
+# A failed warm-up is tried again by the next /ready probe, at most this often
+OCR_WARMUP_RETRY_S = float(os.getenv("OCR_WARMUP_RETRY_S", 30))
 ocr_reader = None
+ocr_lock = threading.Lock()
+ocr_state = {"loaded": False, "warmed": False, "error": None, "attempts": 0}
+ocr_warmup_pid = None
+ocr_warmup_thread = None
+ocr_warmup_failed_at = None
+
+# OCR_WORKERS pages run at once, each using OCR_TORCH_THREADS; under gunicorn together they use this
+# worker's CPU share, a single app.run process leaves torch at its own default
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", min(4, compute_threads())))
+OCR_TORCH_THREADS = int(os.getenv("OCR_TORCH_THREADS") or 0) or (
+    max(1, compute_threads() // OCR_WORKERS) if under_gunicorn() else None)
+
+def set_torch_threads():
+    if OCR_TORCH_THREADS is None:
+        return
+    try:
+        import torch
+        torch.set_num_threads(OCR_TORCH_THREADS)
+    except Exception as e:
+        logging.warning(f"⚠️ Could not set torch threads: {e}")
 
 def get_ocr_reader():
     global ocr_reader
     if ocr_reader is None:
-        logging.info("⏳ Loading EasyOCR model... (might take a moment)")
-        ocr_reader = easyocr.Reader(['en'])
-        logging.info("✅ EasyOCR model loaded.")
+        with ocr_lock:
+            # Re-check under the lock so concurrent first requests build only one reader
+            if ocr_reader is None:
+                logging.info("⏳ Loading EasyOCR model... (might take a moment)")
+                set_torch_threads()
+                ocr_reader = easyocr.Reader(['en'])
+                ocr_state["loaded"] = True
+                logging.info("✅ EasyOCR model loaded.")
     return ocr_reader
 
+def warm_up_ocr():
+    global ocr_warmup_failed_at
+    try:
+        reader = get_ocr_reader()
+        # One tiny inference initializes the detector/recognizer kernels and thread pools
+        reader.readtext(np.full((64, 256), 255, dtype=np.uint8), detail=0)
+        ocr_state.update(warmed=True, error=None)
+        logging.info("🔥 EasyOCR warm-up complete.")
+    except Exception as e:
+        ocr_state["error"] = str(e)
+        ocr_warmup_failed_at = time.monotonic()
+        logging.exception(f"EasyOCR warm-up failed (retrying in {OCR_WARMUP_RETRY_S:g}s):")
+
+def start_ocr_warmup():
+    global ocr_warmup_pid, ocr_warmup_thread, ocr_warmup_failed_at
+    ocr_warmup_pid = os.getpid()
+    ocr_warmup_failed_at = None
+    ocr_state["warmed"] = False
+    ocr_state["attempts"] += 1
+    ocr_warmup_thread = threading.Thread(target=warm_up_ocr, name="ocr-warmup", daemon=True)
+    ocr_warmup_thread.start()
+
+def ensure_ocr_warmup():
+    if OCR_PRELOAD == "off":
+        return
+    if ocr_warmup_pid != os.getpid():
+        # Covers processes that imported the app without forking afterwards
+        start_ocr_warmup()
+    elif (ocr_warmup_failed_at is not None and not ocr_warmup_thread.is_alive()
+          and time.monotonic() - ocr_warmup_failed_at >= OCR_WARMUP_RETRY_S):
+        # A failed load (e.g. weights download timed out) would otherwise keep the worker unready for good
+        start_ocr_warmup()
+
+def reset_ocr_after_fork():
+    # gunicorn preload_app may fork while the parent's warm-up thread holds ocr_lock mid-load.
+    # That thread doesn't exist in the child, so the child would wait on the lock forever:
+    # give it a fresh lock, keep the reader only if it was fully built, and warm it up again.
+    global ocr_lock
+    ocr_lock = threading.Lock()
+    ocr_state.update(loaded=ocr_reader is not None, warmed=False, error=None, attempts=0)
+    if OCR_PRELOAD != "off":
+        start_ocr_warmup()
+
+os.register_at_fork(after_in_child=reset_ocr_after_fork)
+
+if OCR_PRELOAD == "sync":
+    # Forked workers inherit the weights but not the parent's threads; each one warms up after the fork
+    get_ocr_reader()
+elif OCR_PRELOAD == "background":
+    start_ocr_warmup()
+
 # Load API Key from Environment
 from dotenv import load_dotenv
 load_dotenv()
@@ -35,76 +133,196 @@ if not API_KEY:
     logging.warning("⚠️ API_KEY not found in environment variables. Gemini features will fail.")
 
 genai.configure(api_key=API_KEY)
+gemini = get_client(API_KEY)
+# Summaries for identical report text; bump the version when the prompt changes
+PROMPT_TEMPLATE_VERSION = "lab-summary-v2"
+summary_cache = build_response_cache("lab-summary-cache")
 
 # ----------------- OCR -----------------
+# PDF pages with a native text layer skip OCR; scanned pages and images are OCRed on a worker pool
+extraction = ExtractionPipeline(
+    get_ocr_reader,
+    max_workers=OCR_WORKERS,
+    dpi=int(os.getenv("OCR_DPI", 200)),
+    max_dpi=int(os.getenv("OCR_MAX_DPI", 300)),
+    max_page_pixels=int(os.getenv("OCR_MAX_PAGE_PIXELS", 4_000_000)),
+    min_text_chars=int(os.getenv("PDF_MIN_TEXT_CHARS", 20)),
+    # OCR_BATCH_SIZE > 1 batches pages/images across files and concurrent requests
+    batch_size=int(os.getenv("OCR_BATCH_SIZE", 1)),
+    batch_wait_ms=float(os.getenv("OCR_BATCH_WAIT_MS", 20)),
+    recognition_batch_size=int(os.getenv("OCR_RECOGNITION_BATCH_SIZE", 8)),
+    spool_dir=UPLOAD_FOLDER,
+    # Rasterized pages per PDF waiting for OCR; defaults to max(OCR_WORKERS, OCR_BATCH_SIZE)
+    pages_in_flight=int(os.getenv("OCR_PAGES_IN_FLIGHT", 0)) or None,
+)
+
+register_shutdown("ocr-pipeline", extraction.shutdown)
+
+# ----------------- Async Jobs -----------------
+# POST /jobs/parse answers at once; a bounded pool runs OCR + summary, extra submissions get a 503
+jobs = JobQueue(
+    "lab-jobs",
+    max_workers=int(os.getenv("LAB_JOB_WORKERS", 2)),
+    max_pending=int(os.getenv("LAB_JOB_QUEUE", 32)),
+)
+install_job_routes(app, jobs)
+register_shutdown("lab-jobs", jobs.shutdown)
+
 def extract_text(file_path):
-    ext = os.path.splitext(file_path)[1].lower()
-    text = ""
-    if ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
-        reader = get_ocr_reader()
-        res = reader.readtext(file_path, detail=0)
-        text = "\n".join(res) if res else "[No text]"
-    else:  # PDF
-        with fitz.open(file_path) as doc:
-            for page in doc:
-                text += page.get_text() + "\n"
-    return text
+    with stage("lab.extract"):
+        return extraction.extract(file_path)
+
+def extract_uploads(files):
+    """OCR/text-extract uploaded files; returns (combined_text, diagnostics).
+
+    `files` are werkzeug FileStorage objects or (bytes, filename) pairs.
+    """
+    combined_text = ""
+    diagnostics = {}
+
+    # Read each upload straight from the (spooled) request stream; nothing is written to ./uploads
+    uploads = []
+    read_start = time.perf_counter()
+    for f in files:
+        if isinstance(f, tuple):
+            data, filename = f[0], secure_filename(f[1])
+        else:
+            filename = secure_filename(f.filename)
+            data = f.stream.read(MAX_FILE_BYTES + 1)
+        if len(data) > MAX_FILE_BYTES:
+            logging.error(f"❌ {filename} exceeds {MAX_FILE_BYTES} bytes")
+            diagnostics[filename] = {"status": "failed", "error": f"File exceeds {MAX_FILE_BYTES} byte limit"}
+            continue
+        logging.info(f"📄 Read {filename} ({len(data)} bytes) into memory")
+        uploads.append((data, filename))
+    observe("lab.read_uploads", (time.perf_counter() - read_start) * 1000.0)
+
+    # Pages of all files are OCRed concurrently; results come back in upload order
+    with stage("lab.extract"):
+        results = extraction.extract_many(uploads)
+
+    for (_, filename), txt in zip(uploads, results):
+        if isinstance(txt, Exception):
+            logging.error(f"❌ Error processing {filename}: {txt}")
+            diagnostics[filename] = {"status": "failed", "error": str(txt)}
+            continue
+        combined_text += f"\n=== {filename} ===\n{txt}\n"
+        diagnostics[filename] = {"status": "success", "text_length": len(txt)}
+
+    return combined_text, diagnostics
 
 # ----------------- Gemini Analysis -----------------
-def summarize_with_gemini(text):
-    import requests
-    import json
+# Use the same model as Interpreter for consistency
+SUMMARY_MODEL = "gemini-flash-latest"
 
-    prompt = f"""
+# Cap on the report text sent alongside (or, with no parsed values, instead of) the table
+SUMMARY_TEXT_CHARS = 5000
+
+def build_summary_prompt(text):
+    # Parsed values from every page go in a table, out-of-range ones flagged. Everything the
+    # parser did not turn into a row (unknown analytes, repeats, comments, impressions) follows it.
+    with stage("lab.values"):
+        values = extract_lab_values(text)
+    if not values:
+        return f"""
     You are a medical assistant. Summarize key points of this report in simple terms:
 
-    {text[:5000]}
+    {text[:SUMMARY_TEXT_CHARS]}
     """
+    prompt = f"""
+    You are a medical assistant. Summarize key points of this lab report in simple terms.
+    Values flagged H (high) or L (low) are outside the reference range.
+    Ranges marked "default" were not printed on the report. They are generic adult ranges that
+    do not account for sex or age, so treat flags against them as tentative.
 
-    # Use the same model as Interpreter for consistency
-    model_name = "gemini-flash-latest"
+    {format_table(values)}
+    """
+    rest = remaining_text(text, values)
+    if rest:
+        prompt += f"""
+    Other report text (results not in the table, comments and impressions):
 
-    try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={API_KEY}"
-        headers = {'Content-Type': 'application/json'}
-        data = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }]
-        }
-
-        # Timeout 30s
-        logging.info(f"🧪 Generating summary using {model_name} (REST API)")
-        response = requests.post(url, headers=headers, json=data, timeout=30)
-
-        if response.status_code == 200:
-            result = response.json()
-            try:
-                summary = result['candidates'][0]['content']['parts'][0]['text']
-                logging.info("✅ Lab Summary Received")
-                return summary
-            except (KeyError, IndexError):
-                return "[Error Parsing AI Response]"
-
-        elif response.status_code == 403:
-            logging.error("❌ API Key Leaked/Invalid (403)")
-            return "**[System Error]** Your API Key is invalid or leaked. Please update it in Server/.env."
-
-        elif response.status_code == 429:
-            logging.warning("⚠️ Quota Exceeded (429). Returning Mock Summary.")
-            return (
-                "**[Simulated Summary]**\n"
-                "This report appears to show values within standard reference ranges. "
-                "No critical abnormalities detected in this simulated check.\n"
-                "*(Real AI analysis is temporarily unavailable due to quota limits.)*"
-            )
-        else:
-            logging.error(f"❌ Gemini REST failed: {response.status_code} - {response.text}")
-            return f"[AI Service Error: {response.status_code}]"
+    {rest[:SUMMARY_TEXT_CHARS]}
+    """
+    return prompt
 
-    except Exception as e:
-        logging.exception("Gemini REST Request failed:")
-        return f"[Connection Error: {str(e)}]"
+def summary_cache_key(prompt):
+    return make_key("lab-summary", PROMPT_TEMPLATE_VERSION, SUMMARY_MODEL, prompt)
+
+def summary_fallback(result):
+    """Text returned in place of a summary when Gemini gave no usable answer."""
+    if result.status == FORBIDDEN:
+        logging.error("❌ API Key Leaked/Invalid (403)")
+        count("lab.mock_summary.forbidden")
+        return "**[System Error]** Your API Key is invalid or leaked. Please update it in Server/.env."
+
+    elif result.status == QUOTA:
+        logging.warning("⚠️ Quota Exceeded (429). Returning Mock Summary.")
+        count("lab.mock_summary.quota")
+        return (
+            "**[Simulated Summary]**\n"
+            "This report appears to show values within standard reference ranges. "
+            "No critical abnormalities detected in this simulated check.\n"
+            "*(Real AI analysis is temporarily unavailable due to quota limits.)*"
+        )
+    count("lab.mock_summary.error")
+    if result.status_code == 200:
+        return "[Error Parsing AI Response]"
+    elif result.status_code is not None:
+        logging.error(f"❌ Gemini REST failed: {result.status_code} - {result.error}")
+        return f"[AI Service Error: {result.status_code}]"
+    else:
+        logging.error(f"❌ Gemini REST Request failed: {result.error}")
+        return f"[Connection Error: {result.error}]"
+
+def summarize_with_gemini(text):
+    prompt = build_summary_prompt(text)
+
+    logging.info(f"🧪 Generating summary using {SUMMARY_MODEL} (REST API)")
+    with stage("lab.summarize"):
+        result = gemini.generate(prompt, models=[SUMMARY_MODEL], cache=summary_cache, cache_key=summary_cache_key(prompt))
+
+    if result.ok:
+        logging.info("✅ Lab Summary Received")
+        return result.text
+    return summary_fallback(result)
+
+def stream_summary(text):
+    """Yields summary chunks as Gemini produces them; falls back to the same texts as summarize_with_gemini."""
+    prompt = build_summary_prompt(text)
+
+    logging.info(f"🧪 Streaming summary using {SUMMARY_MODEL} (REST API)")
+    stream = gemini.stream(prompt, models=[SUMMARY_MODEL], cache=summary_cache, cache_key=summary_cache_key(prompt))
+    streamed = False
+    for chunk in stream:
+        streamed = True
+        yield chunk
+
+    if stream.result.ok:
+        logging.info("✅ Lab Summary Streamed")
+    elif not streamed:
+        yield summary_fallback(stream.result)
+
+def stream_parse_response(message, text, **fields):
+    """SSE body for /parse: the OCR outcome first, then summary chunks, then the full result."""
+    yield sse_event("diagnostics", {"message": message, **fields})
+    parts = []
+    for chunk in stream_summary(text):
+        parts.append(chunk)
+        yield sse_event("chunk", {"text": chunk})
+    yield sse_event("done", {"message": message, **fields, "summary": "".join(parts)})
+
+def parse_response(message, text, **fields):
+    # ?stream=true (or Accept: text/event-stream) streams the summary as Server-Sent Events
+    flag = (request.values.get("stream") or "").lower() in ("true", "1", "yes")
+    accept = request.accept_mimetypes.best_match(["application/json", "text/event-stream"])
+    if flag or accept == "text/event-stream":
+        return Response(
+            stream_with_context(stream_parse_response(message, text, **fields)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    return jsonify({"message": message, **fields, "summary": summarize_with_gemini(text)})
 
 # ----------------- Route -----------------
 @app.route('/parse', methods=['POST'])
@@ -118,12 +336,7 @@ def parse():
         if not os.path.exists(file_path):
             return jsonify({"error": f"File not found: {file_path}"}), 400
         text = extract_text(file_path)
-        summary = summarize_with_gemini(text)
-        return jsonify({
-            "message": "Parsed successfully (from path)",
-            "file": file_path,
-            "summary": summary
-        })
+        return parse_response("Parsed successfully (from path)", text, file=file_path)
 
     # 🔹 Case 2: Client directly uploads files (Preferred for Microservices)
     if 'files' not in request.files:
@@ -133,36 +346,62 @@ def parse():
     files = request.files.getlist('files')
     logging.info(f"📥 Received {len(files)} files via upload")
 
-    combined_text = ""
-    diagnostics = {}
+    combined_text, diagnostics = extract_uploads(files)
+    return parse_response("Parsed successfully (uploaded)", combined_text, diagnostics=diagnostics)
 
-    for f in files:
-        filename = secure_filename(f.filename)
-        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        logging.info(f"💾 Saving file to: {path}")
-        f.save(path)
-        try:
-            txt = extract_text(path)
-            combined_text += f"\n=== {filename} ===\n{txt}\n"
-            diagnostics[filename] = {"status": "success", "text_length": len(txt)}
-            # Cleanup
-            if os.path.exists(path):
-                os.remove(path)
-        except Exception as e:
-            logging.error(f"❌ Error processing {filename}: {e}")
-            diagnostics[filename] = {"status": "failed", "error": str(e)}
-
-    summary = summarize_with_gemini(combined_text)
-    return jsonify({
+def parse_job(uploads):
+    combined_text, diagnostics = extract_uploads(uploads)
+    return {
         "message": "Parsed successfully (uploaded)",
         "diagnostics": diagnostics,
-        "summary": summary
-    })
+        "summary": summarize_with_gemini(combined_text),
+    }
+
+@app.route('/jobs/parse', methods=['POST'])
+def submit_parse_job():
+    # Same multipart 'files' as /parse, plus an optional 'callback_url' that receives the finished job
+    if 'files' not in request.files:
+        return jsonify({"error": "No files provided"}), 400
+    callback_url = request.values.get('callback_url')
+    invalid = callback_url and validate_callback_url(callback_url)
+    if invalid:
+        return jsonify({"error": invalid}), 400
+
+    # The request stream is gone once we return, so the job gets the bytes
+    files = request.files.getlist('files')
+    uploads = [(f.stream.read(MAX_FILE_BYTES + 1), f.filename) for f in files]
+    try:
+        job = jobs.submit("parse", parse_job, uploads, callback_url=callback_url)
+    except QueueFull as e:
+        logging.warning(f"⚠️ /jobs/parse rejected: {e}")
+        return queue_full_response(e)
+    logging.info(f"📥 Queued parse job {job['job_id']} ({len(uploads)} files)")
+    return accepted_response(job, retry_after=5)
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"error": f"Request body exceeds {MAX_REQUEST_BYTES} bytes."}), 413
+
+@app.route('/stats')
+def stats():
+    return jsonify({"ocr": extraction.stats(), "llm_cache": summary_cache.stats(), "gemini": gemini.stats(), "jobs": jobs.stats()})
+
+@app.route('/ready')
+def readiness_check():
+    # Unlike '/', this only succeeds once the OCR model is loaded and warmed up.
+    # With OCR_PRELOAD=off nothing loads the reader before the first /parse, so gating on it would
+    # keep the worker out of rotation forever: there /ready only means "process up", and the body's
+    # "loaded" says whether the first /parse will pay for loading the model.
+    ensure_ocr_warmup()
+    ready = ocr_state["warmed"] or OCR_PRELOAD == "off"
+    body = {"ready": ready, "ocr_preload": OCR_PRELOAD, **ocr_state}
+    return jsonify(body), 200 if ready else 503
 
 @app.route('/')
 def health_check():
     return "Lab Microservice is running", 200
 
 if __name__ == "__main__":
+    ensure_ocr_warmup()
     port = int(os.environ.get("PORT", 5001))
     app.run(host="0.0.0.0", port=port, debug=os.environ.get("FLASK_DEBUG", "False") == "True")
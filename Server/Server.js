@@ -219,11 +219,39 @@ app.post(
 
     try {
       let microResponse = null;
+      let interpreted = null;
+      const ANALYZE_URL = process.env.ANALYZE_URL?.replace(/\/$/, "");
+
+      // ======================================
+      // 🧩 IN-PROCESS PIPELINE (optional)
+      // ======================================
+      // With ANALYZE_URL set, one call to AnalysisService runs the model and the
+      // interpretation in the same Python process instead of two service hops
+      if (ANALYZE_URL) {
+        console.log("🧩 [ANALYZE] Calling analysis service at:", `${ANALYZE_URL}/analyze`);
+        const analyzeForm = new FormData();
+        analyzeForm.append(type === "xray" ? "xray" : "files", fs.createReadStream(req.file.path), req.file.originalname);
+        analyzeForm.append("username", req.user.name || "User");
+        analyzeForm.append("language", language || "english");
+
+        const analyzeResponse = await axios.post(`${ANALYZE_URL}/analyze`, analyzeForm, {
+          headers: analyzeForm.getHeaders(),
+          maxBodyLength: Infinity,
+          maxContentLength: Infinity,
+          timeout: 180000,
+        });
+        const branch = analyzeResponse.data[type === "xray" ? "xray" : "lab"] || {};
+        if (branch.error) throw new Error(branch.error);
+        const { interpretation, ...raw } = branch;
+        microResponse = raw;
+        interpreted = { response: interpretation };
+        console.log("✅ [ANALYZE] Stage timings (ms):", analyzeResponse.data.timings_ms);
+      }
 
       // ======================================
       // 🧠 X-RAY HANDLER
       // ======================================
-      if (type === "xray") {
+      else if (type === "xray") {
         console.log("🧠 [X-RAY] Preparing to call microservice...");
 
         const filePath = req.file.path;
@@ -310,20 +338,22 @@ app.post(
       // ======================================
       // 🧠 INTERPRETER CALL
       // ======================================
-      console.log("🧠 [INTERPRETER] Sending data for interpretation...");
-      const INTERPRETER_URL =
-        process.env.INTERPRETER_URL?.replace(/\/$/, "") || "";
-
-      const formData2 = new FormData();
-      formData2.append("username", req.user.name || "User");
-      formData2.append("language", language || "english");
-      formData2.append("predictions", JSON.stringify(microResponse));
-
-      const interpreted = await safePost(
-        `${INTERPRETER_URL}/interpret`,
-        formData2,
-        formData2.getHeaders()
-      );
+      if (!interpreted) {
+        console.log("🧠 [INTERPRETER] Sending data for interpretation...");
+        const INTERPRETER_URL =
+          process.env.INTERPRETER_URL?.replace(/\/$/, "") || "";
+
+        const formData2 = new FormData();
+        formData2.append("username", req.user.name || "User");
+        formData2.append("language", language || "english");
+        formData2.append("predictions", JSON.stringify(microResponse));
+
+        interpreted = await safePost(
+          `${INTERPRETER_URL}/interpret`,
+          formData2,
+          formData2.getHeaders()
+        );
+      }
 
       console.log("✅ [INTERPRETER] Response:", interpreted);
 
@@ -389,6 +419,33 @@ app.post("/interpret", authMiddleware, async (req, res) => {
   console.log("🧠 /interpret proxy called");
   try {
     const INTERPRETER_URL = process.env.INTERPRETER_URL?.replace(/\/$/, "") || "";
+    const wantsStream =
+      [true, "true", "1"].includes(req.body?.stream) ||
+      (req.headers.accept || "").includes("text/event-stream");
+    if (wantsStream) {
+      // Pipe Server-Sent Events through unbuffered so the first tokens reach the client immediately
+      const upstream = await axios.post(`${INTERPRETER_URL}/interpret`, req.body, {
+        responseType: "stream",
+        headers: { Accept: "text/event-stream" },
+      });
+      res.set({
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+      });
+      res.flushHeaders();
+      upstream.data.pipe(res);
+      // res "close" fires when the client goes away (req "close" only means the body was read);
+      // stop reading from the interpreter then, so it can abandon the generation
+      res.on("close", () => upstream.data.destroy());
+      upstream.data.on("error", (err) => {
+        console.error("❌ Interpreter stream error:", err.message);
+        if (!res.writableEnded && !res.destroyed) {
+          res.end(`event: error\ndata: ${JSON.stringify({ error: "Interpreter stream failed" })}\n\n`);
+        }
+      });
+      return;
+    }
     // Forward the request body directly to the Python service
     const response = await axios.post(`${INTERPRETER_URL}/interpret`, req.body);
     res.json(response.data);
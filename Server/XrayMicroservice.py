@@ -1,135 +1,412 @@
 # x ray
 import os
+import base64
+import hashlib
 import logging
-import requests
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from flask import Flask, request, jsonify
-import tensorflow as tf
-from tensorflow.keras.models import load_model
+from werkzeug.exceptions import RequestEntityTooLarge
+from inference_batcher import MicroBatcher
+from instrumentation import install_metrics, stage
+from jobs import JobQueue, QueueFull, accepted_response, install_job_routes, queue_full_response, validate_callback_url
+from model_cache import ModelCache
+from result_cache import build_cache, make_key
+from serving import compute_threads, register_shutdown, under_gunicorn
+from xray_backends import load_backend
+from xray_preprocessing import allocate_batch, preprocess_image, preprocess_into
 
 # ------------------ Logging ------------------
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("MEDISCOPE_Server")
 
 # ------------------ Model URLs ------------------
-MODEL_HF_H5_URL = "https://huggingface.co/Nikhil2104/x-ray-predictor/resolve/main/final_best_model.h5"
-MODEL_HF_KERAS_URL = "https://huggingface.co/Nikhil2104/MEDISCOPE/resolve/main/final_best_model.keras"
-LOCAL_H5_PATH = "/tmp/final_best_model.h5"
-LOCAL_KERAS_PATH = "/tmp/final_best_model.keras"
+MODEL_HF_H5_URL = os.environ.get("MODEL_HF_H5_URL", "https://huggingface.co/Nikhil2104/x-ray-predictor/resolve/main/final_best_model.h5")
+MODEL_HF_KERAS_URL = os.environ.get("MODEL_HF_KERAS_URL", "https://huggingface.co/Nikhil2104/MEDISCOPE/resolve/main/final_best_model.keras")
+
+# ------------------ Model Cache ------------------
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "/tmp")
+# Pin expected checksums to verify downloads; unpinned files are verified against their download-time sidecar
+MODEL_KERAS_SHA256 = os.environ.get("MODEL_KERAS_SHA256") or None
+MODEL_H5_SHA256 = os.environ.get("MODEL_H5_SHA256") or None
+# MEDISCOPE_OFFLINE=1: only use files already in MODEL_CACHE_DIR, never touch the network
+MEDISCOPE_OFFLINE = os.environ.get("MEDISCOPE_OFFLINE", "0").lower() in ("1", "true", "yes")
+
+# ------------------ Batching Config ------------------
+BATCH_MAX_SIZE = int(os.environ.get("XRAY_BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("XRAY_BATCH_MAX_WAIT_MS", 10))
+MAX_IMAGES_PER_REQUEST = int(os.environ.get("XRAY_MAX_IMAGES_PER_REQUEST", 16))
+DECODE_WORKERS = int(os.environ.get("XRAY_DECODE_WORKERS", min(4, compute_threads())))
+# Request bodies are read into memory (and queued jobs hold theirs); bound what a request/image may hold
+MAX_REQUEST_BYTES = int(os.environ.get("XRAY_MAX_REQUEST_BYTES", 100 * 1024 * 1024))
+MAX_IMAGE_BYTES = int(os.environ.get("XRAY_MAX_IMAGE_BYTES", 20 * 1024 * 1024))
+
+# ------------------ Thread Config ------------------
+# TF math threads per worker process; under gunicorn the default splits the CPUs evenly across
+# workers, a single app.run process keeps 4 intra-op / 4 inter-op threads
+XRAY_NUM_THREADS = int(os.environ.get("XRAY_NUM_THREADS") or compute_threads(default=4))
+XRAY_INTER_OP_THREADS = int(os.environ.get("XRAY_INTER_OP_THREADS")
+                            or (min(2, XRAY_NUM_THREADS) if under_gunicorn() else 4))
+
+# ------------------ Backend Config ------------------
+# keras | tflite | onnx | savedmodel (non-Keras backends convert the model once and reuse the artifact)
+XRAY_BACKEND = os.environ.get("XRAY_BACKEND", "keras")
+XRAY_BACKEND_ARTIFACT = os.environ.get("XRAY_BACKEND_ARTIFACT") or None
+# float | dynamic | float16 | int8 (quantized variants run on the tflite backend; int8 needs calibration images)
+XRAY_MODEL_VARIANT = os.environ.get("XRAY_MODEL_VARIANT", "float")
+XRAY_CALIBRATION_DIR = os.environ.get("XRAY_CALIBRATION_DIR") or None
+
+# ------------------ Prediction Cache Config ------------------
+# Entries are keyed on the image bytes + model version (the cached weights' SHA-256 unless XRAY_MODEL_VERSION is set)
+XRAY_MODEL_VERSION = os.environ.get("XRAY_MODEL_VERSION") or MODEL_KERAS_SHA256 or "final_best_model"
+XRAY_CACHE_MAX_ENTRIES = int(os.environ.get("XRAY_CACHE_MAX_ENTRIES", 1024))
+XRAY_CACHE_TTL = float(os.environ.get("XRAY_CACHE_TTL", 3600))
+# Optional SQLite file shared by all gunicorn workers on the node (empty = memory only)
+XRAY_CACHE_DB = os.environ.get("XRAY_CACHE_DB") or None
+
+# ------------------ Async Job Config ------------------
+# POST /jobs/predict workers and how many more jobs may wait before submissions get a 503
+XRAY_JOB_WORKERS = int(os.environ.get("XRAY_JOB_WORKERS", 4))
+XRAY_JOB_QUEUE = int(os.environ.get("XRAY_JOB_QUEUE", 64))
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+install_metrics(app, "xray")
 
-# ------------------ Helper: Download Model ------------------
-def download_model(url, local_path):
-    try:
-        logger.info(f"🌐 Downloading model from {url} ...")
-        r = requests.get(url, stream=True, timeout=120)
-        r.raise_for_status()
-        with open(local_path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        logger.info(f"✅ Model downloaded to {local_path}")
-        return local_path
-    except Exception as e:
-        logger.error(f"❌ Failed to download model: {e}")
-        return None
+model_cache = ModelCache(MODEL_CACHE_DIR, offline=MEDISCOPE_OFFLINE)
 
 # ------------------ Load Model ------------------
 def load_mediscope_model():
     # Force CPU only
     os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
-    tf.config.threading.set_intra_op_parallelism_threads(4)
-    tf.config.threading.set_inter_op_parallelism_threads(4)
-    logger.info("💡 Running TensorFlow on CPU only.")
-
-    # Try Keras .keras format first
-    if os.path.exists(LOCAL_KERAS_PATH):
-        try:
-            model = load_model(LOCAL_KERAS_PATH, compile=False)
-            logger.info("✅ Loaded model from local .keras file!")
-            return model
-        except Exception as e:
-            logger.warning(f"⚠️ Local .keras load failed: {e}")
-
-    # Download .keras from HF
-    keras_path = download_model(MODEL_HF_KERAS_URL, LOCAL_KERAS_PATH)
-    if keras_path:
-        try:
-            model = load_model(keras_path, compile=False)
-            logger.info("✅ Loaded model from HF .keras file!")
-            return model
-        except Exception as e:
-            logger.warning(f"⚠️ HF .keras load failed: {e}")
-
-    # Fallback: H5 format
-    if os.path.exists(LOCAL_H5_PATH):
-        try:
-            model = load_model(LOCAL_H5_PATH, compile=False)
-            logger.info("✅ Loaded model from local .h5 file!")
-            return model
-        except Exception as e:
-            logger.warning(f"⚠️ Local H5 load failed: {e}")
-
-    h5_path = download_model(MODEL_HF_H5_URL, LOCAL_H5_PATH)
-    if h5_path:
-        try:
-            model = load_model(h5_path, compile=False)
-            logger.info("✅ Loaded model from HF .h5 file!")
-            return model
-        except Exception as e:
-            logger.warning(f"⚠️ HF .h5 load failed: {e}")
+    # Imported here so lighter backends with a converted artifact never load Keras
+    import tensorflow as tf
+    from tensorflow.keras.models import load_model
+    tf.config.threading.set_intra_op_parallelism_threads(XRAY_NUM_THREADS)
+    tf.config.threading.set_inter_op_parallelism_threads(XRAY_INTER_OP_THREADS)
+    logger.info(f"💡 Running TensorFlow on CPU only ({XRAY_NUM_THREADS} intra-op / {XRAY_INTER_OP_THREADS} inter-op threads).")
+
+    # Try Keras .keras format first, then fall back to H5
+    sources = [
+        (MODEL_HF_KERAS_URL, "final_best_model.keras", MODEL_KERAS_SHA256),
+        (MODEL_HF_H5_URL, "final_best_model.h5", MODEL_H5_SHA256),
+    ]
+    for url, filename, sha256 in sources:
+        # A cached file that fails to load is evicted and fetched once more
+        for _ in range(2):
+            path = model_cache.fetch(url, filename, sha256)
+            if not path:
+                break
+            try:
+                model = load_model(path, compile=False)
+                logger.info(f"✅ Loaded model from {path}!")
+                return model
+            except Exception as e:
+                logger.warning(f"⚠️ {filename} load failed: {e}")
+                # Don't let a bad file poison the next cold start
+                model_cache.invalidate(filename)
 
     raise RuntimeError("❌ Unable to load MEDISCOPE model from any source.")
 
-# Load model at startup
-model = load_mediscope_model()
+def model_source_version():
+    """Version of the weights converted backends are built from: pinned, else the cached file's SHA-256."""
+    return (
+        os.environ.get("XRAY_MODEL_VERSION")
+        or MODEL_KERAS_SHA256
+        or model_cache.cached_digest("final_best_model.keras")
+        or model_cache.cached_digest("final_best_model.h5")
+    )
+
+# Load model at startup and run a warm-up pass so the first request doesn't pay for it.
+# Converted artifacts are rebuilt when the source weights change.
+backend = load_backend(
+    XRAY_BACKEND,
+    load_mediscope_model,
+    artifact_path=XRAY_BACKEND_ARTIFACT,
+    variant=XRAY_MODEL_VARIANT,
+    calibration_dir=XRAY_CALIBRATION_DIR,
+    model_version=model_source_version,
+)
+backend.warmup(batch_sizes=(1, BATCH_MAX_SIZE))
+
+def forward(batch):
+    with stage("xray.forward"):
+        return backend.predict(batch)
+
+# All inference goes through one batching worker so concurrent requests share a forward pass
+batcher = MicroBatcher(
+    forward,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    name="xray-batcher",
+)
+
+# Shared pool for decoding/resizing the images of a batch request in parallel
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="xray-decode")
+
+# Results for images we've already seen (retries, re-analysis, shared films)
+prediction_cache = build_cache("xray-prediction-cache", XRAY_CACHE_MAX_ENTRIES, XRAY_CACHE_TTL, XRAY_CACHE_DB)
+MODEL_CACHE_TAG = f"{model_source_version() or XRAY_MODEL_VERSION}:{backend.name}:{XRAY_MODEL_VARIANT}"
+
+# Graceful shutdown: finish queued inferences before the worker exits
+register_shutdown("xray-batcher", batcher.shutdown)
+register_shutdown("xray-decode-pool", decode_pool.shutdown)
+
+# Registered after the batcher so drain() finishes queued jobs before stopping it
+jobs = JobQueue("xray-jobs", max_workers=XRAY_JOB_WORKERS, max_pending=XRAY_JOB_QUEUE)
+install_job_routes(app, jobs)
+register_shutdown("xray-jobs", jobs.shutdown)
+
+# ------------------ Helper: Cache Key ------------------
+def prediction_cache_key(source):
+    """SHA-256 of the encoded image bytes (bytes or seekable stream) + model version."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest = hashlib.sha256(source).hexdigest()
+    else:
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+        source.seek(0)
+        digest = digest.hexdigest()
+    return make_key(MODEL_CACHE_TAG, digest)
+
+# ------------------ Helper: Format Prediction ------------------
+def format_prediction(prediction):
+    # Convert prediction to readable format
+    # This part depends heavily on the specific model's output classes.
+    # Check if model has a mapping, otherwise return raw probabilities or index.
+    # For now, returning the raw prediction list.
+    return {
+        "prediction": prediction.tolist(),
+        "raw_output": str(prediction)
+    }
+
+# ------------------ Prediction ------------------
+def predict_image(source):
+    """Cached single-image prediction; `source` is encoded image bytes or a seekable stream.
+
+    Shared by /predict and the in-process pipeline (orchestrator.py).
+    """
+    with stage("xray.cache_lookup"):
+        cache_key = prediction_cache_key(source)
+        result = prediction_cache.get(cache_key)
+    if result is None:
+        with stage("xray.preprocess"):
+            image_array = preprocess_image(source)
+
+        # Predict (queued into the next micro-batch; we get our own row back)
+        with stage("xray.inference"):
+            prediction = np.expand_dims(batcher.predict(image_array), axis=0)
+        result = format_prediction(prediction)
+        prediction_cache.set(cache_key, result)
+    return result
 
 # ------------------ Flask Endpoint ------------------
-# ------------------ Flask Endpoint ------------------
+def _read_single_image():
+    """Returns (image_source, error_response) for the three accepted /predict formats."""
+    content_type = (request.mimetype or "").lower()
+
+    # 1. Raw binary body (Content-Type: image/png, image/jpeg, ...)
+    if content_type.startswith("image/") or content_type == "application/octet-stream":
+        # BytesIO shares the buffer with the bytes object, so this is the only copy
+        image_data = request.get_data(cache=False)
+        if not image_data:
+            return None, (jsonify({"error": "Empty image body."}), 400)
+        return image_data, None
+
+    # 2. Multipart upload: decode straight from the part's (spooled) stream
+    if content_type == "multipart/form-data":
+        part = request.files.get("file") or request.files.get("image")
+        if part is None:
+            return None, (jsonify({"error": "Missing 'file' part in multipart request."}), 400)
+        return part.stream, None
+
+    # 3. Legacy JSON contract: {"payload": {"image_base64": ...}}
+    data = request.get_json(silent=True)
+    if not data or "payload" not in data:
+        return None, (jsonify({"error": "Invalid request format. Expected JSON with 'payload' key."}), 400)
+
+    payload = data["payload"]
+    if "image_base64" not in payload:
+        return None, (jsonify({"error": "Missing 'image_base64' in payload."}), 400)
+
+    # Decode base64 image
+    with stage("xray.decode_base64"):
+        return base64.b64decode(payload["image_base64"]), None
+
 @app.route("/predict", methods=["POST"])
 def predict():
     try:
-        data = request.get_json()
-        if not data or "payload" not in data:
-            return jsonify({"error": "Invalid request format. Expected JSON with 'payload' key."}), 400
+        source, error = _read_single_image()
+        if error:
+            return error
+
+        result = predict_image(source)
+
+        return jsonify({
+            "message": "Prediction successful",
+            **result
+        }), 200
+
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Prediction error: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        payload = data["payload"]
-        if "image_base64" not in payload:
-             return jsonify({"error": "Missing 'image_base64' in payload."}), 400
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"error": f"Request body exceeds {MAX_REQUEST_BYTES} bytes."}), 413
 
-        # Decode base64 image
-        import base64
-        import io
-        from PIL import Image
-        import numpy as np
+def _image_too_large():
+    return jsonify({"error": f"Image exceeds {MAX_IMAGE_BYTES} bytes."}), 413
 
-        image_data = base64.b64decode(payload["image_base64"])
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
+def predict_job(image_data):
+    return {"message": "Prediction successful", **predict_image(image_data)}
 
-        # Resize to model's expected input size (160x160 for this model)
-        image = image.resize((160, 160))
-        image_array = np.array(image) / 255.0
-        image_array = np.expand_dims(image_array, axis=0)
+@app.route("/jobs/predict", methods=["POST"])
+def submit_predict_job():
+    # Same formats as /predict; an optional callback_url (query or form field) receives the finished job
+    try:
+        callback_url = request.values.get("callback_url")
+        invalid = callback_url and validate_callback_url(callback_url)
+        if invalid:
+            return jsonify({"error": invalid}), 400
+        # A raw body is the image itself: refuse it before reading anything
+        content_type = (request.mimetype or "").lower()
+        raw = content_type.startswith("image/") or content_type == "application/octet-stream"
+        if raw and (request.content_length or 0) > MAX_IMAGE_BYTES:
+            return _image_too_large()
+        source, error = _read_single_image()
+        if error:
+            return error
 
-        # Predict
-        prediction = model.predict(image_array)
+        # The request stream is gone once we return, so the job gets the bytes (at most MAX_IMAGE_BYTES)
+        image_data = source if isinstance(source, (bytes, bytearray)) else source.read(MAX_IMAGE_BYTES + 1)
+        if len(image_data) > MAX_IMAGE_BYTES:
+            return _image_too_large()
+        job = jobs.submit("predict", predict_job, image_data, callback_url=callback_url)
+        return accepted_response(job)
+
+    except RequestEntityTooLarge:
+        raise
+    except QueueFull as e:
+        logger.warning(f"⚠️ /jobs/predict rejected: {e}")
+        return queue_full_response(e)
+    except Exception as e:
+        logger.error(f"❌ Job submission error: {e}")
+        return jsonify({"error": str(e)}), 500
 
-        # Convert prediction to readable format
-        # This part depends heavily on the specific model's output classes.
-        # Check if model has a mapping, otherwise return raw probabilities or index.
-        # For now, returning the raw prediction list.
-        prediction_list = prediction.tolist()
+def _collect_batch_items():
+    """Returns a list of (name, image_source, base64_string) tuples, or None for a bad request."""
+    if request.files:
+        parts = request.files.getlist("files") or request.files.getlist("images")
+        return [(f.filename or f"image_{i}", f.stream, None) for i, f in enumerate(parts)]
 
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get("payloads"), list):
+        return None
+
+    items = []
+    for i, payload in enumerate(data["payloads"]):
+        if not isinstance(payload, dict):
+            payload = {}
+        name = payload.get("view") or f"image_{i}"
+        items.append((name, None, payload.get("image_base64")))
+    return items
+
+def _decode_and_preprocess(source, image_base64, out):
+    """Returns (cache_key, cached_result); `out` is only filled on a cache miss."""
+    if source is None:
+        if not image_base64:
+            raise ValueError("Missing 'image_base64' in payload.")
+        source = base64.b64decode(image_base64)
+    cache_key = prediction_cache_key(source)
+    cached = prediction_cache.get(cache_key)
+    if cached is None:
+        with stage("xray.preprocess"):
+            preprocess_into(source, out)
+    return cache_key, cached
+
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch():
+    try:
+        items = _collect_batch_items()
+        if items is None:
+            return jsonify({"error": "Invalid request format. Expected JSON with a 'payloads' list or multipart 'files' parts."}), 400
+        if not items:
+            return jsonify({"error": "No images provided."}), 400
+        if len(items) > MAX_IMAGES_PER_REQUEST:
+            return jsonify({"error": f"Too many images ({len(items)}); the limit is {MAX_IMAGES_PER_REQUEST}."}), 413
+
+        logger.info(f"🖼️ Batch prediction for {len(items)} images")
+
+        # Every worker writes its image straight into its own row of one float32 batch buffer
+        buffer = allocate_batch(len(items))
+        futures = [
+            decode_pool.submit(_decode_and_preprocess, source, b64, buffer[i])
+            for i, (_, source, b64) in enumerate(items)
+        ]
+
+        results = [None] * len(items)
+        arrays, indices, keys = [], [], []
+        for i, ((name, _, _), future) in enumerate(zip(items, futures)):
+            try:
+                cache_key, cached = future.result()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not decode image {i} ({name}): {e}")
+                results[i] = {"index": i, "name": name, "status": "failed", "error": str(e)}
+                continue
+            if cached is not None:
+                results[i] = {"index": i, "name": name, "status": "success", **cached}
+            else:
+                arrays.append(buffer[i])
+                indices.append(i)
+                keys.append(cache_key)
+
+        # One stacked forward pass for every uncached image that decoded successfully
+        if arrays:
+            try:
+                with stage("xray.inference"):
+                    predictions = batcher.predict_many(arrays)
+                for i, cache_key, row in zip(indices, keys, predictions):
+                    result = format_prediction(np.expand_dims(row, axis=0))
+                    prediction_cache.set(cache_key, result)
+                    results[i] = {
+                        "index": i,
+                        "name": items[i][0],
+                        "status": "success",
+                        **result
+                    }
+            except Exception as e:
+                logger.error(f"❌ Batch forward pass failed: {e}")
+                for i in indices:
+                    results[i] = {"index": i, "name": items[i][0], "status": "failed", "error": str(e)}
+
+        failed = sum(1 for r in results if r["status"] == "failed")
         return jsonify({
-            "message": "Prediction successful",
-            "prediction": prediction_list,
-            "raw_output": str(prediction)
+            "message": "Batch prediction complete",
+            "count": len(results),
+            "failed": failed,
+            "results": results
         }), 200
 
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
-        logger.error(f"❌ Prediction error: {e}")
+        logger.error(f"❌ Batch prediction error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "backend": backend.name,
+        "model_variant": XRAY_MODEL_VARIANT,
+        "batching": batcher.stats(),
+        "cache": prediction_cache.stats(),
+        "jobs": jobs.stats()
+    }), 200
+
 @app.route("/", methods=["GET"])
 def health_check():
     return "Xray Microservice is running", 200
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import time
+
+import easyocr
+
+from lab_extraction import IMAGE_EXTENSIONS, ExtractionPipeline
+
+# Benchmark: per-item vs batched EasyOCR over a local corpus of lab-report scans (images and PDFs)
+# Usage: python bench_ocr.py --corpus ./lab_samples [--batch-sizes 1 4 8] [--recognition-batch-size 8] [--json]
+
+
+def run(reader, paths, batch_size, recognition_batch_size, workers):
+    pipeline = ExtractionPipeline(
+        lambda: reader,
+        max_workers=workers,
+        batch_size=batch_size,
+        recognition_batch_size=recognition_batch_size,
+    )
+    start = time.perf_counter()
+    results = pipeline.extract_many(paths)
+    elapsed = time.perf_counter() - start
+    if pipeline.batcher is not None:
+        pipeline.batcher.shutdown(timeout=5)
+    pipeline.pool.shutdown(wait=True)
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    chars = sum(len(r) for r in results if not isinstance(r, Exception))
+    return {"seconds": round(elapsed, 3), "files": len(paths), "failed": failed, "chars": chars}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EasyOCR batching benchmark")
+    parser.add_argument("--corpus", required=True, help="Directory of lab report images/PDFs")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--recognition-batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.corpus, name) for name in os.listdir(args.corpus)
+        if name.lower().endswith(IMAGE_EXTENSIONS + (".pdf",))
+    )
+    if not paths:
+        raise SystemExit(f"No images or PDFs found in {args.corpus}")
+
+    reader = easyocr.Reader(['en'])
+    # Warm-up so model initialization isn't charged to the first configuration
+    run(reader, paths[:1], 1, 1, args.workers)
+
+    rows = {}
+    # Baseline: the old behaviour (no batching, recognizer batch size 1)
+    rows["baseline"] = run(reader, paths, 1, 1, args.workers)
+    for size in args.batch_sizes:
+        rows[f"batch_{size}"] = run(reader, paths, size, args.recognition_batch_size, args.workers)
+
+    if args.json:
+        print(json.dumps({"corpus": args.corpus, "files": len(paths), "runs": rows}, indent=2))
+        return
+
+    base = rows["baseline"]["seconds"]
+    print(f"{len(paths)} files, {args.workers} workers")
+    print(f"{'config':>10} {'seconds':>8} {'speedup':>8} {'failed':>7} {'chars':>8}")
+    for name, r in rows.items():
+        print(f"{name:>10} {r['seconds']:>8.2f} {base / r['seconds'] if r['seconds'] else 0:>7.2f}x {r['failed']:>7} {r['chars']:>8}")
+
+
+if __name__ == "__main__":
+    main()
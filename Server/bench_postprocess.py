@@ -0,0 +1,128 @@
+import argparse
+import json
+import random
+import time
+
+from text_pipeline import PromptTemplate, strip_greetings
+
+# Benchmark: legacy Interpreter prompt building + greeting cleanup vs text_pipeline
+# Usage: python bench_postprocess.py [--repeat 200] [--json]
+
+PROMPT_TEXT = """
+You are a friendly medical assistant giving conversational wellness guidance.
+
+The patient says:
+-------------------------
+{content}
+-------------------------
+
+Respond with:
+- No greeting at the start.
+- Simple, clear suggestions (no jargon).
+- 2–3 easy home remedies (hydration 💧, rest 😴, herbal tea 🌿).
+- Mention which doctor to consult if needed.
+- Keep under 6 lines, positive and reassuring.
+"""
+PROMPT = PromptTemplate(PROMPT_TEXT)
+
+
+def legacy_prompt(content):
+    # The original per-call f-string
+    return f"""
+You are a friendly medical assistant giving conversational wellness guidance.
+
+The patient says:
+-------------------------
+{content}
+-------------------------
+
+Respond with:
+- No greeting at the start.
+- Simple, clear suggestions (no jargon).
+- 2–3 easy home remedies (hydration 💧, rest 😴, herbal tea 🌿).
+- Mention which doctor to consult if needed.
+- Keep under 6 lines, positive and reassuring.
+"""
+
+
+def legacy_clean(text):
+    # The original two uncompiled passes
+    import re
+    text = re.sub(r"(?i)^\s*(hi|hello|hey)[^a-zA-Z]*", "", text).strip()
+    return re.sub(r"(?i)(^|\n)\s*(hi|hello|hey|dear)[^\n]*\n?", "", text).strip()
+
+
+def make_outputs():
+    rng = random.Random(7)
+    lines = [
+        "Your results look mostly normal 😊.",
+        "Drink plenty of water 💧 and rest 😴.",
+        "1. **Hydration**: 8 glasses a day.",
+        "Consider seeing a **cardiologist** if symptoms persist.",
+        "Dear patient, please take care.",
+        "Hello again!",
+        "",
+    ]
+    typical = "Hello! 👋\n" + "\n".join(lines[:4]) + "\nPlease consult your doctor for confirmation."
+    long_text = "Hi there,\n" + "\n".join(rng.choice(lines) for _ in range(2000))
+    # Many short lines, blank runs and greeting lines: worst case for the multi-line regex
+    many_lines = "\n".join(rng.choice(["hey", "", "  ", "ok.", "Dear x", "a"]) for _ in range(20000))
+    # A long blank run that does not lead into a greeting: the legacy pattern retries from every newline
+    whitespace = "Summary:" + " \n" * 2000 + "Done."
+    return {"typical": typical, "long": long_text, "many_lines": many_lines, "blank_run": whitespace}
+
+
+def time_fn(fn, data, repeat):
+    fn(data)  # warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        samples.append((time.perf_counter() - start) * 1000.0)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interpreter prompt/post-processing benchmark")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    rows = []
+    cases = [("prompt", "typical", legacy_prompt, PROMPT.render, "What helps with a mild headache?")]
+    for name, text in make_outputs().items():
+        cases.append(("cleanup", name, legacy_clean, strip_greetings, text))
+
+    for stage, name, old_fn, new_fn, data in cases:
+        # Long inputs need fewer repeats to get a stable median
+        repeat = args.repeat if len(data) < 10_000 else max(5, args.repeat // 20)
+        old_p50, old_max = time_fn(old_fn, data, repeat)
+        new_p50, new_max = time_fn(new_fn, data, repeat)
+        rows.append({
+            "stage": stage,
+            "case": name,
+            "chars": len(data),
+            "legacy_p50_us": round(old_p50 * 1000, 2),
+            "legacy_max_us": round(old_max * 1000, 2),
+            "new_p50_us": round(new_p50 * 1000, 2),
+            "new_max_us": round(new_max * 1000, 2),
+            "speedup": round(old_p50 / new_p50, 2) if new_p50 else None,
+            "identical": old_fn(data) == new_fn(data),
+        })
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'stage':>8} {'case':>15} {'chars':>8} {'legacy p50':>12} {'new p50':>11} {'speedup':>8} {'same':>5}")
+    for r in rows:
+        print(
+            f"{r['stage']:>8} {r['case']:>15} {r['chars']:>8} "
+            f"{r['legacy_p50_us']:>10.1f}us {r['new_p50_us']:>9.1f}us "
+            f"{r['speedup']:>7.2f}x {str(r['identical']):>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
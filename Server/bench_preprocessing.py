@@ -0,0 +1,90 @@
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from xray_preprocessing import preprocess_image
+
+# Benchmark: legacy X-ray preprocessing vs xray_preprocessing.preprocess_image
+# Usage: python bench_preprocessing.py [--sizes 512 1024 3000] [--repeat 20] [--json]
+
+
+def legacy_preprocess(image_data):
+    # The original /predict pipeline, kept here as the baseline
+    image = Image.open(io.BytesIO(image_data)).convert("RGB")
+    image = image.resize((160, 160))
+    return np.array(image) / 255.0
+
+
+def make_film(side, mode, fmt):
+    # Smooth gradient + noise so JPEG/PNG encoders do realistic amounts of work
+    rng = np.random.default_rng(side)
+    y, x = np.mgrid[0:side, 0:side]
+    base = ((x + y) * (255.0 / (2 * side))).astype(np.float32)
+    base += rng.normal(0, 12, size=base.shape)
+    gray = np.clip(base, 0, 255).astype(np.uint8)
+    image = Image.fromarray(gray, "L")
+    if mode == "RGB":
+        image = image.convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buf.getvalue()
+
+
+def time_fn(fn, data, repeat):
+    fn(data)  # warm-up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        samples.append((time.perf_counter() - start) * 1000.0)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="X-ray preprocessing latency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048, 3000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    rows = []
+    for side in args.sizes:
+        for mode in ("L", "RGB"):
+            for fmt in ("JPEG", "PNG"):
+                data = make_film(side, mode, fmt)
+                old_p50, old_max = time_fn(legacy_preprocess, data, args.repeat)
+                new_p50, new_max = time_fn(preprocess_image, data, args.repeat)
+                # Draft-mode decoding is lossy w.r.t. full decode + resize; report how far apart they are
+                diff = float(np.abs(legacy_preprocess(data) - preprocess_image(data)).max())
+                rows.append({
+                    "size": side,
+                    "mode": mode,
+                    "format": fmt,
+                    "legacy_p50_ms": round(old_p50, 3),
+                    "legacy_max_ms": round(old_max, 3),
+                    "new_p50_ms": round(new_p50, 3),
+                    "new_max_ms": round(new_max, 3),
+                    "speedup": round(old_p50 / new_p50, 2) if new_p50 else None,
+                    "max_abs_diff": round(diff, 5),
+                })
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'size':>6} {'mode':>4} {'fmt':>5} {'legacy p50':>11} {'new p50':>9} {'speedup':>8} {'max diff':>9}")
+    for r in rows:
+        print(
+            f"{r['size']:>6} {r['mode']:>4} {r['format']:>5} "
+            f"{r['legacy_p50_ms']:>9.2f}ms {r['new_p50_ms']:>7.2f}ms "
+            f"{r['speedup']:>7.2f}x {r['max_abs_diff']:>9.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
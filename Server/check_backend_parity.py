@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from xray_backends import ARTIFACT_NAMES, BACKENDS, KerasBackend, load_backend
+from xray_preprocessing import TARGET_SIZE, allocate_batch, preprocess_into
+
+# Parity check: every alternative backend must match the Keras model's outputs
+# Usage: python check_backend_parity.py [--model /tmp/final_best_model.keras] [--images DIR]
+#                                       [--backends tflite onnx savedmodel] [--atol 1e-4]
+
+
+def load_inputs(image_dir, count):
+    if image_dir:
+        paths = sorted(
+            os.path.join(image_dir, name) for name in os.listdir(image_dir)
+            if name.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".tiff"))
+        )[:count]
+        batch = allocate_batch(len(paths))
+        for i, path in enumerate(paths):
+            with open(path, "rb") as f:
+                preprocess_into(f.read(), batch[i])
+        return batch
+    rng = np.random.default_rng(0)
+    return rng.random((count, TARGET_SIZE[1], TARGET_SIZE[0], 3), dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare X-ray backends against the Keras model")
+    parser.add_argument("--model", default="/tmp/final_best_model.keras")
+    parser.add_argument("--images", default=None, help="Directory of sample X-rays (default: random inputs)")
+    parser.add_argument("--count", type=int, default=8)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+
+    model = load_model(args.model, compile=False)
+    reference = KerasBackend(model)
+    inputs = load_inputs(args.images, args.count)
+    expected = reference.predict(inputs)
+
+    report, ok = {}, True
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.backends:
+            try:
+                backend = load_backend(name, lambda: model, os.path.join(workdir, ARTIFACT_NAMES[name]))
+                # Check both a full batch and single-sample calls (exercises dynamic batch sizes)
+                batched = backend.predict(inputs)
+                single = np.concatenate([backend.predict(inputs[i:i + 1]) for i in range(len(inputs))])
+                diff = float(max(np.abs(batched - expected).max(), np.abs(single - expected).max()))
+                passed = diff <= args.atol
+                report[name] = {"max_abs_diff": diff, "passed": passed}
+            except Exception as e:
+                report[name] = {"error": str(e), "passed": False}
+            ok = ok and report[name]["passed"]
+
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+# Shared Gemini REST client: pooled keep-alive connections, concurrency limit, deadlines
+import os
+import re
+import json
+import time
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import count, observe, stage
+from result_cache import make_key
+from serving import worker_processes
+from upstream import CircuitBreaker, SingleFlight, TokenBucket
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+# Primary first, then fallback
+DEFAULT_MODELS = ["gemini-flash-latest", "gemini-pro-latest"]
+
+# Result statuses
+OK = "ok"
+QUOTA = "quota"          # 429: callers serve their simulated response
+FORBIDDEN = "forbidden"  # 403: invalid/leaked key
+ERROR = "error"          # every model failed (HTTP error, bad JSON, timeout, deadline)
+
+# Gemini puts the quota reset in the error body: "retryDelay": "17s"
+_RETRY_DELAY = re.compile(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"')
+
+
+class GeminiResult:
+    def __init__(self, status, text="", model=None, status_code=None, error=None):
+        self.status = status
+        self.text = text
+        self.model = model
+        self.status_code = status_code
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == OK
+
+    def __repr__(self):
+        return f"GeminiResult(status={self.status!r}, model={self.model!r}, status_code={self.status_code!r})"
+
+
+class GeminiClient:
+    """Thread-safe client shared by every request in the process.
+
+    - One requests.Session with a sized connection pool, so TLS connections are reused.
+    - A semaphore caps in-flight upstream calls (`max_concurrency`).
+    - Each attempt gets `attempt_timeout` seconds, and the whole call including
+      fallbacks must finish within `deadline` seconds.
+    - `rate_limiter` (upstream.TokenBucket) spaces calls to the quota; a call that can't
+      get a token within `rate_wait` seconds is answered as QUOTA without going upstream.
+    - Each model has a circuit breaker: models that keep failing are skipped until their
+      cooldown ends, and a 429/403 opens the breaker at once.
+    - Identical concurrent generate() calls share one upstream call.
+    - With `hedge_after` > 0, a primary call still running after that many seconds is
+      raced against the next model; the first usable answer wins.
+    """
+
+    def __init__(self, api_key, base_url=GEMINI_BASE_URL, models=None, max_concurrency=8,
+                 attempt_timeout=30.0, deadline=45.0, pool_size=None, rate_limiter=None, rate_wait=2.0,
+                 breaker_failures=5, breaker_cooldown=30.0, hedge_after=0.0):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.models = list(models or DEFAULT_MODELS)
+        self.attempt_timeout = float(attempt_timeout)
+        self.deadline = float(deadline)
+        self._slots = threading.BoundedSemaphore(max(1, int(max_concurrency)))
+        self.rate_limiter = rate_limiter or TokenBucket(0)
+        self.rate_wait = float(rate_wait)
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        self._flights = SingleFlight()
+        self.hedge_after = max(float(hedge_after), 0.0)
+        # Hedged attempts run here so the caller can wait on either one
+        self._hedge_pool = None
+        if self.hedge_after:
+            self._hedge_pool = ThreadPoolExecutor(max_workers=2 * max(1, int(max_concurrency)),
+                                                  thread_name_prefix="gemini-hedge")
+
+        pool_size = pool_size or max(1, int(max_concurrency))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def _url(self, model_name, method="generateContent"):
+        return f"{self.base_url}/models/{model_name}:{method}?key={self.api_key}"
+
+    @staticmethod
+    def _body(prompt):
+        return {"contents": [{"parts": [{"text": prompt}]}]}
+
+    @staticmethod
+    def _extract_text(result):
+        # Structure: candidates[0].content.parts[0].text
+        return result['candidates'][0]['content']['parts'][0]['text']
+
+    # ------------------ Upstream control ------------------
+    def breaker(self, model_name):
+        breaker = self._breakers.get(model_name)
+        if breaker is None:
+            with self._breakers_lock:
+                breaker = self._breakers.setdefault(
+                    model_name, CircuitBreaker(model_name, self.breaker_failures, self.breaker_cooldown)
+                )
+        return breaker
+
+    @staticmethod
+    def _retry_after(response):
+        """Seconds until the quota resets, from Retry-After or the error body (None if absent)."""
+        header = response.headers.get("Retry-After")
+        if header and header.isdigit():
+            return float(header)
+        match = _RETRY_DELAY.search(response.text or "")
+        return float(match.group(1)) if match else None
+
+    def _record(self, breaker, result, retry_after=None):
+        if result.ok:
+            breaker.record_success()
+        elif result.status in (QUOTA, FORBIDDEN):
+            breaker.trip(result.status, retry_after)
+        else:
+            breaker.record_failure(result.status)
+
+    def _attempt(self, model_name, prompt, end):
+        """One generateContent call to one model. Never raises; returns a GeminiResult."""
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            logging.warning(f"⚠️ Gemini deadline reached before trying {model_name}")
+            return GeminiResult(ERROR, model=model_name, error="Deadline exceeded")
+        if not self.rate_limiter.acquire(timeout=min(self.rate_wait, remaining)):
+            logging.warning("⚠️ Gemini rate limit reached; answering as quota exceeded")
+            count("gemini.rate_limited")
+            return GeminiResult(QUOTA, model=model_name, error="Local rate limit")
+
+        remaining = end - time.monotonic()
+        if not self._slots.acquire(timeout=max(remaining, 0)):
+            logging.warning("⚠️ Gemini concurrency limit reached; gave up waiting for a slot")
+            return GeminiResult(ERROR, model=model_name, error="Too many concurrent Gemini requests")
+        breaker = self.breaker(model_name)
+        try:
+            timeout = min(self.attempt_timeout, max(end - time.monotonic(), 0.001))
+            with stage("gemini.generate"):
+                response = self.session.post(self._url(model_name), json=self._body(prompt), timeout=timeout)
+        except Exception as e:
+            logging.error(f"❌ {model_name} REST Request failed: {e}")
+            count("gemini.request_failed")
+            result = GeminiResult(ERROR, model=model_name, error=str(e))
+            self._record(breaker, result)
+            return result
+        finally:
+            self._slots.release()
+
+        retry_after = None
+        if response.status_code == 200:
+            try:
+                result = GeminiResult(OK, self._extract_text(response.json()), model=model_name, status_code=200)
+            except (ValueError, KeyError, IndexError, TypeError):
+                logging.warning(f"⚠️ Unexpected JSON structure from {model_name}: {response.text[:500]}")
+                result = GeminiResult(ERROR, model=model_name, status_code=200, error="Unexpected response structure")
+        elif response.status_code == 429:
+            # Callers log and serve their own fallback text
+            count("gemini.http_429")
+            retry_after = self._retry_after(response)
+            result = GeminiResult(QUOTA, model=model_name, status_code=429)
+        elif response.status_code == 403:
+            count("gemini.http_403")
+            result = GeminiResult(FORBIDDEN, model=model_name, status_code=403)
+        else:
+            count("gemini.http_error")
+            logging.warning(f"⚠️ {model_name} REST API failed: {response.status_code} - {response.text}")
+            result = GeminiResult(ERROR, model=model_name, status_code=response.status_code, error=response.text)
+        self._record(breaker, result, retry_after)
+        return result
+
+    def _next_model(self, models):
+        """Pops models until one whose breaker lets a call through.
+
+        Returns (model, skipped_result); skipped_result is the answer to give instead when a
+        skipped breaker was opened by quota/key errors (the same answer the call would get).
+        """
+        while models:
+            model_name = models.pop(0)
+            breaker = self.breaker(model_name)
+            if breaker.allow():
+                return model_name, None
+            count("gemini.breaker_skip")
+            logging.warning(f"⚠️ Skipping {model_name}: circuit open ({breaker.reason})")
+            if breaker.reason in (QUOTA, FORBIDDEN):
+                return None, GeminiResult(breaker.reason, model=model_name, error="Circuit open")
+        return None, None
+
+    def _hedged(self, model_name, models, prompt, end):
+        """Runs `model_name`; if it is still running after `hedge_after`, races the next model too.
+
+        Returns the first OK result, else the last result to finish. The losing call is left
+        to finish in the background (its breaker outcome is still recorded).
+        """
+        futures = {self._hedge_pool.submit(self._attempt, model_name, prompt, end)}
+        done, _ = wait(futures, timeout=min(self.hedge_after, max(end - time.monotonic(), 0)))
+        if not done:
+            hedge_model, skipped = self._next_model(models)
+            if hedge_model is not None:
+                count("gemini.hedged")
+                logging.info(f"🏁 {model_name} slower than {self.hedge_after:g}s; hedging with {hedge_model}")
+                futures.add(self._hedge_pool.submit(self._attempt, hedge_model, prompt, end))
+
+        result = None
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=max(end - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                return GeminiResult(ERROR, model=model_name, error="Deadline exceeded")
+            for future in done:
+                result = future.result()
+                if result.ok:
+                    return result
+        return result
+
+    # ------------------ Public API ------------------
+    @staticmethod
+    def cache_key_for(cache_key, models, prompt):
+        """The key a response is cached under: the caller's key plus the model chain and the exact prompt.
+
+        A prompt change (template, language instruction) or a different model never
+        serves text cached for another, whatever the caller folded into its own key.
+        """
+        return make_key("gemini", cache_key, *models, prompt)
+
+    def generate(self, prompt, models=None, deadline=None, cache=None, cache_key=None):
+        """Try each model in order until one answers. Never raises; returns a GeminiResult.
+
+        With a `cache` (result_cache.TieredCache) and `cache_key`, successful model text is
+        served from / stored in the cache under `cache_key` scoped to the models and prompt
+        (see cache_key_for). Quota, key and error results are never cached.
+        Concurrent calls with the same key (or prompt and models) share one upstream call.
+        """
+        models = list(models or self.models)
+        if cache_key is not None:
+            cache_key = self.cache_key_for(cache_key, models, prompt)
+        if cache is not None and cache_key is not None:
+            text = cache.get(cache_key)
+            if text is not None:
+                logging.info("⚡ Gemini response served from cache")
+                count("gemini.cache_hit")
+                return GeminiResult(OK, text, model="cache", status_code=200)
+
+        deadline = self.deadline if deadline is None else float(deadline)
+        flight_key = cache_key or make_key("gemini", *models, prompt)
+        try:
+            result, _ = self._flights.do(
+                flight_key, lambda: self._generate(prompt, models, deadline, cache, cache_key), timeout=deadline
+            )
+        except TimeoutError:
+            return GeminiResult(ERROR, error="Deadline exceeded")
+        return result
+
+    def _generate(self, prompt, models, deadline, cache, cache_key):
+        end = time.monotonic() + deadline
+        models = list(models)
+        last = GeminiResult(ERROR, error="No models attempted")
+
+        attempt = 0
+        while models:
+            model_name, skipped = self._next_model(models)
+            if skipped is not None:
+                return skipped
+            if model_name is None:
+                if not attempt:
+                    last = GeminiResult(ERROR, error="Circuit open for every model")
+                break
+            if attempt:
+                count("gemini.fallback")
+            attempt += 1
+
+            if self._hedge_pool is not None and models:
+                last = self._hedged(model_name, models, prompt, end)
+            else:
+                last = self._attempt(model_name, prompt, end)
+
+            if last.ok:
+                if cache is not None and cache_key is not None:
+                    cache.set(cache_key, last.text)
+                return last
+            if last.status in (QUOTA, FORBIDDEN) or last.error == "Deadline exceeded":
+                return last
+        return last
+
+    def stats(self):
+        return {
+            "breakers": {name: b.snapshot() for name, b in list(self._breakers.items())},
+            "in_flight": self._flights.in_flight(),
+            "rate_limit_per_s": self.rate_limiter.rate or None,
+            "hedge_after_s": self.hedge_after or None,
+        }
+
+    def stream(self, prompt, models=None, deadline=None, cache=None, cache_key=None):
+        """Streaming counterpart of generate(); see GeminiStream."""
+        return GeminiStream(self, prompt, models, deadline, cache, cache_key)
+
+
+class GeminiStream:
+    """Iterates text chunks from streamGenerateContent (SSE); `.result` is set once exhausted.
+
+    Falls back to the next model only while nothing has been yielded yet. A failure
+    mid-stream ends iteration with an ERROR result holding the partial text.
+    """
+
+    def __init__(self, client, prompt, models, deadline, cache, cache_key):
+        self.client = client
+        self.prompt = prompt
+        self.models = list(models or client.models)
+        self.deadline = client.deadline if deadline is None else float(deadline)
+        self.cache = cache
+        self.cache_key = None if cache_key is None else client.cache_key_for(cache_key, self.models, prompt)
+        self.result = None
+
+    def _chunks(self, response):
+        # SSE is always UTF-8; without a charset requests would decode text/event-stream as Latin-1
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            payload = json.loads(line[5:].strip())
+            for part in payload.get('candidates', [{}])[0].get('content', {}).get('parts', []):
+                if part.get('text'):
+                    yield part['text']
+
+    def __iter__(self):
+        client = self.client
+        if self.cache is not None and self.cache_key is not None:
+            text = self.cache.get(self.cache_key)
+            if text is not None:
+                logging.info("⚡ Gemini response served from cache")
+                count("gemini.cache_hit")
+                self.result = GeminiResult(OK, text, model="cache", status_code=200)
+                yield text
+                return
+
+        end = time.monotonic() + self.deadline
+        self.result = GeminiResult(ERROR, error="No models attempted")
+
+        models = list(self.models)
+        attempt = 0
+        while models:
+            model_name, skipped = client._next_model(models)
+            if skipped is not None:
+                self.result = skipped
+                return
+            if model_name is None:
+                if not attempt:
+                    self.result = GeminiResult(ERROR, error="Circuit open for every model")
+                return
+            if attempt:
+                count("gemini.fallback")
+            attempt += 1
+            remaining = end - time.monotonic()
+            if remaining > 0 and not client.rate_limiter.acquire(timeout=min(client.rate_wait, remaining)):
+                count("gemini.rate_limited")
+                self.result = GeminiResult(QUOTA, model=model_name, error="Local rate limit")
+                return
+            remaining = end - time.monotonic()
+            if remaining <= 0 or not client._slots.acquire(timeout=remaining):
+                self.result = GeminiResult(ERROR, model=model_name, error="Deadline exceeded")
+                return
+            breaker = client.breaker(model_name)
+            parts = []
+            try:
+                url = client._url(model_name, "streamGenerateContent") + "&alt=sse"
+                timeout = min(client.attempt_timeout, remaining)
+                start = time.perf_counter()
+                with client.session.post(url, json=client._body(self.prompt), timeout=timeout, stream=True) as response:
+                    if response.status_code == 429:
+                        count("gemini.http_429")
+                        self.result = GeminiResult(QUOTA, model=model_name, status_code=429)
+                        client._record(breaker, self.result, client._retry_after(response))
+                        return
+                    if response.status_code == 403:
+                        count("gemini.http_403")
+                        self.result = GeminiResult(FORBIDDEN, model=model_name, status_code=403)
+                        client._record(breaker, self.result)
+                        return
+                    if response.status_code != 200:
+                        logging.warning(f"⚠️ {model_name} stream failed: {response.status_code} - {response.text}")
+                        count("gemini.http_error")
+                        self.result = GeminiResult(ERROR, model=model_name, status_code=response.status_code, error=response.text)
+                        client._record(breaker, self.result)
+                        continue
+                    for chunk in self._chunks(response):
+                        if not parts:
+                            observe("gemini.stream_first_chunk", (time.perf_counter() - start) * 1000.0)
+                        parts.append(chunk)
+                        yield chunk
+                        if time.monotonic() > end:
+                            raise TimeoutError("Deadline exceeded mid-stream")
+            except Exception as e:
+                logging.error(f"❌ {model_name} stream failed: {e}")
+                count("gemini.request_failed")
+                self.result = GeminiResult(ERROR, "".join(parts), model=model_name, error=str(e))
+                client._record(breaker, self.result)
+                if parts:
+                    return
+                continue
+            finally:
+                client._slots.release()
+
+            if not parts:
+                self.result = GeminiResult(ERROR, model=model_name, status_code=200, error="Empty stream")
+                client._record(breaker, self.result)
+                continue
+            text = "".join(parts)
+            observe("gemini.stream", (time.perf_counter() - start) * 1000.0)
+            self.result = GeminiResult(OK, text, model=model_name, status_code=200)
+            client._record(breaker, self.result)
+            if self.cache is not None and self.cache_key is not None:
+                self.cache.set(self.cache_key, text)
+            return
+
+
+# ------------------ Response cache ------------------
+def build_response_cache(name):
+    """LLM response cache from LLM_CACHE_MAX_ENTRIES / LLM_CACHE_TTL / LLM_CACHE_DB (optional SQLite)."""
+    from result_cache import build_cache
+
+    return build_cache(
+        name,
+        int(os.getenv("LLM_CACHE_MAX_ENTRIES", 2048)),
+        float(os.getenv("LLM_CACHE_TTL", 6 * 3600)),
+        os.getenv("LLM_CACHE_DB") or None,
+    )
+
+
+# ------------------ Shared instance ------------------
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(api_key=None):
+    """Process-wide client configured from the environment."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # GEMINI_RPM is the project quota; each worker process gets its share
+                rate = float(os.getenv("GEMINI_RPM", 0)) / 60.0 / worker_processes()
+                _client = GeminiClient(
+                    api_key if api_key is not None else os.getenv("API_KEY"),
+                    base_url=GEMINI_BASE_URL,
+                    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", 8)),
+                    attempt_timeout=float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", 30)),
+                    deadline=float(os.getenv("GEMINI_DEADLINE", 45)),
+                    rate_limiter=TokenBucket(rate, float(os.getenv("GEMINI_BURST", 0)) or max(1.0, rate * 10)),
+                    rate_wait=float(os.getenv("GEMINI_RATE_WAIT", 2)),
+                    breaker_failures=int(os.getenv("GEMINI_BREAKER_FAILURES", 5)),
+                    breaker_cooldown=float(os.getenv("GEMINI_BREAKER_COOLDOWN", 30)),
+                    # Hedging doubles upstream calls (and quota) for slow prompts, so it is opt-in
+                    hedge_after=float(os.getenv("GEMINI_HEDGE_AFTER_MS", 0)) / 1000.0,
+                )
+    return _client
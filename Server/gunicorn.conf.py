@@ -0,0 +1,52 @@
+# Production serving for the Python services, e.g.
+#   PORT=5000 gunicorn -c gunicorn.conf.py XrayMicroservice:app
+#   PORT=5001 gunicorn -c gunicorn.conf.py LabMicroservice:app
+#   PORT=5002 gunicorn -c gunicorn.conf.py Interpreter:app
+#   PORT=5003 gunicorn -c gunicorn.conf.py AnalysisService:app
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from serving import available_cpus, compute_threads, drain, worker_processes  # noqa: E402
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Worker processes x compute threads ~= available CPUs (override with SERVING_WORKERS /
+# SERVING_COMPUTE_THREADS). Exported so the app, imported after this file, sizes its pools the same way.
+workers = worker_processes()
+os.environ["SERVING_WORKERS"] = str(workers)
+
+# Request threads per worker. They mostly wait on the batcher, OCR pool or Gemini, so this can
+# exceed the compute threads.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# Off by default: each worker loads and warms up its own models. GUNICORN_PRELOAD=1 loads them
+# once in the master so workers share the weights copy-on-write, but the X-ray service then runs
+# TensorFlow (and the Lab service torch) before fork(), and their thread pools (Eigen, XNNPACK,
+# OpenMP) are not fork-safe: workers can hang in their first predict. Only preload services
+# without models (Interpreter), or a TF/torch build you have checked under preload.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0").lower() in ("1", "true", "yes")
+
+# Long OCR/LLM requests; on SIGTERM workers get graceful_timeout to finish in-flight requests
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 180))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 60))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+# Recycle workers now and then to bound fragmentation (0 = never)
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max(1, max_requests // 10) if max_requests else 0
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    server.log.info(
+        f"⚙️ {workers} workers x {threads} request threads, "
+        f"{compute_threads()} compute threads each ({available_cpus()} CPUs), preload={preload_app}"
+    )
+
+
+def worker_exit(server, worker):
+    # Requests have finished by now; stop batchers/pools once their queued work is done
+    drain()
@@ -0,0 +1,171 @@
+# Micro-batching scheduler for model inference
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger("MEDISCOPE_Batcher")
+
+
+class MicroBatcher:
+    """Collects single-sample requests into batches for one forward pass.
+
+    Callers submit one preprocessed sample (no batch axis) and get back their own
+    row of the model output. A background worker waits for the first request, then
+    keeps collecting until `max_batch_size` samples are queued or `max_wait_ms`
+    has elapsed, whichever comes first.
+
+    With `stack=False` samples may differ in shape: `predict_fn` receives the plain
+    list and must return a sequence with one result per sample. `workers` > 1 runs
+    several batch loops off the same queue.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10, name="batcher", stack=True, workers=1):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+        self.name = name
+        self.stack = stack
+
+        self.num_workers = max(1, int(workers))
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._last_batch_size = 0
+        self._batch_size_counts = {}
+        self._stopped = False
+
+        self._start()
+        # Threads don't survive fork(); a preloaded app (gunicorn preload_app) restarts them in each worker
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._start())
+        logger.info(
+            f"⚙️ {name} started (max_batch_size={self.max_batch_size}, max_wait_ms={max_wait_ms}, workers={self.num_workers})"
+        )
+
+    def _start(self):
+        if self._stopped:
+            return
+        self._queue = queue.Queue()
+        self._submit_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"{self.name}-worker-{i}", daemon=True)
+            for i in range(self.num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    # ------------------ Public API ------------------
+    def submit(self, sample):
+        """Queue one sample and return a Future resolving to its output row."""
+        if self._stopped:
+            raise RuntimeError(f"{self.name} is shut down")
+        future = Future()
+        self._queue.put((np.asarray(sample) if self.stack else sample, future))
+        return future
+
+    def predict(self, sample, timeout=None):
+        return self.submit(sample).result(timeout=timeout)
+
+    def predict_many(self, samples, timeout=None):
+        """Queue several samples back to back so they share a forward pass.
+
+        Groups larger than `max_batch_size` are split across consecutive batches.
+        Rows come back in input order.
+        """
+        with self._submit_lock:
+            futures = [self.submit(sample) for sample in samples]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self._batches
+            avg_size = (self._items / batches) if batches else 0.0
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": batches,
+                "items": self._items,
+                "errors": self._errors,
+                "last_batch_size": self._last_batch_size,
+                "avg_batch_size": round(avg_size, 3),
+                "avg_batch_fill": round(avg_size / self.max_batch_size, 3) if batches else 0.0,
+                "batch_size_counts": {str(k): v for k, v in sorted(self._batch_size_counts.items())},
+            }
+
+    def shutdown(self, timeout=None):
+        """Stops accepting work; samples already queued are still run before the workers exit."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=timeout)
+
+    # ------------------ Worker ------------------
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            # Leave the sentinel for the other workers
+            self._queue.put(None)
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the sentinel so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+
+            # Skip callers that gave up before we got to them
+            batch = [(x, f) for x, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                if self.stack:
+                    outputs = np.asarray(self.predict_fn(np.stack([x for x, _ in batch], axis=0)))
+                else:
+                    outputs = list(self.predict_fn([x for x, _ in batch]))
+                if len(outputs) != len(batch):
+                    raise RuntimeError(
+                        f"Model returned {len(outputs)} rows for a batch of {len(batch)}"
+                    )
+                for i, (_, future) in enumerate(batch):
+                    future.set_result(outputs[i])
+                failed = False
+            except Exception as e:
+                logger.error(f"❌ {self.name} batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                failed = True
+
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._last_batch_size = len(batch)
+                self._batch_size_counts[len(batch)] = self._batch_size_counts.get(len(batch), 0) + 1
+                if failed:
+                    self._errors += 1
@@ -0,0 +1,297 @@
+# Low-overhead instrumentation: stage timers, histograms, counters, /metrics and an opt-in sampling profiler
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from collections import Counter
+
+logger = logging.getLogger("MEDISCOPE_Metrics")
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is +Inf)
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Sampling profiler: PROFILE_HZ > 0 samples threads that are inside a timed stage.
+# PROFILE_STAGES limits it to stage-name prefixes, e.g. "lab.ocr,xray."
+PROFILE_HZ = float(os.getenv("PROFILE_HZ", 0))
+PROFILE_STAGES = tuple(s for s in os.getenv("PROFILE_STAGES", "").split(",") if s)
+PROFILE_MAX_DEPTH = 64
+
+# Stages measured on the current request's thread, for the Server-Timing header
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+def _round(ms):
+    return None if ms is None else round(ms, 3)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max", "lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, ms):
+        index = bisect.bisect_left(BUCKETS_MS, ms)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += ms
+            if ms > self.max:
+                self.max = ms
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (max for the overflow bucket)."""
+        with self.lock:
+            counts, count, top = list(self.counts), self.count, self.max
+        if not count:
+            return None
+        rank, seen = q * count, 0
+        for index, n in enumerate(counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS_MS[index], top) if index < len(BUCKETS_MS) else top
+        return top
+
+    def snapshot(self):
+        with self.lock:
+            count, total, top = self.count, self.total, self.max
+        return {
+            "count": count,
+            "mean_ms": round(total / count, 3) if count else None,
+            "max_ms": round(top, 3),
+            **{f"p{q}_ms": _round(self.quantile(q / 100)) for q in (50, 95, 99)},
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name, ms):
+        self.histogram(name).observe(ms)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((name, ms))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self, service="mediscope"):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        return {
+            "service": service,
+            "pid": os.getpid(),
+            "counters": counters,
+            "stages": {name: h.snapshot() for name, h in sorted(histograms.items())},
+            "profiler": profiler.stats(),
+        }
+
+    def prometheus(self, service="mediscope"):
+        """Prometheus text exposition format, labelled with `service`."""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+        lines = ["# TYPE mediscope_stage_duration_ms histogram"]
+        for name, h in sorted(histograms.items()):
+            with h.lock:
+                counts, count, total = list(h.counts), h.count, h.total
+            labels = f'service="{service}",stage="{name}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS_MS + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f'mediscope_stage_duration_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"mediscope_stage_duration_ms_sum{{{labels}}} {total:.3f}")
+            lines.append(f"mediscope_stage_duration_ms_count{{{labels}}} {count}")
+        lines.append("# TYPE mediscope_events_total counter")
+        for name, value in sorted(counters.items()):
+            lines.append(f'mediscope_events_total{{service="{service}",event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# ------------------ Sampling profiler ------------------
+class SamplingProfiler:
+    """Samples the stacks of threads inside a timed stage and counts them as collapsed stacks.
+
+    Output ("stage;module:function;... count" per line) loads into flamegraph.pl or speedscope.
+    Off unless PROFILE_HZ > 0; when off, entering a stage costs one attribute check.
+    """
+
+    def __init__(self, hz=0.0, prefixes=()):
+        self.hz = hz
+        self.prefixes = prefixes
+        self.active = {}  # thread id -> stage name
+        self.samples = Counter()
+        self.lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def enabled(self):
+        return self.hz > 0
+
+    def wants(self, stage):
+        return self.enabled and (not self.prefixes or stage.startswith(self.prefixes))
+
+    def enter(self, stage):
+        """Marks this thread as inside `stage`; returns the enclosing stage to restore on exit."""
+        # The sampler thread does not survive fork(); (re)start it lazily in each process
+        if self._pid != os.getpid():
+            self._start()
+        ident = threading.get_ident()
+        outer = self.active.get(ident)
+        self.active[ident] = stage
+        return outer
+
+    def exit(self, outer=None):
+        ident = threading.get_ident()
+        if outer is None:
+            self.active.pop(ident, None)
+        else:
+            self.active[ident] = outer
+
+    def _start(self):
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.active = {}
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            logger.info(f"🔬 Sampling profiler running at {self.hz:g} Hz")
+
+    def _run(self):
+        interval = 1.0 / self.hz
+        while True:
+            time.sleep(interval)
+            active = dict(self.active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            stacks = []
+            for ident, stage in active.items():
+                frame = frames.get(ident)
+                names = []
+                while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(";".join([stage] + names[::-1]))
+            with self.lock:
+                self.samples.update(stacks)
+
+    def collapsed(self, reset=False):
+        with self.lock:
+            samples = dict(self.samples)
+            if reset:
+                self.samples.clear()
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(samples.items(), key=lambda kv: -kv[1]))
+
+    def stats(self):
+        with self.lock:
+            return {"hz": self.hz, "prefixes": list(self.prefixes), "samples": sum(self.samples.values())}
+
+
+profiler = SamplingProfiler(PROFILE_HZ, PROFILE_STAGES)
+
+
+# ------------------ Public API ------------------
+class stage:
+    """Times a block into the `name` histogram: `with stage("lab.ocr"): ...`"""
+
+    __slots__ = ("name", "start", "profiled", "outer")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profiled = profiler.wants(self.name)
+        if self.profiled:
+            self.outer = profiler.enter(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, (time.perf_counter() - self.start) * 1000.0)
+        if self.profiled:
+            profiler.exit(self.outer)
+        return False
+
+
+def observe(name, ms):
+    registry.observe(name, ms)
+
+
+def count(name, n=1):
+    registry.count(name, n)
+
+
+def install_metrics(app, service):
+    """Per-request timing + Server-Timing header, and GET /metrics (Prometheus text, ?format=json for JSON).
+
+    Counters and histograms are per process; under gunicorn each worker reports its own.
+    The service label belongs to `app`: a process can import several service apps (AnalysisService
+    does), and each one keeps its own name.
+    """
+    from flask import Response, current_app, g, jsonify, request
+
+    app.extensions["mediscope_metrics"] = {"service": service}
+
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_token = _request_stages.set([])
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("_metrics_start", None)
+        token = g.pop("_metrics_token", None)
+        if start is None or request.endpoint in ("metrics", "metrics_profile"):
+            return response
+        # Streamed bodies are still being produced here: this is the time to the response headers
+        elapsed = (time.perf_counter() - start) * 1000.0
+        registry.histogram(f"request.{request.endpoint or 'unknown'}").observe(elapsed)
+        registry.count(f"http.{response.status_code}")
+        stages = _request_stages.get() or []
+        timing = [f"{name};dur={ms:.1f}" for name, ms in stages]
+        timing.append(f"total;dur={elapsed:.1f}")
+        response.headers["Server-Timing"] = ", ".join(timing)
+        if token is not None:
+            _request_stages.reset(token)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        service = current_app.extensions["mediscope_metrics"]["service"]
+        if request.args.get("format") == "json":
+            return jsonify(registry.snapshot(service))
+        return Response(registry.prometheus(service), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/metrics/profile", methods=["GET"])
+    def metrics_profile():
+        # Collapsed stacks; ?reset=1 clears them after reading
+        if not profiler.enabled:
+            return jsonify({"error": "Profiler disabled; set PROFILE_HZ (e.g. 97) to enable it"}), 404
+        reset = request.args.get("reset", "").lower() in ("1", "true", "yes")
+        return Response(profiler.collapsed(reset), mimetype="text/plain")
@@ -0,0 +1,281 @@
+# Asynchronous jobs: a bounded local worker pool with back-pressure, polled or called back on completion
+import os
+import time
+import uuid
+import socket
+import logging
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+from instrumentation import count, observe, stage
+from result_cache import LRUTTLCache, SQLiteCache
+from serving import worker_processes
+
+logger = logging.getLogger("MEDISCOPE_Jobs")
+
+# Completed jobs stay readable this long (seconds)
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 3600))
+JOB_MAX_RECORDS = int(os.getenv("JOB_MAX_RECORDS", 10000))
+# SQLite file shared by the worker processes, so a poll can land on any of them
+JOBS_DB = os.getenv("JOBS_DB") or None
+# Longest GET /jobs/<id>?wait= long-poll, in seconds
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", 30))
+# Comma-separated hosts callbacks may go to; empty disables callbacks (clients poll instead)
+JOB_CALLBACK_HOSTS = tuple(h.strip().lower() for h in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if h.strip())
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", 10))
+# Callbacks are POSTed from their own small pool, so a slow receiver doesn't hold up job workers
+JOB_CALLBACK_WORKERS = int(os.getenv("JOB_CALLBACK_WORKERS", 2))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when every worker is busy and the queue is at its limit."""
+
+
+def _forbidden_address(host, port):
+    """Error message if `host` resolves to a link-local, multicast, reserved or unspecified address.
+
+    Those are never legitimate callback targets (169.254.169.254 is the cloud metadata service).
+    Loopback and private addresses are fine: the host was allow-listed on purpose.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except OSError as e:
+        return f"callback_url host {host} does not resolve: {e}"
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if address.is_link_local or address.is_multicast or address.is_reserved or address.is_unspecified:
+            return f"callback_url host {host} resolves to a forbidden address ({address})"
+    return None
+
+
+def validate_callback_url(url):
+    """Returns an error message for an unusable callback URL, else None.
+
+    Jobs POST their results to the callback, so only hosts in JOB_CALLBACK_HOSTS are accepted.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return "callback_url must be an http(s) URL"
+    if not JOB_CALLBACK_HOSTS:
+        return "Callbacks are disabled (set JOB_CALLBACK_HOSTS); poll the status URL instead"
+    if parsed.hostname.lower() not in JOB_CALLBACK_HOSTS:
+        return f"callback_url host {parsed.hostname} is not allowed"
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        return "callback_url has an invalid port"
+    return _forbidden_address(parsed.hostname, port)
+
+
+class JobQueue:
+    """Runs `fn(*args)` on `max_workers` threads; at most `max_pending` more jobs may wait.
+
+    Job records (status, timestamps, result or error) live in memory, or in SQLite when `db_path`
+    is set. Records expire `result_ttl` seconds after their last update; queued and running jobs
+    are also pinned in this process, so neither expiry nor `max_records` eviction can lose them.
+    """
+
+    def __init__(self, name, max_workers=2, max_pending=32, result_ttl=JOB_RESULT_TTL, db_path=JOBS_DB,
+                 max_records=JOB_MAX_RECORDS):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(0, int(max_pending))
+        # Room for every in-flight job, so other worker processes can still see them in a shared store
+        max_records = max(int(max_records), self.max_workers + self.max_pending)
+        self.store = SQLiteCache(db_path, result_ttl, max_records) if db_path else LRUTTLCache(max_records, result_ttl)
+        self.shared = db_path is not None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._counters = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "callbacks_failed": 0}
+        if not self.shared and worker_processes() > 1:
+            logger.warning(f"⚠️ {name}: job records are per process; set JOBS_DB so any worker can answer a poll")
+        logger.info(f"🧵 {name}: workers={self.max_workers}, queue={self.max_pending}, "
+                    f"ttl={result_ttl}s, store={db_path or 'memory'}")
+
+    def _ensure_pool(self):
+        # Threads don't survive fork(); a preloaded app creates its pool in each worker on first use
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            self._callbacks = ThreadPoolExecutor(max_workers=max(1, JOB_CALLBACK_WORKERS),
+                                                 thread_name_prefix=f"{self.name}-callback")
+            self._in_flight = 0
+            self._events = {}
+            self._active = {}
+
+    # ------------------ Public API ------------------
+    def submit(self, kind, fn, *args, callback_url=None):
+        """Queues a job and returns its record; raises QueueFull instead of queueing past the limit."""
+        with self._lock:
+            self._ensure_pool()
+            if self._in_flight >= self.max_workers + self.max_pending:
+                self._counters["rejected"] += 1
+                count(f"jobs.{self.name}.rejected")
+                raise QueueFull(f"{self.name} is at capacity ({self._in_flight} jobs in flight)")
+            self._in_flight += 1
+            self._counters["submitted"] += 1
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "kind": kind,
+                "status": QUEUED,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            if callback_url:
+                job["callback_url"] = callback_url
+            self._events[job["job_id"]] = threading.Event()
+            self._active[job["job_id"]] = job
+        self.store.set(job["job_id"], job)
+        try:
+            self._pool.submit(self._run, job, fn, args)
+        except RuntimeError:
+            # Pool already shut down (process draining)
+            self._finish(job, FAILED, error="Service is shutting down")
+        return job
+
+    def get(self, job_id):
+        if self._pid == os.getpid():
+            job = self._active.get(job_id)
+            if job is not None:
+                return job
+        return self.store.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """Job record once finished or after `timeout` seconds, whichever comes first; None if unknown."""
+        deadline = time.monotonic() + min(max(float(timeout), 0.0), JOB_MAX_WAIT)
+        event = self._events.get(job_id) if self._pid == os.getpid() else None
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            # Jobs running in another worker process are only visible through the store
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(0.25, remaining))
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            in_flight = self._in_flight if self._pid == os.getpid() else 0
+        return {
+            **counters,
+            "in_flight": in_flight,
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "shared_store": self.shared,
+        }
+
+    def shutdown(self):
+        """Finishes running and queued jobs and their callbacks, then stops the workers."""
+        if self._pid == os.getpid():
+            self._pool.shutdown(wait=True)
+            self._callbacks.shutdown(wait=True)
+
+    # ------------------ Worker ------------------
+    def _run(self, job, fn, args):
+        job = dict(job, status=RUNNING, started_at=time.time())
+        observe(f"jobs.{self.name}.wait", (job["started_at"] - job["submitted_at"]) * 1000.0)
+        self._active[job["job_id"]] = job
+        self.store.set(job["job_id"], job)
+        try:
+            with stage(f"jobs.{self.name}.run"):
+                result = fn(*args)
+        except Exception as e:
+            logger.error(f"❌ {self.name} job {job['job_id']} failed: {e}")
+            self._finish(job, FAILED, error=str(e))
+        else:
+            self._finish(job, DONE, result=result)
+
+    def _finish(self, job, status, result=None, error=None):
+        job = dict(job, status=status, finished_at=time.time())
+        if status == DONE:
+            job["result"] = result
+        else:
+            job["error"] = error
+        self.store.set(job["job_id"], job)
+        with self._lock:
+            self._in_flight -= 1
+            self._counters[status] += 1
+            self._active.pop(job["job_id"], None)
+            event = self._events.pop(job["job_id"], None)
+        count(f"jobs.{self.name}.{status}")
+        if event is not None:
+            event.set()
+        if job.get("callback_url"):
+            try:
+                self._callbacks.submit(self._callback, job)
+            except RuntimeError:
+                # Callback pool already shut down (process draining): send it from here
+                self._callback(job)
+
+    def _callback(self, job):
+        # Checked again at send time: DNS may have changed since submission. Redirects are not
+        # followed, so an allowed host can't bounce the POST somewhere else.
+        error = validate_callback_url(job["callback_url"])
+        if error is None:
+            try:
+                response = requests.post(job["callback_url"], json=public_view(job),
+                                         timeout=JOB_CALLBACK_TIMEOUT, allow_redirects=False)
+                response.raise_for_status()
+                if response.is_redirect:
+                    error = f"callback answered with a redirect ({response.status_code})"
+            except requests.RequestException as e:
+                error = str(e)
+        if error is not None:
+            logger.warning(f"⚠️ Callback for {self.name} job {job['job_id']} failed: {error}")
+            with self._lock:
+                self._counters["callbacks_failed"] += 1
+            count(f"jobs.{self.name}.callback_failed")
+
+
+def public_view(job):
+    """The job as returned to clients (the callback URL is not echoed back)."""
+    return {k: v for k, v in job.items() if k != "callback_url"}
+
+
+def install_job_routes(app, jobs):
+    """GET /jobs/<id> (optional ?wait=<seconds> long-poll) for a JobQueue."""
+    from flask import jsonify, request
+
+    @app.route("/jobs/<job_id>", methods=["GET"])
+    def job_status(job_id):
+        try:
+            wait = float(request.args.get("wait", 0))
+        except ValueError:
+            return jsonify({"error": "wait must be a number of seconds"}), 400
+        job = jobs.wait(job_id, wait) if wait > 0 else jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown or expired job"}), 404
+        return jsonify(public_view(job)), 200
+
+
+def accepted_response(job, retry_after=1):
+    """202 Accepted pointing at the job's status URL."""
+    from flask import jsonify, url_for
+
+    status_url = url_for("job_status", job_id=job["job_id"])
+    response = jsonify({"job_id": job["job_id"], "status": job["status"], "status_url": status_url})
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def queue_full_response(error, retry_after=5):
+    """503 with Retry-After, so callers back off instead of piling on."""
+    from flask import jsonify
+
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
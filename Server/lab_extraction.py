@@ -0,0 +1,268 @@
+# Lab report text extraction: PDF text-layer fast path + parallel per-page OCR
+import io
+import os
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import fitz  # PyMuPDF
+from PIL import Image
+
+from inference_batcher import MicroBatcher
+from instrumentation import stage
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
+
+# MuPDF keeps global state and is not safe to drive from several threads at once.
+# Text extraction and rasterization are serialized here; OCR runs outside the lock.
+_fitz_lock = threading.Lock()
+
+
+class ExtractionPipeline:
+    """Extracts text from images and PDFs, OCRing pages concurrently on a worker pool.
+
+    PDF pages with a usable native text layer skip OCR entirely; scanned pages are
+    rasterized (DPI capped so a page never exceeds `max_page_pixels`) and OCRed.
+
+    A PDF's pages are read and rasterized inside per-page pool tasks, at most
+    `pages_in_flight` at a time per document, so a long scan never sits in memory
+    as a stack of rasters.
+
+    With `batch_size` > 1, pages and images from every in-flight request are pooled
+    by a MicroBatcher and OCRed together through EasyOCR's `readtext_batched`;
+    `recognition_batch_size` is passed through as EasyOCR's recognizer batch size.
+    """
+
+    def __init__(self, reader_factory, max_workers=4, dpi=200, max_dpi=300,
+                 max_page_pixels=4_000_000, min_text_chars=20,
+                 batch_size=1, batch_wait_ms=20, recognition_batch_size=8, spool_dir=None,
+                 pages_in_flight=None):
+        self.reader_factory = reader_factory
+        # Only used when an in-memory image can't be decoded and EasyOCR needs a real file
+        self.spool_dir = spool_dir
+        self.dpi = min(dpi, max_dpi)
+        self.max_page_pixels = max_page_pixels
+        self.min_text_chars = min_text_chars
+        self.recognition_batch_size = max(1, recognition_batch_size)
+        # Pages of one PDF rasterized but not yet OCRed; bounds a request's memory to this many rasters
+        self.pages_in_flight = max(1, pages_in_flight or max(max_workers, batch_size))
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr")
+        self.batcher = None
+        if batch_size > 1:
+            self.batcher = MicroBatcher(
+                self._ocr_batch,
+                max_batch_size=batch_size,
+                max_wait_ms=batch_wait_ms,
+                name="ocr-batcher",
+                stack=False,
+                workers=max_workers,
+            )
+
+    # ------------------ OCR ------------------
+    @staticmethod
+    def _join(res):
+        return "\n".join(res) if res else "[No text]"
+
+    def _ocr(self, image):
+        with stage("lab.ocr"):
+            res = self.reader_factory().readtext(image, detail=0, batch_size=self.recognition_batch_size)
+        return self._join(res)
+
+    def _ocr_batch(self, images):
+        # readtext_batched needs equally sized inputs; group by shape rather than resizing
+        groups = {}
+        for i, image in enumerate(images):
+            groups.setdefault(image.shape, []).append(i)
+
+        reader = self.reader_factory()
+        texts = [None] * len(images)
+        for indices in groups.values():
+            if len(indices) == 1:
+                texts[indices[0]] = self._ocr(images[indices[0]])
+                continue
+            with stage("lab.ocr_batch"):
+                results = reader.readtext_batched(
+                    [images[i] for i in indices], detail=0, batch_size=self.recognition_batch_size
+                )
+            for i, res in zip(indices, results):
+                texts[i] = self._join(res)
+        return texts
+
+    def _submit_ocr(self, image):
+        if self.batcher is not None:
+            if not isinstance(image, np.ndarray):
+                # Decode files up front so they can share a batch with rasterized pages
+                with Image.open(image) as img:
+                    image = np.asarray(img.convert("L"))
+            return self.batcher.submit(image)
+        return self.pool.submit(self._ocr, image)
+
+    def _submit_image_bytes(self, data, ext):
+        try:
+            with stage("lab.image_decode"), Image.open(io.BytesIO(data)) as img:
+                image = np.asarray(img.convert("L"))
+        except Exception as e:
+            # Formats PIL can't read go to EasyOCR via a private, per-request temp file
+            logging.warning(f"⚠️ In-memory decode failed ({e}); spooling to a temp file")
+            fd, path = tempfile.mkstemp(suffix=ext, dir=self.spool_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            future = self.pool.submit(self._ocr, path)
+            future.add_done_callback(lambda _: os.path.exists(path) and os.remove(path))
+            return future
+        return self._submit_ocr(image)
+
+    def stats(self):
+        return {"batching": self.batcher.stats() if self.batcher is not None else None}
+
+    def shutdown(self):
+        """Finishes queued OCR work, then stops the batcher and the worker pool."""
+        if self.batcher is not None:
+            self.batcher.shutdown()
+        self.pool.shutdown(wait=True)
+
+    def _page_dpi(self, page):
+        # Points are 1/72"; scale the DPI down if the page would rasterize past the pixel cap
+        width_in, height_in = page.rect.width / 72.0, page.rect.height / 72.0
+        area = max(width_in * height_in, 1e-6)
+        return max(36, min(self.dpi, int((self.max_page_pixels / area) ** 0.5)))
+
+    def _rasterize(self, page):
+        pix = page.get_pixmap(dpi=self._page_dpi(page), colorspace=fitz.csGRAY, alpha=False)
+        return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+    def _read_page(self, doc, index):
+        """Returns (text, None) for a page with a text layer, else (text, grayscale raster)."""
+        with _fitz_lock:
+            with stage("lab.pdf_text"):
+                page = doc.load_page(index)
+                text = page.get_text()
+            if len(text.strip()) >= self.min_text_chars:
+                return text, None
+            with stage("lab.pdf_rasterize"):
+                return text, self._rasterize(page)
+
+    # ------------------ Planning ------------------
+    def _submit_pdf(self, source, name):
+        """Returns one future per page; pages are read and rasterized lazily on the pool."""
+        with _fitz_lock, stage("lab.pdf_open"):
+            doc = fitz.open(source) if isinstance(source, str) else fitz.open(stream=source, filetype="pdf")
+            page_count = len(doc)
+        return _PdfPages(self, doc, name, page_count).futures
+
+    def submit(self, source, filename=None):
+        """Queue a file for extraction; returns a zero-arg callable that joins its text.
+
+        `source` is a path, or the file's bytes with `filename` giving its extension.
+        """
+        name = os.path.basename(filename or (source if isinstance(source, str) else ""))
+        ext = os.path.splitext(name)[1].lower()
+        if ext in IMAGE_EXTENSIONS:
+            if isinstance(source, str):
+                future = self._submit_ocr(source)
+            else:
+                future = self._submit_image_bytes(source, ext)
+            return future.result
+
+        futures = self._submit_pdf(source, name)
+        return lambda: "".join(f.result() + "\n" for f in futures)
+
+    # ------------------ Public API ------------------
+    def extract(self, source, filename=None):
+        return self.submit(source, filename)()
+
+    def extract_many(self, items):
+        """Extract several files concurrently.
+
+        `items` are paths or (bytes, filename) pairs. Returns text or the raised
+        exception per item, in order.
+        """
+        pending = []
+        for item in items:
+            try:
+                pending.append(self.submit(*item) if isinstance(item, tuple) else self.submit(item))
+            except Exception as e:
+                pending.append(e)
+
+        results = []
+        for item in pending:
+            if isinstance(item, Exception):
+                results.append(item)
+                continue
+            try:
+                results.append(item())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class _PdfPages:
+    """One open PDF; each page is read, rasterized and OCRed in its own pool task.
+
+    Only `pipeline.pages_in_flight` pages run at once: a finished page starts the
+    next one, and the last one closes the document.
+    """
+
+    def __init__(self, pipeline, doc, name, page_count):
+        self.pipeline = pipeline
+        self.doc = doc
+        self.name = name
+        self.futures = [Future() for _ in range(page_count)]
+        self._lock = threading.Lock()
+        self._next = 0
+        self._remaining = page_count
+        if not page_count:
+            self._close()
+        for _ in range(min(pipeline.pages_in_flight, page_count)):
+            self._start_next()
+
+    def _start_next(self):
+        with self._lock:
+            if self._next >= len(self.futures):
+                return
+            index = self._next
+            self._next += 1
+        try:
+            self.pipeline.pool.submit(self._run, index)
+        except Exception as e:
+            self._finish(index, error=e)
+
+    def _run(self, index):
+        try:
+            text, image = self.pipeline._read_page(self.doc, index)
+            if image is not None:
+                logging.info(f"🔍 Page {index + 1} of {self.name} has no text layer; OCR queued")
+                if self.pipeline.batcher is not None:
+                    # The batcher's worker finishes the page, so this pool thread moves on
+                    self.pipeline.batcher.submit(image).add_done_callback(lambda f: self._finish_from(index, f))
+                    return
+                text = self.pipeline._ocr(image)
+        except Exception as e:
+            self._finish(index, error=e)
+            return
+        self._finish(index, text)
+
+    def _finish_from(self, index, future):
+        if future.exception() is not None:
+            self._finish(index, error=future.exception())
+        else:
+            self._finish(index, future.result())
+
+    def _finish(self, index, result=None, error=None):
+        if error is not None:
+            self.futures[index].set_exception(error)
+        else:
+            self.futures[index].set_result(result)
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            self._close()
+        else:
+            self._start_next()
+
+    def _close(self):
+        with _fitz_lock:
+            self.doc.close()
@@ -0,0 +1,307 @@
+# Structured lab-value extraction: analyte / value / unit / reference range from OCR or PDF text
+import re
+import logging
+
+logger = logging.getLogger("MEDISCOPE_LabValues")
+
+# Canonical analyte -> (aliases, fallback reference range by unit)
+# Fallback ranges (adult, common units) are only used to flag values when the report prints none.
+# They ignore sex and age, so readings flagged against them are marked as such in the prompt.
+ANALYTES = {
+    "Hemoglobin": (["hemoglobin", "haemoglobin", "hb", "hgb"], {"g/dL": (12.0, 17.5)}),
+    "Hematocrit": (["hematocrit", "haematocrit", "hct", "pcv", "packed cell volume"], {"%": (36.0, 52.0)}),
+    "RBC Count": (["rbc count", "rbc", "red blood cell count", "red blood cells", "total rbc count"], {"10^6/uL": (4.0, 6.0)}),
+    "WBC Count": (["wbc count", "wbc", "white blood cell count", "white blood cells", "total leukocyte count",
+                   "total leucocyte count", "tlc", "total wbc count"], {"10^3/uL": (4.0, 11.0), "cells/uL": (4000, 11000)}),
+    "Platelet Count": (["platelet count", "platelets", "plt"], {"10^3/uL": (150, 450), "lakhs/uL": (1.5, 4.5)}),
+    "MCV": (["mcv", "mean corpuscular volume"], {"fL": (80, 100)}),
+    "MCH": (["mch", "mean corpuscular hemoglobin"], {"pg": (27, 33)}),
+    "MCHC": (["mchc", "mean corpuscular hemoglobin concentration"], {"g/dL": (32, 36)}),
+    "RDW": (["rdw", "rdw-cv", "red cell distribution width"], {"%": (11.5, 14.5)}),
+    "Neutrophils": (["neutrophils", "neutrophil"], {"%": (40, 75)}),
+    "Lymphocytes": (["lymphocytes", "lymphocyte"], {"%": (20, 45)}),
+    "Monocytes": (["monocytes", "monocyte"], {"%": (2, 10)}),
+    "Eosinophils": (["eosinophils", "eosinophil"], {"%": (1, 6)}),
+    "Basophils": (["basophils", "basophil"], {"%": (0, 2)}),
+    "ESR": (["esr", "erythrocyte sedimentation rate"], {"mm/hr": (0, 20)}),
+    "Glucose (Fasting)": (["fasting blood sugar", "fasting blood glucose", "fasting glucose", "fbs", "glucose fasting",
+                           "fasting plasma glucose", "fpg"], {"mg/dL": (70, 100), "mmol/L": (3.9, 5.6)}),
+    "Glucose (Post-prandial)": (["post prandial blood sugar", "postprandial blood sugar", "ppbs", "glucose pp",
+                                 "post prandial glucose"], {"mg/dL": (70, 140)}),
+    "Glucose (Random)": (["random blood sugar", "rbs", "random glucose", "glucose random", "blood glucose", "glucose"],
+                         {"mg/dL": (70, 140), "mmol/L": (3.9, 7.8)}),
+    "HbA1c": (["hba1c", "glycated hemoglobin", "glycosylated hemoglobin", "hemoglobin a1c", "a1c"], {"%": (4.0, 5.7)}),
+    "Total Cholesterol": (["total cholesterol", "cholesterol total", "serum cholesterol", "cholesterol"], {"mg/dL": (0, 200)}),
+    "HDL Cholesterol": (["hdl cholesterol", "hdl-c", "hdl"], {"mg/dL": (40, 100)}),
+    "LDL Cholesterol": (["ldl cholesterol", "ldl-c", "ldl"], {"mg/dL": (0, 100)}),
+    "VLDL Cholesterol": (["vldl cholesterol", "vldl"], {"mg/dL": (2, 30)}),
+    "Triglycerides": (["triglycerides", "triglyceride", "tg"], {"mg/dL": (0, 150)}),
+    "Creatinine": (["serum creatinine", "creatinine"], {"mg/dL": (0.6, 1.3)}),
+    "Urea": (["blood urea", "urea"], {"mg/dL": (15, 45)}),
+    "BUN": (["blood urea nitrogen", "bun"], {"mg/dL": (7, 20)}),
+    "Uric Acid": (["uric acid", "serum uric acid"], {"mg/dL": (3.5, 7.2)}),
+    "eGFR": (["egfr", "estimated gfr"], {"mL/min/1.73m2": (90, 200)}),
+    "Sodium": (["sodium", "na+", "serum sodium"], {"mmol/L": (135, 145), "mEq/L": (135, 145)}),
+    "Potassium": (["potassium", "k+", "serum potassium"], {"mmol/L": (3.5, 5.1), "mEq/L": (3.5, 5.1)}),
+    "Chloride": (["chloride", "cl-", "serum chloride"], {"mmol/L": (98, 107), "mEq/L": (98, 107)}),
+    "Calcium": (["calcium", "serum calcium", "total calcium"], {"mg/dL": (8.5, 10.5)}),
+    "Total Bilirubin": (["total bilirubin", "bilirubin total", "bilirubin, total", "serum bilirubin", "bilirubin"], {"mg/dL": (0.1, 1.2)}),
+    "Direct Bilirubin": (["direct bilirubin", "bilirubin direct", "bilirubin, direct", "conjugated bilirubin"], {"mg/dL": (0.0, 0.3)}),
+    "ALT (SGPT)": (["alt", "sgpt", "alanine aminotransferase", "alanine transaminase"], {"U/L": (7, 56)}),
+    "AST (SGOT)": (["ast", "sgot", "aspartate aminotransferase", "aspartate transaminase"], {"U/L": (10, 40)}),
+    "Alkaline Phosphatase": (["alkaline phosphatase", "alp"], {"U/L": (44, 147)}),
+    "GGT": (["ggt", "gamma gt", "gamma glutamyl transferase"], {"U/L": (9, 48)}),
+    "Total Protein": (["total protein", "protein total", "serum protein"], {"g/dL": (6.0, 8.3)}),
+    "Albumin": (["albumin", "serum albumin"], {"g/dL": (3.5, 5.5)}),
+    "Globulin": (["globulin"], {"g/dL": (2.0, 3.5)}),
+    "TSH": (["tsh", "thyroid stimulating hormone"], {"uIU/mL": (0.4, 4.0)}),
+    "T3": (["total t3", "t3", "triiodothyronine"], {"ng/dL": (80, 200), "ng/mL": (0.8, 2.0)}),
+    "T4": (["total t4", "t4", "thyroxine"], {"ug/dL": (5.0, 12.0)}),
+    "Free T3": (["free t3", "ft3"], {"pg/mL": (2.3, 4.2)}),
+    "Free T4": (["free t4", "ft4"], {"ng/dL": (0.8, 1.8)}),
+    "Vitamin D": (["vitamin d", "25-oh vitamin d", "25 oh vitamin d", "25-hydroxy vitamin d", "vit d"], {"ng/mL": (30, 100)}),
+    "Vitamin B12": (["vitamin b12", "vit b12", "cobalamin", "b12"], {"pg/mL": (200, 900)}),
+    "Iron": (["serum iron", "iron"], {"ug/dL": (60, 170)}),
+    "Ferritin": (["ferritin", "serum ferritin"], {"ng/mL": (20, 250)}),
+    "CRP": (["c-reactive protein", "c reactive protein", "crp", "hs-crp"], {"mg/L": (0, 5)}),
+}
+
+# Unit spellings seen in reports -> canonical unit
+UNIT_ALIASES = {
+    "g/dl": "g/dL", "gm/dl": "g/dL", "gms/dl": "g/dL", "g/l": "g/L",
+    "mg/dl": "mg/dL", "mg/l": "mg/L", "mmol/l": "mmol/L", "meq/l": "mEq/L",
+    "%": "%", "fl": "fL", "pg": "pg", "u/l": "U/L", "iu/l": "U/L",
+    "mm/hr": "mm/hr", "mm/1st hr": "mm/hr", "mm/h": "mm/hr",
+    "ng/ml": "ng/mL", "pg/ml": "pg/mL", "ng/dl": "ng/dL", "ug/dl": "ug/dL", "µg/dl": "ug/dL", "mcg/dl": "ug/dL",
+    "uiu/ml": "uIU/mL", "µiu/ml": "uIU/mL", "miu/l": "uIU/mL", "miu/ml": "uIU/mL",
+    "10^3/ul": "10^3/uL", "10^3/µl": "10^3/uL", "x10^3/ul": "10^3/uL", "10³/µl": "10^3/uL", "thou/ul": "10^3/uL",
+    "10^9/l": "10^3/uL", "x10^9/l": "10^3/uL",
+    "10^6/ul": "10^6/uL", "10^6/µl": "10^6/uL", "x10^6/ul": "10^6/uL", "10⁶/µl": "10^6/uL", "mill/cumm": "10^6/uL",
+    "million/ul": "10^6/uL", "10^12/l": "10^6/uL",
+    "cells/cumm": "cells/uL", "/cumm": "cells/uL", "cells/ul": "cells/uL", "/ul": "cells/uL", "cumm": "cells/uL",
+    "lakhs/cumm": "lakhs/uL", "lakh/cumm": "lakhs/uL", "lakhs/ul": "lakhs/uL",
+    "ml/min/1.73m2": "mL/min/1.73m2", "ml/min/1.73 m2": "mL/min/1.73m2",
+}
+
+# Longest text we look at after an analyte name for its value/unit/range (cells are often on separate OCR lines)
+MAX_FIELD_CHARS = 160
+
+
+def _trie_regex(words):
+    """One regex for a word list, built from a character trie so shared prefixes are matched once.
+
+    Longer alternatives come first at every node, so "hemoglobin a1c" wins over "hemoglobin".
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        end = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if end else body
+
+    return build(trie)
+
+
+_ALIAS_TO_ANALYTE = {alias: name for name, (aliases, _) in ANALYTES.items() for alias in aliases}
+# Aliases are matched on whole words, case-insensitively, with any whitespace run between words
+_ANALYTE_RE = re.compile(
+    r"(?<![A-Za-z0-9])(" + _trie_regex(sorted(_ALIAS_TO_ANALYTE)).replace(r"\ ", r"\s+") + r")(?![A-Za-z0-9])",
+    re.IGNORECASE,
+)
+_UNIT_RE = re.compile(
+    r"(?<![A-Za-z0-9])(" + _trie_regex(sorted(UNIT_ALIASES)).replace(r"\ ", r"\s*") + r")(?![A-Za-z])",
+    re.IGNORECASE,
+)
+_NUMBER = r"\d{1,3}(?:,\d{2,3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+_VALUE_RE = re.compile(r"(?<![\w.])([<>]=?|≤|≥)?\s*(" + _NUMBER + r")(?![\w.])")
+_RANGE_RE = re.compile(
+    r"(" + _NUMBER + r")\s*(?:-|–|—|to)\s*(" + _NUMBER + r")"
+    r"|(?:<|≤|up\s*to|upto|less\s+than)\s*(" + _NUMBER + r")"
+    r"|(?:>|≥|more\s+than|greater\s+than)\s*(" + _NUMBER + r")",
+    re.IGNORECASE,
+)
+# A flag printed next to the value: High/Low/Critical, or a bare H/L (not the L of "mmol/L")
+_FLAG_RE = re.compile(r"(?<![A-Za-z/])(?:((?i:high|critical))|((?i:low))|(H)|(L))(?![A-Za-z])")
+# A later line starting with a word begins the next row ("PSA 9.8 ..."), unless the word is a
+# unit, a flag or part of a range, i.e. one more cell of this row on its own OCR line
+_WORD_LINE_RE = re.compile(r"\n[ \t]*(?=[^\W\d_]{2})")
+_CELL_WORD_RE = re.compile(r"(?:high|low|critical|normal|abnormal|up\s*to|upto|less\s+than|more\s+than|greater\s+than)\b",
+                           re.IGNORECASE)
+
+
+def _number(text):
+    return float(text.replace(",", ""))
+
+
+def _canonical_unit(raw):
+    raw = re.sub(r"\s+", " ", raw.lower())
+    return UNIT_ALIASES.get(raw) or UNIT_ALIASES.get(raw.replace(" ", ""))
+
+
+class LabValue:
+    __slots__ = ("analyte", "value", "comparator", "unit", "low", "high", "flag", "reference_source", "span")
+
+    def __init__(self, analyte, value, comparator, unit, low, high, flag, reference_source, span=None):
+        self.analyte = analyte
+        self.value = value
+        self.comparator = comparator
+        self.unit = unit
+        self.low = low
+        self.high = high
+        self.flag = flag
+        self.reference_source = reference_source  # "report", "default" or None
+        self.span = span  # (start, end) of the name..value/unit/range text this reading was parsed from
+
+    def reference(self):
+        if self.low is None and self.high is None:
+            return ""
+        if self.low is None:
+            return f"<{self.high:g}"
+        if self.high is None:
+            return f">{self.low:g}"
+        return f"{self.low:g}-{self.high:g}"
+
+    def to_dict(self):
+        return {
+            "analyte": self.analyte,
+            "value": self.value,
+            "comparator": self.comparator,
+            "unit": self.unit,
+            "reference": self.reference(),
+            "reference_source": self.reference_source,
+            "flag": self.flag,
+        }
+
+
+def _row_end(field):
+    """End of the row that starts `field`: the first later line that looks like a new label, else the end."""
+    for m in _WORD_LINE_RE.finditer(field):
+        if not (_UNIT_RE.match(field, m.end()) or _CELL_WORD_RE.match(field, m.end())):
+            return m.start()
+    return len(field)
+
+
+def _parse_field(name, field):
+    """Value, unit, range, printed flag and the end of the parsed text, from the text following an analyte name (or None)."""
+    value_match = None
+    ranges = list(_RANGE_RE.finditer(field))
+    first = _VALUE_RE.search(field)
+    # Prefer a range that doesn't start with the first number: in "< 0.5 mg/L 0-5" the "< 0.5" is the result
+    range_match = next((r for r in ranges if first and not r.start() <= first.start(2) < r.end()), None)
+    range_match = range_match or (ranges[0] if ranges else None)
+    # The result is the first number that isn't part of the reference range
+    for m in _VALUE_RE.finditer(field):
+        if range_match and range_match.start() <= m.start(2) < range_match.end():
+            continue
+        value_match = m
+        break
+    if value_match is None:
+        return None
+    value = _number(value_match.group(2))
+    comparator = value_match.group(1) or ""
+
+    unit = None
+    end = value_match.end()
+    unit_match = _UNIT_RE.search(field, value_match.end()) or _UNIT_RE.search(field)
+    if unit_match is not None:
+        unit = _canonical_unit(unit_match.group(1))
+        end = max(end, unit_match.end())
+
+    low = high = None
+    source = None
+    if range_match:
+        lo, hi, upper, lower = range_match.groups()
+        if lo is not None:
+            low, high = _number(lo), _number(hi)
+        elif upper is not None:
+            high = _number(upper)
+        else:
+            low = _number(lower)
+        source = "report"
+        end = max(end, range_match.end())
+    else:
+        defaults = ANALYTES[name][1]
+        if unit in defaults:
+            low, high = defaults[unit]
+            source = "default"
+        elif unit is None and len(defaults) == 1:
+            # No unit printed: only trust the default if the value is plausible for it
+            (default_unit, (d_low, d_high)), = defaults.items()
+            if d_high and 0 < value < d_high * 10:
+                unit, low, high, source = default_unit, d_low, d_high, "default"
+
+    flag = ""
+    if low is not None and value < low:
+        flag = "L"
+    elif high is not None and value > high:
+        flag = "H"
+    elif low is None and high is None:
+        # No range to compare against; keep a flag the lab printed right after the value
+        printed = _FLAG_RE.search(field, value_match.end(), value_match.end() + 24)
+        if printed:
+            flag = "H" if printed.group(1) or printed.group(3) else "L"
+            end = max(end, printed.end())
+    return value, comparator, unit, low, high, flag, source, end
+
+
+def extract_lab_values(text):
+    """All analyte readings in `text`, in order of appearance.
+
+    One scan of the alias regex finds every analyte name; each reading is parsed from
+    the (bounded) text up to the next analyte name, so the whole pass is linear.
+    Repeated analytes (e.g. a panel printed on two pages) keep their first reading;
+    later ones are left for remaining_text().
+    """
+    matches = list(_ANALYTE_RE.finditer(text))
+    values = []
+    seen = set()
+    for i, m in enumerate(matches):
+        name = _ALIAS_TO_ANALYTE.get(re.sub(r"\s+", " ", m.group(1).lower()))
+        if name is None or name in seen:
+            continue
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        field = text[m.end():min(end, m.end() + MAX_FIELD_CHARS)]
+        field = field[:_row_end(field)]
+        parsed = _parse_field(name, field)
+        if parsed is None:
+            continue
+        seen.add(name)
+        *fields, end = parsed
+        values.append(LabValue(name, *fields, span=(m.start(), m.end() + end)))
+    return values
+
+
+def remaining_text(text, values):
+    """`text` without the parts that became table rows: other analytes, repeats, comments, impressions.
+
+    Lines left with no letters or digits (separators, emptied table rows) are dropped.
+    """
+    parts, pos = [], 0
+    for v in sorted((v for v in values if v.span), key=lambda v: v.span[0]):
+        start, end = v.span
+        if start >= pos:
+            parts.append(text[pos:start])
+            pos = end
+    parts.append(text[pos:])
+    lines = (" ".join(line.split()) for line in "".join(parts).splitlines())
+    return "\n".join(line for line in lines if any(ch.isalnum() for ch in line))
+
+
+def format_table(values):
+    """Compact pipe table for the LLM prompt; abnormal rows are marked in the Flag column.
+
+    Ranges the report did not print are marked "default" (generic adult range, not sex- or age-specific).
+    """
+    lines = ["Analyte | Value | Unit | Reference | Flag"]
+    for v in values:
+        ref = v.reference() + (" (default)" if v.reference_source == "default" else "")
+        lines.append(f"{v.analyte} | {v.comparator}{v.value:g} | {v.unit or ''} | {ref} | {v.flag}")
+    return "\n".join(lines)
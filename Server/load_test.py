@@ -0,0 +1,457 @@
+import argparse
+import base64
+import io
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Load test for the Python services: concurrent request mixes with p50/p95/p99 latency,
+# throughput, per-stage breakdown and time-to-first-token for streamed interpretations.
+# Run the services against stub_servers.py so no network or Gemini quota is needed.
+# Usage:
+#   python load_test.py --smoke                                   # one request per kind
+#   python load_test.py --concurrency 16 --duration 60 --mix xray_512=3,chat=2,lab_pdf=1
+#   python load_test.py --json --save baseline.json
+#   python load_test.py --compare baseline.json [--threshold 0.1]  # exit 1 on regression
+
+XRAY_SIZES = (224, 512, 1024, 2048)
+DEFAULT_MIX = "xray_512=3,xray_1024=1,lab_image=1,lab_pdf=1,chat=3,report=2,report_stream=1"
+
+LAB_REPORT_LINES = [
+    "COMPLETE BLOOD COUNT",
+    "Test Name            Result   Unit        Reference Range",
+    "Hemoglobin           11.2     g/dL        13.0 - 17.0",
+    "Total Leukocyte Count 12500   cells/cumm  4000 - 11000",
+    "Platelet Count       250000   /cumm       150000 - 410000",
+    "MCV                  88       fL          83 - 101",
+    "Fasting Blood Sugar  126      mg/dL       70 - 100",
+    "Serum Creatinine     1.1      mg/dL       0.7 - 1.3",
+    "TSH                  5.6      uIU/mL      0.4 - 4.0",
+    "LDL Cholesterol      160      mg/dL       < 100",
+]
+
+CHAT_QUERIES = [
+    "I have had a mild headache since morning, what should I do?",
+    "What foods help with low hemoglobin?",
+    "Is it normal to feel tired after a fever?",
+    "How much water should I drink every day?",
+]
+
+
+# ------------------ Payloads ------------------
+def _jpeg(size, seed):
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("L", (size, size), color=20)
+    draw = ImageDraw.Draw(image)
+    # A rough chest-film silhouette so decoders and resizers do real work
+    for _ in range(40):
+        x, y = rng.randrange(size), rng.randrange(size)
+        r = rng.randrange(size // 20 + 1, size // 4 + 2)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=rng.randrange(60, 220))
+    out = io.BytesIO()
+    image.convert("RGB").save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _lab_image():
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (1240, 40 + 40 * len(LAB_REPORT_LINES)), color="white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(LAB_REPORT_LINES):
+        draw.text((40, 30 + 40 * i), line, fill="black")
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def _lab_pdf(pages):
+    """A text-layer PDF (the extraction fast path); falls back to an image-only PDF without PyMuPDF."""
+    try:
+        import fitz
+    except ImportError:
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(_lab_image()))
+        out = io.BytesIO()
+        image.save(out, format="PDF", save_all=True, append_images=[image] * (pages - 1))
+        return out.getvalue()
+
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        page.insert_text((40, 60), f"Page {page_number + 1}\n" + "\n".join(LAB_REPORT_LINES), fontsize=10)
+    return doc.tobytes()
+
+
+class Payloads:
+    """Builds each payload once. With `unique`, every request gets distinct bytes/text so result caches miss."""
+
+    def __init__(self, unique=True, pdf_pages=3):
+        self.unique = unique
+        self.jpegs = {size: _jpeg(size, size) for size in XRAY_SIZES}
+        self.lab_image = _lab_image()
+        self.lab_pdf = _lab_pdf(pdf_pages)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def tag(self):
+        if not self.unique:
+            return 0
+        with self._lock:
+            return next(self._counter)
+
+    def blob(self, data):
+        # Trailing bytes after the JPEG EOI / PNG IEND / PDF %%EOF are ignored by decoders but change the cache key
+        tag = self.tag()
+        return data + f"\n{tag}".encode() if self.unique else data
+
+    def text(self, text):
+        tag = self.tag()
+        return f"{text} (#{tag})" if self.unique else text
+
+
+# ------------------ Requests ------------------
+class Outcome:
+    __slots__ = ("kind", "ok", "status", "latency_ms", "ttft_ms", "stages", "error")
+
+    def __init__(self, kind, ok, status, latency_ms, ttft_ms=None, stages=None, error=None):
+        self.kind = kind
+        self.ok = ok
+        self.status = status
+        self.latency_ms = latency_ms
+        self.ttft_ms = ttft_ms
+        self.stages = stages or {}
+        self.error = error
+
+
+def parse_server_timing(header):
+    """{"name": ms} from a Server-Timing header ("db;dur=12.3, ocr;dur=80")."""
+    stages = {}
+    for entry in (header or "").split(","):
+        parts = [p.strip() for p in entry.split(";")]
+        if not parts[0]:
+            continue
+        for param in parts[1:]:
+            if param.startswith("dur="):
+                try:
+                    stages[parts[0]] = float(param[4:])
+                except ValueError:
+                    pass
+    return stages
+
+
+class Runner:
+    def __init__(self, urls, payloads, timeout=120.0, language="english"):
+        self.urls = urls
+        self.payloads = payloads
+        self.timeout = timeout
+        self.language = language
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # One keep-alive session per load thread
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, kind):
+        """Sends one request of `kind` and returns its Outcome."""
+        start = time.perf_counter()
+        try:
+            status, ttft, stages, error = self._send(kind, start)
+        except requests.RequestException as e:
+            return Outcome(kind, False, None, (time.perf_counter() - start) * 1000.0, error=str(e))
+        latency = (time.perf_counter() - start) * 1000.0
+        ok = status == 200 and error is None
+        return Outcome(kind, ok, status, latency, ttft, stages, error)
+
+    def _send(self, kind, start):
+        if kind.startswith("xray_"):
+            image = self.payloads.blob(self.payloads.jpegs[int(kind[5:])])
+            body = {"payload": {"image_base64": base64.b64encode(image).decode("ascii"), "body_part": "chest"}}
+            response = self.session.post(f"{self.urls['xray']}/predict", json=body, timeout=self.timeout)
+            return self._finish(response)
+
+        if kind in ("lab_image", "lab_pdf"):
+            data, name = (self.payloads.lab_image, "report.png") if kind == "lab_image" else (self.payloads.lab_pdf, "report.pdf")
+            files = [("files", (name, self.payloads.blob(data)))]
+            response = self.session.post(f"{self.urls['lab']}/parse", files=files, timeout=self.timeout)
+            return self._finish(response)
+
+        if kind == "chat":
+            body = {"username": "LoadTest", "language": self.language, "type": "chat",
+                    "query": self.payloads.text(random.choice(CHAT_QUERIES))}
+            response = self.session.post(f"{self.urls['interpreter']}/interpret", json=body, timeout=self.timeout)
+            return self._finish(response)
+
+        if kind in ("report", "report_stream"):
+            predictions = json.dumps({"message": "Prediction successful", "prediction": [[0.82, 0.18]],
+                                      "note": self.payloads.text("load test")})
+            body = {"username": "LoadTest", "language": self.language, "type": "report", "predictions": predictions}
+            if kind == "report":
+                response = self.session.post(f"{self.urls['interpreter']}/interpret", json=body, timeout=self.timeout)
+                return self._finish(response)
+            body["stream"] = True
+            return self._stream(f"{self.urls['interpreter']}/interpret", body, start)
+
+        if kind == "analyze":
+            files = [
+                ("xray", ("film.jpg", self.payloads.blob(self.payloads.jpegs[512]))),
+                ("files", ("report.pdf", self.payloads.blob(self.payloads.lab_pdf))),
+            ]
+            data = {"username": "LoadTest", "language": self.language}
+            response = self.session.post(f"{self.urls['analyze']}/analyze", files=files, data=data, timeout=self.timeout)
+            status, ttft, stages, error = self._finish(response)
+            if status == 200:
+                # Stage timings measured inside the pipeline
+                stages.update(response.json().get("timings_ms", {}))
+            return status, ttft, stages, error
+
+        raise ValueError(f"Unknown request kind: {kind}")
+
+    @staticmethod
+    def _finish(response):
+        content = response.content  # read the whole body before stopping the clock
+        error = None if response.status_code == 200 else content[:200].decode("utf-8", "replace")
+        return response.status_code, None, parse_server_timing(response.headers.get("Server-Timing")), error
+
+    def _stream(self, url, body, start):
+        """Reads the SSE response; TTFT is the time to the first model text ("chunk" event)."""
+        ttft = None
+        error = None
+        with self.session.post(url, json=body, timeout=self.timeout, stream=True,
+                               headers={"Accept": "text/event-stream"}) as response:
+            if response.status_code != 200:
+                return response.status_code, None, {}, response.text[:200]
+            for line in response.iter_lines(decode_unicode=True):
+                if ttft is None and line == "event: chunk":
+                    ttft = (time.perf_counter() - start) * 1000.0
+                elif line == "event: error":
+                    error = "stream error event"
+            stages = parse_server_timing(response.headers.get("Server-Timing"))
+        return response.status_code, ttft, stages, error
+
+
+# ------------------ Scheduling ------------------
+def parse_mix(spec):
+    """"xray_512=3,chat=1" -> [("xray_512", 3.0), ("chat", 1.0)]"""
+    mix = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition("=")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def run_load(runner, mix, concurrency, total=None, duration=None, seed=1):
+    """Closed loop: `concurrency` threads each send the next request as soon as their last one finishes."""
+    rng = random.Random(seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    lock = threading.Lock()
+    issued = itertools.count()
+    outcomes = []
+    deadline = time.monotonic() + duration if duration else None
+
+    def next_kind():
+        with lock:
+            if total is not None and next(issued) >= total:
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            return rng.choices(names, weights)[0]
+
+    def worker():
+        while True:
+            kind = next_kind()
+            if kind is None:
+                return
+            outcome = runner.request(kind)
+            with lock:
+                outcomes.append(outcome)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return outcomes, time.perf_counter() - start
+
+
+# ------------------ Reporting ------------------
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "mean": round(sum(ordered) / len(ordered), 2), "max": round(ordered[-1], 2)}
+
+
+def summarize(outcomes, elapsed, config):
+    kinds = {}
+    for kind in sorted({o.kind for o in outcomes}):
+        rows = [o for o in outcomes if o.kind == kind]
+        ok = [o for o in rows if o.ok]
+        statuses = {}
+        for o in rows:
+            statuses[str(o.status)] = statuses.get(str(o.status), 0) + 1
+        stage_names = sorted({name for o in ok for name in o.stages})
+        kinds[kind] = {
+            "count": len(rows),
+            "errors": len(rows) - len(ok),
+            "status": statuses,
+            "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else None,
+            "latency_ms": percentiles([o.latency_ms for o in ok]),
+            "ttft_ms": percentiles([o.ttft_ms for o in ok if o.ttft_ms is not None]),
+            "stages_ms": {name: percentiles([o.stages[name] for o in ok if name in o.stages]) for name in stage_names},
+            "sample_errors": sorted({o.error for o in rows if o.error})[:3],
+        }
+    ok = [o for o in outcomes if o.ok]
+    return {
+        "config": config,
+        "elapsed_s": round(elapsed, 3),
+        "requests": len(outcomes),
+        "errors": len(outcomes) - len(ok),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else None,
+        "latency_ms": percentiles([o.latency_ms for o in ok]),
+        "kinds": kinds,
+    }
+
+
+def print_report(report):
+    print(f"\n{report['requests']} requests in {report['elapsed_s']}s, {report['errors']} errors, "
+          f"{report['throughput_rps']} req/s (concurrency {report['config']['concurrency']})")
+    print(f"{'kind':>14} {'count':>6} {'err':>4} {'req/s':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'ttft p50':>9}")
+    for kind, row in report["kinds"].items():
+        lat = row["latency_ms"] or {}
+        ttft = (row["ttft_ms"] or {}).get("p50")
+        print(f"{kind:>14} {row['count']:>6} {row['errors']:>4} {row['throughput_rps'] or 0:>7.2f} "
+              f"{lat.get('p50', 0):>7.1f}ms {lat.get('p95', 0):>7.1f}ms {lat.get('p99', 0):>7.1f}ms "
+              f"{(f'{ttft:.1f}ms' if ttft is not None else '-'):>9}")
+        for stage, stats in row["stages_ms"].items():
+            print(f"{'':>14}   {stage:<22} p50 {stats['p50']:>8.1f}ms  p95 {stats['p95']:>8.1f}ms")
+        for error in row["sample_errors"]:
+            print(f"{'':>14}   ⚠️ {error[:120]}")
+
+
+def compare(report, baseline, threshold):
+    """Regressions against a saved report: latency percentiles up or throughput down by more than `threshold`."""
+    regressions = []
+    for kind, row in report["kinds"].items():
+        old = baseline.get("kinds", {}).get(kind)
+        if not old:
+            continue
+        for metric in ("latency_ms", "ttft_ms"):
+            for q in ("p50", "p95", "p99"):
+                new_v = (row.get(metric) or {}).get(q)
+                old_v = (old.get(metric) or {}).get(q)
+                if new_v is not None and old_v and new_v > old_v * (1 + threshold):
+                    regressions.append(f"{kind} {metric} {q}: {old_v} -> {new_v} (+{(new_v / old_v - 1) * 100:.0f}%)")
+        new_rps, old_rps = row.get("throughput_rps"), old.get("throughput_rps")
+        if new_rps is not None and old_rps and new_rps < old_rps * (1 - threshold):
+            regressions.append(f"{kind} throughput: {old_rps} -> {new_rps} req/s ({(new_rps / old_rps - 1) * 100:.0f}%)")
+        if row["errors"] > old.get("errors", 0):
+            regressions.append(f"{kind} errors: {old.get('errors', 0)} -> {row['errors']}")
+    return regressions
+
+
+def smoke(runner, kinds):
+    """One request per kind, printed as it completes; returns the number of failures."""
+    failed = 0
+    for kind in kinds:
+        outcome = runner.request(kind)
+        mark = "✅" if outcome.ok else "❌"
+        detail = f"ttft {outcome.ttft_ms:.0f}ms" if outcome.ttft_ms is not None else ""
+        print(f"{mark} {kind:<14} status={outcome.status} {outcome.latency_ms:.0f}ms {detail} {outcome.error or ''}")
+        failed += not outcome.ok
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MEDISCOPE load test")
+    parser.add_argument("--xray-url", default=os.getenv("XRAY_URL", "http://127.0.0.1:5000"))
+    parser.add_argument("--lab-url", default=os.getenv("LAB_URL", "http://127.0.0.1:5001"))
+    parser.add_argument("--interpreter-url", default=os.getenv("INTERPRETER_URL", "http://127.0.0.1:5002"))
+    parser.add_argument("--analyze-url", default=os.getenv("ANALYZE_URL", "http://127.0.0.1:5003"))
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"kind=weight list; kinds: {', '.join(f'xray_{s}' for s in XRAY_SIZES)}, "
+                             "lab_image, lab_pdf, chat, report, report_stream, analyze")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead of a request count")
+    parser.add_argument("--warmup", type=int, default=1, help="Unrecorded requests per kind before the run")
+    parser.add_argument("--language", default="english", help="Interpretation language (exercises translation)")
+    parser.add_argument("--pdf-pages", type=int, default=3)
+    parser.add_argument("--cache-hits", action="store_true", help="Repeat identical payloads instead of unique ones")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--smoke", action="store_true", help="Send one request per kind and exit")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    parser.add_argument("--save", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline JSON report; exit 1 if this run regresses against it")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed regression as a fraction")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    urls = {
+        "xray": args.xray_url.rstrip("/"),
+        "lab": args.lab_url.rstrip("/"),
+        "interpreter": args.interpreter_url.rstrip("/"),
+        "analyze": args.analyze_url.rstrip("/"),
+    }
+    runner = Runner(urls, Payloads(unique=not args.cache_hits, pdf_pages=args.pdf_pages), args.timeout, args.language)
+
+    if args.smoke:
+        sys.exit(1 if smoke(runner, [name for name, _ in mix]) else 0)
+
+    for name, _ in mix:
+        for _ in range(args.warmup):
+            runner.request(name)
+
+    config = {"mix": args.mix, "concurrency": args.concurrency, "requests": None if args.duration else args.requests,
+              "duration_s": args.duration, "language": args.language, "cache_hits": args.cache_hits,
+              "pdf_pages": args.pdf_pages}
+    outcomes, elapsed = run_load(runner, mix, args.concurrency, None if args.duration else args.requests,
+                                 args.duration, args.seed)
+    report = summarize(outcomes, elapsed, config)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+        if args.compare:
+            print(f"\n{len(regressions)} regressions vs {args.compare} (threshold {args.threshold:.0%})")
+            for line in regressions:
+                print(f"  ❌ {line}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# Local model cache: checksummed, atomic, resumable downloads
+import os
+import hashlib
+import logging
+from contextlib import contextmanager
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock; fine for the single-process dev server
+    fcntl = None
+
+logger = logging.getLogger("MEDISCOPE_ModelCache")
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def sha256_file(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelCache:
+    """Keeps model files in `cache_dir`, downloading them only when missing or corrupt.
+
+    - Downloads go to `<name>.part` and are renamed into place only after they verify,
+      so a crash mid-download never leaves a truncated model under the real name.
+    - An interrupted `.part` file is resumed with an HTTP Range request. If-Range carries the
+      ETag/Last-Modified of the first response, so a file that changed upstream starts over.
+    - Fetches of one file are serialized across processes by an flock on `<name>.lock`:
+      gunicorn workers all load the model at boot, and only the first one downloads.
+    - Every cached file has a `<name>.sha256` sidecar; with no pinned checksum the
+      sidecar written at download time is what later cold starts verify against.
+    - In offline mode the network is never touched: a missing file is a cache miss.
+    """
+
+    def __init__(self, cache_dir, offline=False, chunk_size=CHUNK_SIZE, timeout=120, session=None):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, filename):
+        return os.path.join(self.cache_dir, filename)
+
+    @contextmanager
+    def _locked(self, filename):
+        # flock locks belong to the open file, so this also serializes threads of one process
+        if fcntl is None:
+            yield
+            return
+        with open(self.path_for(filename) + ".lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def invalidate(self, filename):
+        with self._locked(filename):
+            self._evict(filename)
+
+    def _evict(self, filename):
+        for path in (self.path_for(filename), self.path_for(filename) + ".sha256"):
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info(f"🗑️ Evicted {filename} from model cache")
+
+    @staticmethod
+    def _discard_part(path):
+        for leftover in (path + ".part", path + ".part.validator"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    # ------------------ Verification ------------------
+    def _expected_digest(self, path, sha256):
+        if sha256:
+            return sha256.lower()
+        sidecar = path + ".sha256"
+        if os.path.exists(sidecar):
+            with open(sidecar) as f:
+                return f.read().strip().lower() or None
+        return None
+
+    def _verify(self, path, sha256):
+        expected = self._expected_digest(path, sha256)
+        if expected is None:
+            return True
+        actual = sha256_file(path, self.chunk_size)
+        if actual != expected:
+            logger.warning(f"⚠️ Checksum mismatch for {path}: expected {expected[:12]}…, got {actual[:12]}…")
+            return False
+        return True
+
+    def _write_sidecar(self, path, digest):
+        tmp = path + ".sha256.part"
+        with open(tmp, "w") as f:
+            f.write(digest + "\n")
+        os.replace(tmp, path + ".sha256")
+
+    # ------------------ Public API ------------------
+    def cached_digest(self, filename):
+        """SHA-256 recorded for a cached file (from its sidecar, without re-hashing), or None if not cached."""
+        path = self.path_for(filename)
+        if not os.path.exists(path):
+            return None
+        return self._expected_digest(path, None)
+
+    def fetch(self, url, filename, sha256=None):
+        """Return a verified local path for `filename`, downloading from `url` if needed.
+
+        Returns None when the file is unavailable (offline miss or failed download).
+        """
+        # Checked under the lock: a worker that waited on another's download finds the file here
+        with self._locked(filename):
+            return self._fetch(url, filename, sha256)
+
+    def _fetch(self, url, filename, sha256):
+        path = self.path_for(filename)
+
+        if os.path.exists(path):
+            if self._verify(path, sha256):
+                logger.info(f"✅ Model cache hit: {path}")
+                return path
+            self._evict(filename)
+
+        if self.offline:
+            logger.warning(f"⚠️ Offline mode: {filename} is not in the model cache ({self.cache_dir})")
+            return None
+
+        try:
+            digest = self._download(url, path)
+        except Exception as e:
+            logger.error(f"❌ Failed to download model: {e}")
+            return None
+
+        if sha256 and digest != sha256.lower():
+            logger.error(f"❌ Downloaded {filename} failed SHA-256 verification; discarding")
+            self._discard_part(path)
+            return None
+
+        self._write_sidecar(path, digest)
+        os.replace(path + ".part", path)
+        self._discard_part(path)
+        logger.info(f"✅ Model downloaded to {path}")
+        return path
+
+    @staticmethod
+    def _validator(response):
+        # If-Range needs a strong ETag or a Last-Modified date
+        etag = response.headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return response.headers.get("Last-Modified")
+
+    def _download(self, url, path):
+        part = path + ".part"
+        validator = None
+        if os.path.exists(part + ".validator"):
+            with open(part + ".validator") as f:
+                validator = f.read().strip() or None
+        # Without a validator there's no telling whether the bytes on disk are from the same file
+        offset = os.path.getsize(part) if validator and os.path.exists(part) else 0
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset else {}
+
+        logger.info(f"🌐 Downloading model from {url} ..." + (f" (resuming at {offset} bytes)" if offset else ""))
+        with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as r:
+            if offset and r.status_code == 416:
+                # The partial file is already complete
+                return sha256_file(part, self.chunk_size)
+            r.raise_for_status()
+            if offset and r.status_code != 206:
+                # Server ignored the Range header, or the file changed since (If-Range); start over
+                offset = 0
+            if not offset:
+                validator = self._validator(r)
+                if validator:
+                    with open(part + ".validator", "w") as f:
+                        f.write(validator + "\n")
+                elif os.path.exists(part + ".validator"):
+                    os.remove(part + ".validator")
+
+            digest = hashlib.sha256()
+            if offset:
+                with open(part, "rb") as f:
+                    for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                        digest.update(chunk)
+
+            with open(part, "ab" if offset else "wb") as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        digest.update(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        return digest.hexdigest()
@@ -0,0 +1,182 @@
+# In-process analysis pipeline: X-ray, lab OCR and interpretation without HTTP hops
+import json
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import observe
+
+logger = logging.getLogger("MEDISCOPE_Orchestrator")
+
+
+def _gateway_number(text):
+    # JSON.stringify writes 1.0 as 1, which /interpret then parses back as an int
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def gateway_content(micro_response):
+    """The Interpreter content the gateway flow builds from a microservice response.
+
+    The service answers through Flask's jsonify (keys sorted), Server.js re-stringifies the parsed
+    body, and /interpret re-dumps it with indent=2. Matching it byte for byte keeps the prompt and
+    the interpretation cache key the same for /analyze and the two-hop flow.
+    """
+    relayed = json.loads(json.dumps(micro_response, sort_keys=True), parse_float=_gateway_number)
+    return json.dumps(relayed, indent=2)
+
+
+class Components:
+    """The blocking stage functions the pipeline drives.
+
+    - predict_xray(image_bytes) -> prediction dict (XrayMicroservice.predict_image)
+    - extract_lab(files) -> (combined_text, diagnostics); files are (bytes, filename) pairs
+    - summarize_lab(text) -> summary string
+    - interpret(username, content, mode, language) -> response string
+    """
+
+    def __init__(self, predict_xray, extract_lab, summarize_lab, interpret):
+        self.predict_xray = predict_xray
+        self.extract_lab = extract_lab
+        self.summarize_lab = summarize_lab
+        self.interpret = interpret
+
+
+def local_components():
+    """Components backed by the service modules, imported (and their models loaded) in this process."""
+    import Interpreter
+    import LabMicroservice
+    import XrayMicroservice
+
+    return Components(
+        predict_xray=XrayMicroservice.predict_image,
+        extract_lab=LabMicroservice.extract_uploads,
+        summarize_lab=LabMicroservice.summarize_with_gemini,
+        interpret=Interpreter.generate_health_response,
+    )
+
+
+def stub_components(delay_ms=0.0):
+    """Deterministic offline stand-ins; each stage sleeps `delay_ms` to mimic its latency."""
+    delay = max(float(delay_ms), 0.0) / 1000.0
+
+    def predict_xray(image_bytes):
+        time.sleep(delay)
+        score = (sum(image_bytes[:64]) % 100) / 100.0
+        prediction = [[round(score, 4), round(1.0 - score, 4)]]
+        return {"prediction": prediction, "raw_output": str(prediction)}
+
+    def extract_lab(files):
+        time.sleep(delay)
+        text = "".join(f"\n=== {name} ===\nStub text ({len(data)} bytes)\n" for data, name in files)
+        diagnostics = {name: {"status": "success", "text_length": len(data)} for data, name in files}
+        return text, diagnostics
+
+    def summarize_lab(text):
+        time.sleep(delay)
+        return f"Stub summary of {len(text)} characters."
+
+    def interpret(username, content, mode="report", language="english"):
+        time.sleep(delay)
+        return f"👋 Hello {username},\n\nStub interpretation ({mode}, {language}) of {len(content)} characters."
+
+    return Components(predict_xray, extract_lab, summarize_lab, interpret)
+
+
+class AnalysisPipeline:
+    """Runs the X-ray and lab branches concurrently and interprets each as soon as its input is ready.
+
+    X-ray: predict -> interpret.  Lab: OCR -> summarize -> interpret.
+    The stages are blocking calls, so each one runs on `executor`; asyncio only
+    schedules them. Interpreter content is serialized once, exactly as the gateway
+    flow would have it after /interpret re-parses it (see gateway_content).
+    """
+
+    def __init__(self, components, max_workers=8):
+        self.components = components
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analyze")
+
+    async def _run(self, timings, stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            timings[stage] = round(elapsed, 2)
+            # Per-film stages ("xray_predict_0", ...) share one histogram
+            observe(f"analyze.{stage.rstrip('0123456789_')}", elapsed)
+
+    async def _xray_branch(self, images, username, language, timings):
+        # Several films go through the batcher together; each prediction call joins the same micro-batch
+        predictions = await asyncio.gather(*[
+            self._run(timings, f"xray_predict_{i}", self.components.predict_xray, data)
+            for i, (data, _) in enumerate(images)
+        ], return_exceptions=True)
+        # Same shapes as /predict and /predict_batch, so the interpretation prompt matches the gateway flow
+        if len(images) == 1:
+            if isinstance(predictions[0], Exception):
+                raise predictions[0]
+            micro_response = {"message": "Prediction successful", **predictions[0]}
+        else:
+            results = []
+            for i, ((_, name), prediction) in enumerate(zip(images, predictions)):
+                if isinstance(prediction, Exception):
+                    # One unreadable film is a failed item, as in /predict_batch
+                    logger.warning(f"⚠️ Could not predict image {i} ({name}): {prediction}")
+                    results.append({"index": i, "name": name, "status": "failed", "error": str(prediction)})
+                else:
+                    results.append({"index": i, "name": name, "status": "success", **prediction})
+            micro_response = {
+                "message": "Batch prediction complete",
+                "count": len(results),
+                "failed": sum(1 for r in results if r["status"] == "failed"),
+                "results": results,
+            }
+        content = gateway_content(micro_response)
+        interpretation = await self._run(
+            timings, "xray_interpret", self.components.interpret, username, content, "report", language
+        )
+        return {**micro_response, "interpretation": interpretation}
+
+    async def _lab_branch(self, files, username, language, timings):
+        text, diagnostics = await self._run(timings, "lab_extract", self.components.extract_lab, files)
+        summary = await self._run(timings, "lab_summarize", self.components.summarize_lab, text)
+        micro_response = {"message": "Parsed successfully (uploaded)", "diagnostics": diagnostics, "summary": summary}
+        content = gateway_content(micro_response)
+        interpretation = await self._run(
+            timings, "lab_interpret", self.components.interpret, username, content, "report", language
+        )
+        return {**micro_response, "interpretation": interpretation}
+
+    async def analyze(self, images=(), lab_files=(), username="Patient", language="english"):
+        """`images` and `lab_files` are (bytes, filename) pairs. Returns a dict per branch plus timings.
+
+        A failing branch is reported as {"error": ...} without cancelling the other one.
+        """
+        timings = {}
+        start = time.perf_counter()
+        branches = {}
+        if images:
+            branches["xray"] = self._xray_branch(list(images), username, language, timings)
+        if lab_files:
+            branches["lab"] = self._lab_branch(list(lab_files), username, language, timings)
+
+        outcomes = await asyncio.gather(*branches.values(), return_exceptions=True)
+        result = {}
+        for name, outcome in zip(branches, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"❌ {name} branch failed: {outcome}")
+                result[name] = {"error": str(outcome)}
+            else:
+                result[name] = outcome
+        timings["total"] = round((time.perf_counter() - start) * 1000.0, 2)
+        result["timings_ms"] = timings
+        return result
+
+    def analyze_sync(self, images=(), lab_files=(), username="Patient", language="english"):
+        """Blocking wrapper for WSGI views and scripts."""
+        return asyncio.run(self.analyze(images, lab_files, username, language))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
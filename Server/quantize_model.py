@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from xray_backends import (
+    BACKEND_DIR,
+    QUANTIZED_VARIANTS,
+    KerasBackend,
+    TFLiteBackend,
+    default_artifact_path,
+    load_calibration_batches,
+    quantize_model,
+)
+
+# Post-training quantization for the X-ray model
+#
+# Build variants (int8 needs a directory of representative X-rays for calibration):
+#   python quantize_model.py build --model /tmp/final_best_model.keras --calibration ./calib
+# Compare them against the float model on a local image set:
+#   python quantize_model.py report --model /tmp/final_best_model.keras --images ./eval [--json]
+#
+# Serve a variant with XRAY_MODEL_VARIANT=dynamic|float16|int8 (same XRAY_BACKEND_DIR).
+
+
+def _rss_mb():
+    # Resident set size of this process, Linux only
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return float("nan")
+
+
+def _load_keras(path):
+    from tensorflow.keras.models import load_model
+
+    return load_model(path, compile=False)
+
+
+def _eval_images(image_dir, limit):
+    return np.concatenate(list(load_calibration_batches(image_dir, limit=limit)))
+
+
+def _latency_ms(backend, images, batch_size, repeat):
+    backend.predict(images[:batch_size])  # warm-up
+    samples = []
+    for _ in range(repeat):
+        for start in range(0, len(images), batch_size):
+            batch = images[start:start + batch_size]
+            t0 = time.perf_counter()
+            backend.predict(batch)
+            samples.append((time.perf_counter() - t0) * 1000.0 / len(batch))
+    samples.sort()
+    return samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+def label_agreement(got, expected, threshold=0.5):
+    """Fraction of images given the same label as the float model.
+
+    A single (sigmoid) output is thresholded; several outputs are compared by argmax.
+    """
+    got = np.asarray(got).reshape(len(got), -1)
+    expected = np.asarray(expected).reshape(len(expected), -1)
+    if got.shape[1] == 1:
+        return float(((got[:, 0] >= threshold) == (expected[:, 0] >= threshold)).mean())
+    return float((got.argmax(axis=1) == expected.argmax(axis=1)).mean())
+
+
+def build(args):
+    model = _load_keras(args.model)
+    for variant in args.variants:
+        calibration = None
+        if variant == "int8":
+            if not args.calibration:
+                print("Skipping int8: --calibration DIR is required")
+                continue
+            calibration = load_calibration_batches(args.calibration, limit=args.calibration_limit)
+        path = os.path.join(args.out, os.path.basename(default_artifact_path("tflite", variant)))
+        quantize_model(model, variant, path, calibration)
+        print(f"{variant}: {path} ({os.path.getsize(path) / 1e6:.2f} MB)")
+
+
+def report(args):
+    images = _eval_images(args.images, args.limit)
+
+    rss_before = _rss_mb()
+    reference = KerasBackend(_load_keras(args.model))
+    expected = reference.predict(images)
+    rows = {"float": {
+        "size_mb": round(os.path.getsize(args.model) / 1e6, 3),
+        "rss_delta_mb": round(_rss_mb() - rss_before, 1),
+    }}
+    rows["float"]["p50_ms"], rows["float"]["p95_ms"] = _latency_ms(reference, images, args.batch_size, args.repeat)
+
+    for variant in args.variants:
+        path = os.path.join(args.out, os.path.basename(default_artifact_path("tflite", variant)))
+        if not os.path.exists(path):
+            rows[variant] = {"error": f"missing {path}; run 'build' first"}
+            continue
+        rss_before = _rss_mb()
+        backend = TFLiteBackend(path)
+        got = backend.predict(images)
+        rss_delta = _rss_mb() - rss_before
+        p50, p95 = _latency_ms(backend, images, args.batch_size, args.repeat)
+        deviation = np.abs(got - expected)
+        rows[variant] = {
+            "size_mb": round(os.path.getsize(path) / 1e6, 3),
+            "rss_delta_mb": round(rss_delta, 1),
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "max_abs_diff": float(deviation.max()),
+            "mean_abs_diff": float(deviation.mean()),
+            "label_agreement": label_agreement(got, expected, args.threshold),
+        }
+
+    if args.json:
+        print(json.dumps({"images": int(len(images)), "variants": rows}, indent=2))
+        return
+
+    print(f"Evaluated on {len(images)} images (per-image latency, batch size {args.batch_size})")
+    print(f"{'variant':>8} {'size MB':>8} {'RSS +MB':>8} {'p50 ms':>8} {'p95 ms':>8} {'max diff':>9} {'mean diff':>10} {'labels':>6}")
+    for name, r in rows.items():
+        if "error" in r:
+            print(f"{name:>8} {r['error']}")
+            continue
+        print(
+            f"{name:>8} {r['size_mb']:>8.2f} {r['rss_delta_mb']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+            f"{r.get('max_abs_diff', 0.0):>9.5f} {r.get('mean_abs_diff', 0.0):>10.6f} {r.get('label_agreement', 1.0):>6.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the X-ray model and measure the accuracy/latency trade-off")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Write quantized TFLite variants")
+    p_build.add_argument("--model", default="/tmp/final_best_model.keras")
+    p_build.add_argument("--calibration", default=None, help="Directory of representative X-rays (int8)")
+    p_build.add_argument("--calibration-limit", type=int, default=200)
+    p_build.add_argument("--variants", nargs="+", choices=QUANTIZED_VARIANTS, default=list(QUANTIZED_VARIANTS))
+    p_build.add_argument("--out", default=BACKEND_DIR)
+    p_build.set_defaults(func=build)
+
+    p_report = sub.add_parser("report", help="Compare variants against the float model")
+    p_report.add_argument("--model", default="/tmp/final_best_model.keras")
+    p_report.add_argument("--images", required=True, help="Directory of evaluation X-rays")
+    p_report.add_argument("--limit", type=int, default=200)
+    p_report.add_argument("--variants", nargs="+", choices=QUANTIZED_VARIANTS, default=list(QUANTIZED_VARIANTS))
+    p_report.add_argument("--out", default=BACKEND_DIR)
+    p_report.add_argument("--batch-size", type=int, default=1)
+    p_report.add_argument("--repeat", type=int, default=3)
+    p_report.add_argument("--threshold", type=float, default=0.5, help="Decision threshold for a single-output model")
+    p_report.add_argument("--json", action="store_true", help="Print machine-readable results")
+    p_report.set_defaults(func=report)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# Result caching: in-process LRU/TTL tier + optional SQLite tier shared between workers
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("MEDISCOPE_Cache")
+
+
+def make_key(*parts):
+    """Stable hex key from strings/bytes (e.g. content digest + model version)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class LRUTTLCache:
+    """Thread-safe in-process cache bounded by entry count and per-entry age."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self.max_entries = int(max_entries)
+        self.ttl = float(ttl_seconds)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if self.ttl and expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """JSON values in a SQLite file; WAL mode lets several worker processes share it.
+
+    Connections are opened on first use, one per thread and process: caches are built at import,
+    before gunicorn forks, and a SQLite connection must not be carried across fork().
+    """
+
+    def __init__(self, path, ttl_seconds=3600, max_entries=100000):
+        self.path = path
+        self.ttl = float(ttl_seconds)
+        self.max_entries = int(max_entries)
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _conn(self):
+        # A forked child inherits the forking thread's locals, so the pid is checked too
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+            conn.commit()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if self.ttl and expires < time.time():
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl),
+        )
+        # Cheap housekeeping: drop expired rows, then trim the oldest beyond the cap
+        conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+        conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        conn.commit()
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache")
+        conn.commit()
+
+
+class TieredCache:
+    """Memory tier in front of an optional disk tier, with hit/miss counters."""
+
+    def __init__(self, memory, disk=None, name="cache"):
+        self.memory = memory
+        self.disk = disk
+        self.name = name
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "errors": 0}
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except Exception as e:
+                logger.warning(f"⚠️ {self.name} disk read failed: {e}")
+                self._count("errors")
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                self._count("disk_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except Exception as e:
+                logger.warning(f"⚠️ {self.name} disk write failed: {e}")
+                self._count("errors")
+        self._count("sets")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        counters["hit_ratio"] = round((lookups - counters["misses"]) / lookups, 3) if lookups else 0.0
+        counters["memory_entries"] = len(self.memory)
+        counters["disk_enabled"] = self.disk is not None
+        return counters
+
+
+def build_cache(name, max_entries, ttl_seconds, db_path=None):
+    """TieredCache from config values; an empty `db_path` disables the disk tier."""
+    disk = SQLiteCache(db_path, ttl_seconds) if db_path else None
+    logger.info(f"🗄️ {name}: memory={max_entries} entries, ttl={ttl_seconds}s, disk={db_path or 'off'}")
+    return TieredCache(LRUTTLCache(max_entries, ttl_seconds), disk, name=name)
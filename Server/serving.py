@@ -0,0 +1,83 @@
+# Production serving helpers: CPU budget per worker process and graceful-shutdown hooks
+import os
+import sys
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger("MEDISCOPE_Serving")
+
+_shutdown_hooks = []
+_shutdown_lock = threading.Lock()
+
+
+def available_cpus():
+    """CPUs this process may actually use: affinity mask, capped by a cgroup CPU quota if one is set."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def under_gunicorn():
+    """True when gunicorn runs this process (it is imported before gunicorn.conf.py and the app)."""
+    return "gunicorn" in sys.modules
+
+
+def worker_processes():
+    """Worker process count: SERVING_WORKERS / WEB_CONCURRENCY, else half the CPUs (each worker gets >= 2 threads).
+
+    Always 1 outside gunicorn (app.run, scripts): there is no other worker to share with.
+    """
+    if not under_gunicorn():
+        return 1
+    configured = os.environ.get("SERVING_WORKERS") or os.environ.get("WEB_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    return max(1, available_cpus() // 2)
+
+
+def compute_threads(default=None):
+    """Math threads (TF/TFLite/ONNX/torch) for one worker process, so workers x threads ~= CPUs.
+
+    SERVING_COMPUTE_THREADS overrides the split. Outside gunicorn nothing is split: `default`
+    (the caller's own pre-gunicorn setting) if given, else all available CPUs.
+    """
+    configured = os.environ.get("SERVING_COMPUTE_THREADS")
+    if configured:
+        return max(1, int(configured))
+    if not under_gunicorn():
+        return default if default is not None else available_cpus()
+    return max(1, available_cpus() // worker_processes())
+
+
+# ------------------ Graceful shutdown ------------------
+def register_shutdown(name, fn):
+    """Run `fn()` when the process drains (gunicorn worker_exit, or interpreter exit)."""
+    with _shutdown_lock:
+        _shutdown_hooks.append((name, fn))
+
+
+def drain():
+    """Runs the registered hooks once, newest first, e.g. stopping batchers after their queues empty."""
+    with _shutdown_lock:
+        hooks = list(reversed(_shutdown_hooks))
+        _shutdown_hooks.clear()
+    for name, fn in hooks:
+        try:
+            fn()
+            logger.info(f"🛑 {name} drained")
+        except Exception as e:
+            logger.warning(f"⚠️ {name} shutdown failed: {e}")
+
+
+atexit.register(drain)
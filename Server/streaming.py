@@ -0,0 +1,121 @@
+# Server-Sent Events helpers and incremental text post-processing for streamed LLM output
+import re
+import json
+
+# Same rules as text_pipeline.strip_greetings; the leading pattern captures the greeting-line word
+_LEADING_GREETING = re.compile(r"(?i)\s*(?:(?:hi|hello|hey)[^a-zA-Z]*)?(?:(hi|hello|hey|dear)[^\n]*\n?)?")
+_GREETING_WORD = re.compile(r"(?i)hi|hello|hey|dear")
+# A sentence ends at terminal punctuation followed by whitespace, or at a line break; it keeps
+# the whole whitespace run after it, so it is only complete once the next sentence has begun
+_SENTENCE = re.compile(r".*?(?:[.!?।]+\s+|\n\s*)(?=\S)", re.S)
+
+# Longest greeting word is "hello"; that many characters decide whether a line is a greeting
+_DECIDE_CHARS = 5
+
+
+def sse_event(event, data):
+    """One SSE frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class GreetingFilter:
+    """Streaming version of the Interpreter's greeting cleanup.
+
+    The joined output equals text_pipeline.strip_greetings() of the joined input. Text is
+    held back only while it could still change: the start until the leading greeting is
+    settled, a line break until the next line's first few characters rule a greeting out,
+    and trailing whitespace until more text follows (dropped by flush()).
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._leading = True     # the leading greeting hasn't been settled yet
+        self._dropping = False   # inside a greeting line; discard up to and including its newline
+        self._started = False    # whitespace before the first emitted text is discarded
+        self._tail = ""          # trailing whitespace, emitted once more text follows
+
+    def _emit(self, text, out):
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return
+            self._started = True
+        body = text.rstrip()
+        if body:
+            out.append(self._tail + body)
+            self._tail = text[len(body):]
+        else:
+            self._tail += text
+
+    def feed(self, chunk, final=False):
+        self._buf += chunk
+        out = []
+        if self._leading:
+            m = _LEADING_GREETING.match(self._buf)
+            end = m.end()
+            if m.group(1):
+                settled = self._buf[end - 1:end] == "\n"
+            else:
+                settled = len(self._buf) - end >= _DECIDE_CHARS
+            if not (settled or final):
+                return ""
+            self._buf = self._buf[end:]
+            self._leading = False
+
+        # After the start, only a line break can lead into a greeting line; the break,
+        # any blank lines after it and the greeting line itself go together
+        while self._buf:
+            if self._dropping:
+                idx = self._buf.find("\n")
+                if idx == -1:
+                    self._buf = ""
+                    break
+                self._buf = self._buf[idx + 1:]
+                self._dropping = False
+                continue
+
+            idx = self._buf.find("\n")
+            if idx == -1:
+                self._emit(self._buf, out)
+                self._buf = ""
+                break
+            self._emit(self._buf[:idx], out)
+            self._buf = self._buf[idx:]
+            rest = self._buf.lstrip()
+            if not final and len(rest) < _DECIDE_CHARS and "\n" not in rest:
+                break  # not enough of the next line to decide yet
+            if _GREETING_WORD.match(rest):
+                self._buf = rest
+                self._dropping = True
+                continue
+            self._emit(self._buf[:len(self._buf) - len(rest)], out)
+            self._buf = rest
+        return "".join(out)
+
+    def flush(self):
+        text = self.feed("", final=True)
+        self._tail = ""
+        return text
+
+
+class SentenceBuffer:
+    """Accumulates streamed text and releases it one complete sentence at a time.
+
+    Sentences come out the same however the text was chunked.
+    """
+
+    def __init__(self):
+        self._buf = ""
+
+    def feed(self, text):
+        self._buf += text
+        sentences, pos = [], 0
+        for m in _SENTENCE.finditer(self._buf):
+            sentences.append(m.group(0))
+            pos = m.end()
+        self._buf = self._buf[pos:]
+        return sentences
+
+    def flush(self):
+        rest, self._buf = self._buf, ""
+        return [rest] if rest else []
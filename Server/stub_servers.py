@@ -0,0 +1,262 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Local stand-ins for the Gemini REST API and a LibreTranslate-style translation server,
+# so load runs need no network and no API quota.
+# Usage: python stub_servers.py [--gemini-latency-ms 800] [--ttft-ms 300] [--translate-latency-ms 50]
+# then start the services with the environment it prints (GEMINI_BASE_URL, TRANSLATION_URL, ...).
+
+REPLY_LINES = [
+    "Your results look mostly within the normal range 😊.",
+    "A few values are slightly outside the reference range, which is common.",
+    "Drink plenty of water 💧 and get enough rest 😴.",
+    "A light diet with fruits and vegetables 🥗 can help.",
+    "Please consult a **general physician** to confirm these findings.",
+]
+
+
+def _latency(ms, jitter):
+    """Sleep `ms` +/- `jitter` fraction."""
+    if ms > 0:
+        time.sleep(max(0.0, ms * (1 + random.uniform(-jitter, jitter))) / 1000.0)
+
+
+def _reply_for(prompt):
+    """Deterministic model text: a few reply lines picked by the prompt hash."""
+    if "Translate each string in this JSON array" in prompt:
+        # GeminiBackend batch translation: answer with a same-length JSON array
+        segments = json.loads(prompt[prompt.find("["):prompt.rfind("]") + 1])
+        return json.dumps([f"[translated] {s}" for s in segments], ensure_ascii=False)
+    seed = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    count = 3 + seed % 3
+    return "\n".join(REPLY_LINES[(seed + i) % len(REPLY_LINES)] for i in range(count))
+
+
+class StubConfig:
+    def __init__(self, gemini_latency_ms=800.0, ttft_ms=300.0, chunk_ms=40.0, translate_latency_ms=50.0,
+                 jitter=0.2, quota_rate=0.0, error_rate=0.0, slow_rate=0.0, slow_ms=5000.0,
+                 down_models=(), retry_delay_s=None, slow_models=(), reply_text=None, stream_chunk_chars=None,
+                 forbidden_models=()):
+        self.gemini_latency_ms = gemini_latency_ms
+        self.ttft_ms = ttft_ms
+        self.chunk_ms = chunk_ms
+        self.translate_latency_ms = translate_latency_ms
+        self.jitter = jitter
+        # Fault injection, to exercise the fallback, breaker and hedging paths:
+        # fraction of Gemini calls answered 429 / 500, fraction delayed by slow_ms,
+        # and models that always answer 503 / 403 (rejected key) / are always slow
+        self.quota_rate = quota_rate
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.down_models = set(down_models)
+        self.forbidden_models = set(forbidden_models)
+        self.slow_models = set(slow_models)
+        # Sent as the 429 body's retryDelay, like Gemini does
+        self.retry_delay_s = retry_delay_s
+        # Fixed model text instead of the prompt-hash reply lines, and streams cut every
+        # stream_chunk_chars characters instead of once per line (to split words and sentences)
+        self.reply_text = reply_text
+        self.stream_chunk_chars = stream_chunk_chars
+        self.counters = {"generate": 0, "stream": 0, "quota": 0, "errors": 0, "slow": 0, "forbidden": 0,
+                         "translate": 0, "segments": 0}
+        self.calls_by_model = {}
+        self.lock = threading.Lock()
+
+    def count(self, **deltas):
+        with self.lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    def count_model(self, model):
+        with self.lock:
+            self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict.fromkeys(self.counters, 0)
+            self.calls_by_model = {}
+
+
+def _handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/stats":
+                with config.lock:
+                    return self._send_json(200, {**config.counters, "models": dict(config.calls_by_model)})
+            self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            try:
+                body = self._json_body()
+            except ValueError:
+                return self._send_json(400, {"error": "invalid JSON"})
+
+            if path.endswith("/translate"):
+                return self._translate(body)
+            model = path.rsplit("/", 1)[-1].split(":")[0]
+            if path.endswith(":generateContent"):
+                return self._generate(model, body)
+            if path.endswith(":streamGenerateContent"):
+                return self._stream(model, body)
+            self._send_json(404, {"error": "not found"})
+
+        def _prompt(self, body):
+            try:
+                return body["contents"][0]["parts"][0]["text"]
+            except (KeyError, IndexError, TypeError):
+                return ""
+
+        def _reply(self, body):
+            return config.reply_text if config.reply_text is not None else _reply_for(self._prompt(body))
+
+        def _fault(self, model):
+            """Sends an injected failure and returns True, or delays a slow call and returns False."""
+            config.count_model(model)
+            if model in config.down_models:
+                config.count(errors=1)
+                self._send_json(503, {"error": {"code": 503, "status": "UNAVAILABLE"}})
+                return True
+            if model in config.forbidden_models:
+                config.count(forbidden=1)
+                self._send_json(403, {"error": {"code": 403, "status": "PERMISSION_DENIED"}})
+                return True
+            if config.quota_rate and random.random() < config.quota_rate:
+                config.count(quota=1)
+                error = {"code": 429, "status": "RESOURCE_EXHAUSTED"}
+                if config.retry_delay_s is not None:
+                    error["details"] = [{"retryDelay": f"{config.retry_delay_s:g}s"}]
+                self._send_json(429, {"error": error})
+                return True
+            if config.error_rate and random.random() < config.error_rate:
+                config.count(errors=1)
+                self._send_json(500, {"error": {"code": 500, "status": "INTERNAL"}})
+                return True
+            if model in config.slow_models or (config.slow_rate and random.random() < config.slow_rate):
+                config.count(slow=1)
+                time.sleep(config.slow_ms / 1000.0)
+            return False
+
+        def _generate(self, model, body):
+            config.count(generate=1)
+            if self._fault(model):
+                return
+            _latency(config.gemini_latency_ms, config.jitter)
+            text = self._reply(body)
+            self._send_json(200, {"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+        def _stream(self, model, body):
+            config.count(stream=1)
+            if self._fault(model):
+                return
+            _latency(config.ttft_ms, config.jitter)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            text = self._reply(body)
+            if config.stream_chunk_chars:
+                n = config.stream_chunk_chars
+                pieces = [text[i:i + n] for i in range(0, len(text), n)]
+            else:
+                pieces = [line + "\n" for line in text.split("\n")]
+                pieces[-1] = pieces[-1][:-1]
+            for i, piece in enumerate(pieces):
+                if i:
+                    _latency(config.chunk_ms, config.jitter)
+                chunk = {"candidates": [{"content": {"parts": [{"text": piece}]}}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+            self.close_connection = True
+
+        def _translate(self, body):
+            q = body.get("q", [])
+            segments = q if isinstance(q, list) else [q]
+            config.count(translate=1, segments=len(segments))
+            _latency(config.translate_latency_ms, config.jitter)
+            target = body.get("target", "en")
+            translated = [f"[{target}] {s}" for s in segments]
+            self._send_json(200, {"translatedText": translated if isinstance(q, list) else translated[0]})
+
+    return Handler
+
+
+def start_stub_servers(config, host="127.0.0.1", gemini_port=8090, translate_port=8091):
+    """Starts both stubs on daemon threads; returns the servers (call .shutdown() to stop).
+
+    Port 0 picks a free port; read it back from server.server_address.
+    """
+    servers = []
+    for port in (gemini_port, translate_port):
+        server = ThreadingHTTPServer((host, port), _handler(config))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Gemini and translation servers for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--gemini-port", type=int, default=8090)
+    parser.add_argument("--translate-port", type=int, default=8091)
+    parser.add_argument("--gemini-latency-ms", type=float, default=800.0, help="generateContent latency")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="Time to the first streamed chunk")
+    parser.add_argument("--chunk-ms", type=float, default=40.0, help="Gap between streamed chunks")
+    parser.add_argument("--translate-latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter as a fraction (0.2 = +/-20%%)")
+    parser.add_argument("--quota-rate", type=float, default=0.0, help="Fraction of Gemini calls answered with 429")
+    parser.add_argument("--retry-delay-s", type=float, help="retryDelay sent with injected 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of Gemini calls answered with 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of Gemini calls delayed by --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=5000.0)
+    parser.add_argument("--down-models", default="", help="Comma-separated models that always answer 503")
+    parser.add_argument("--slow-models", default="", help="Comma-separated models always delayed by --slow-ms")
+    parser.add_argument("--forbidden-models", default="", help="Comma-separated models that always answer 403")
+    args = parser.parse_args()
+
+    config = StubConfig(args.gemini_latency_ms, args.ttft_ms, args.chunk_ms, args.translate_latency_ms,
+                        args.jitter, args.quota_rate, args.error_rate, args.slow_rate, args.slow_ms,
+                        [m for m in args.down_models.split(",") if m], args.retry_delay_s,
+                        [m for m in args.slow_models.split(",") if m],
+                        forbidden_models=[m for m in args.forbidden_models.split(",") if m])
+    servers = start_stub_servers(config, args.host, args.gemini_port, args.translate_port)
+    print("🧪 Stub servers running. Start the services with:")
+    print(f"  export GEMINI_BASE_URL=http://{args.host}:{args.gemini_port}")
+    print("  export API_KEY=stub")
+    print("  export TRANSLATION_BACKEND=http")
+    print(f"  export TRANSLATION_URL=http://{args.host}:{args.translate_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
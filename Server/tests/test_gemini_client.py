@@ -0,0 +1,128 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from gemini_client import ERROR, OK, QUOTA, GeminiClient
+from stub_servers import StubConfig, start_stub_servers
+
+# The pooled client on its own: one keep-alive session, the concurrency cap, per-attempt and
+# overall time limits, and falling back from the primary model to the next one
+
+FLASH, PRO = "gemini-flash-latest", "gemini-pro-latest"
+
+
+@pytest.fixture
+def stub():
+    """Starts a stub Gemini server; returns (client, config) built from the given options."""
+    servers = []
+
+    def start(client_kwargs=None, **config_kwargs):
+        config = StubConfig(jitter=0.0, **config_kwargs)
+        gemini, translate = start_stub_servers(config, gemini_port=0, translate_port=0)
+        servers.extend([gemini, translate])
+        host, port = gemini.server_address[:2]
+        client = GeminiClient("stub", base_url=f"http://{host}:{port}", models=[FLASH, PRO], **(client_kwargs or {}))
+        return client, config
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def connection_pool(client):
+    """The one urllib3 pool the session opened to the stub."""
+    pools = client.session.get_adapter(client.base_url).poolmanager.pools
+    (key,) = pools.keys()
+    return pools[key]
+
+
+def test_sequential_calls_reuse_one_connection(stub):
+    client, config = stub(gemini_latency_ms=0)
+    results = [client.generate(f"prompt {i}") for i in range(5)]
+    assert all(r.status == OK and r.text for r in results)
+    pool = connection_pool(client)
+    assert pool.num_requests == 5
+    assert pool.num_connections == 1
+
+
+def test_concurrency_cap_limits_upstream_connections(stub):
+    client, config = stub({"max_concurrency": 2}, gemini_latency_ms=100)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(lambda i: client.generate(f"prompt {i}"), range(6)))
+    assert all(r.status == OK for r in results)
+    # 6 calls, 2 at a time, 100 ms each
+    assert time.perf_counter() - start >= 0.3
+    assert connection_pool(client).num_connections <= 2
+
+
+def test_attempt_ok(stub):
+    client, config = stub(gemini_latency_ms=0)
+    result = client._attempt(FLASH, "hello", time.monotonic() + 5)
+    assert (result.status, result.model, result.status_code) == (OK, FLASH, 200)
+    assert result.text
+
+
+def test_attempt_times_out(stub):
+    client, config = stub({"attempt_timeout": 0.2}, gemini_latency_ms=0, slow_models=[FLASH], slow_ms=1000)
+    result = client._attempt(FLASH, "hello", time.monotonic() + 5)
+    assert result.status == ERROR and result.model == FLASH
+
+
+def test_attempt_after_the_deadline_never_goes_upstream(stub):
+    client, config = stub(gemini_latency_ms=0)
+    result = client._attempt(FLASH, "hello", time.monotonic() - 1)
+    assert (result.status, result.error) == (ERROR, "Deadline exceeded")
+    assert config.calls_by_model == {}
+
+
+def test_failed_primary_falls_back_to_the_next_model(stub):
+    client, config = stub(gemini_latency_ms=0, down_models=[FLASH])
+    result = client.generate("hello")
+    assert (result.status, result.model) == (OK, PRO)
+    assert config.calls_by_model == {FLASH: 1, PRO: 1}
+
+
+def test_quota_on_the_primary_is_answered_without_fallback(stub):
+    # A 429 is a project-wide quota; the fallback model would get the same answer
+    client, config = stub(gemini_latency_ms=0, quota_rate=1.0)
+    assert client.generate("hello").status == QUOTA
+    assert config.calls_by_model == {FLASH: 1}
+
+
+def test_every_model_failing_is_an_error(stub):
+    client, config = stub(gemini_latency_ms=0, down_models=[FLASH, PRO])
+    result = client.generate("hello")
+    assert (result.status, result.status_code) == (ERROR, 503)
+
+
+def test_fallback_only_gets_the_time_left(stub):
+    client, config = stub({"attempt_timeout": 0.3, "deadline": 0.4}, gemini_latency_ms=0,
+                          slow_models=[FLASH, PRO], slow_ms=1000)
+    start = time.perf_counter()
+    result = client.generate("hello")
+    assert result.status == ERROR
+    assert time.perf_counter() - start < 0.8
+
+
+def test_next_model_skips_open_breakers(stub):
+    client, config = stub()
+    for _ in range(client.breaker_failures):
+        client.breaker(FLASH).record_failure(ERROR, cooldown=60)
+    models = [FLASH, PRO]
+    assert client._next_model(models) == (PRO, None)
+    assert models == []
+
+
+def test_next_model_answers_for_a_breaker_opened_by_quota(stub):
+    client, config = stub()
+    client.breaker(FLASH).trip(QUOTA, 30)
+    model, skipped = client._next_model([FLASH, PRO])
+    assert model is None
+    assert (skipped.status, skipped.model, skipped.error) == (QUOTA, FLASH, "Circuit open")
+
+
+def test_no_models_left(stub):
+    client, config = stub()
+    assert client._next_model([]) == (None, None)
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference_batcher import MicroBatcher
+
+
+class RecordingModel:
+    """Doubles each row and records the batch sizes it was called with; can be held on `gate`."""
+
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, batch):
+        self.gate.wait(5)
+        self.batches.append(len(batch))
+        return np.asarray(batch) * 2
+
+
+@pytest.fixture
+def make_batcher():
+    batchers = []
+
+    def make(predict_fn, **kwargs):
+        batcher = MicroBatcher(predict_fn, **kwargs)
+        batchers.append(batcher)
+        return batcher
+
+    yield make
+    for batcher in batchers:
+        batcher.shutdown(timeout=5)
+
+
+def test_queued_samples_share_batches(make_batcher):
+    model = RecordingModel()
+    batcher = make_batcher(model, max_batch_size=4, max_wait_ms=200)
+    rows = batcher.predict_many([np.full(3, i) for i in range(10)], timeout=5)
+    assert [row.tolist() for row in rows] == [[2 * i] * 3 for i in range(10)]
+    assert model.batches == [4, 4, 2]
+    stats = batcher.stats()
+    assert (stats["batches"], stats["items"], stats["batch_size_counts"]) == (3, 10, {"2": 1, "4": 2})
+
+
+def test_a_lone_sample_is_flushed_after_max_wait(make_batcher):
+    model = RecordingModel()
+    batcher = make_batcher(model, max_batch_size=8, max_wait_ms=100)
+    start = time.perf_counter()
+    assert batcher.predict(np.ones(2), timeout=5).tolist() == [2, 2]
+    assert 0.09 <= time.perf_counter() - start < 1.0
+    assert model.batches == [1]
+
+
+def test_a_full_batch_does_not_wait(make_batcher):
+    model = RecordingModel()
+    batcher = make_batcher(model, max_batch_size=2, max_wait_ms=5000)
+    start = time.perf_counter()
+    batcher.predict_many([np.ones(2), np.zeros(2)], timeout=5)
+    assert time.perf_counter() - start < 1.0
+
+
+def test_requests_arriving_while_a_batch_runs_form_the_next_one(make_batcher):
+    model = RecordingModel()
+    model.gate.clear()
+    batcher = make_batcher(model, max_batch_size=8, max_wait_ms=20)
+    first = batcher.submit(np.ones(1))
+    time.sleep(0.1)  # the worker now holds `first` inside the model
+    rest = [batcher.submit(np.full(1, i)) for i in range(5)]
+    model.gate.set()
+    assert first.result(5).tolist() == [2]
+    assert [f.result(5).tolist() for f in rest] == [[2 * i] for i in range(5)]
+    assert model.batches == [1, 5]
+
+
+def test_a_failing_batch_fails_every_caller_in_it(make_batcher):
+    def broken(batch):
+        raise ValueError("bad input")
+
+    batcher = make_batcher(broken, max_batch_size=4, max_wait_ms=50)
+    futures = [batcher.submit(np.ones(1)) for _ in range(3)]
+    for future in futures:
+        with pytest.raises(ValueError, match="bad input"):
+            future.result(5)
+    assert batcher.stats()["errors"] == 1
+
+
+def test_a_short_model_output_is_an_error(make_batcher):
+    batcher = make_batcher(lambda batch: batch[:1], max_batch_size=2, max_wait_ms=200)
+    with pytest.raises(RuntimeError, match="1 rows for a batch of 2"):
+        batcher.predict_many([np.ones(1), np.ones(1)], timeout=5)
+
+
+def test_unstacked_samples_may_differ_in_shape(make_batcher):
+    batcher = make_batcher(lambda images: [image.shape for image in images], max_batch_size=4, max_wait_ms=50,
+                           stack=False)
+    shapes = batcher.predict_many([np.zeros((2, 3)), np.zeros((5, 1))], timeout=5)
+    assert shapes == [(2, 3), (5, 1)]
+
+
+def test_cancelled_requests_are_skipped(make_batcher):
+    model = RecordingModel()
+    model.gate.clear()
+    batcher = make_batcher(model, max_batch_size=8, max_wait_ms=20)
+    busy = batcher.submit(np.ones(1))
+    time.sleep(0.1)
+    cancelled, kept = batcher.submit(np.ones(1)), batcher.submit(np.ones(1))
+    assert cancelled.cancel()
+    model.gate.set()
+    assert busy.result(5).tolist() == kept.result(5).tolist() == [2]
+    assert model.batches == [1, 1]
+
+
+def test_shutdown_drains_the_queue_and_stops_every_worker():
+    model = RecordingModel()
+    model.gate.clear()
+    batcher = MicroBatcher(model, max_batch_size=2, max_wait_ms=10, workers=3)
+    futures = [batcher.submit(np.full(1, i)) for i in range(7)]
+    stopper = threading.Thread(target=batcher.shutdown, kwargs={"timeout": 5})
+    stopper.start()
+    while not batcher._stopped:
+        time.sleep(0.001)
+    with pytest.raises(RuntimeError, match="shut down"):
+        batcher.submit(np.ones(1))
+    model.gate.set()
+    stopper.join(5)
+    # The sentinel went in behind the queued samples: all of them ran, then each worker saw it and left
+    assert [f.result(0).tolist() for f in futures] == [[2 * i] for i in range(7)]
+    assert sum(model.batches) == 7
+    assert not any(worker.is_alive() for worker in batcher._workers)
+    batcher.shutdown()  # a second call is a no-op
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+def test_forked_child_restarts_the_workers(make_batcher):
+    # Like gunicorn preload_app: the batcher is built in the master, whose threads the worker doesn't inherit
+    model = RecordingModel()
+    batcher = make_batcher(model, max_batch_size=4, max_wait_ms=10)
+    assert batcher.predict(np.ones(1), timeout=5).tolist() == [2]
+    parent_workers = list(batcher._workers)
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            restarted = all(worker.is_alive() for worker in batcher._workers)
+            restarted = restarted and not set(batcher._workers) & set(parent_workers)
+            ok = restarted and batcher.predict(np.full(1, 3), timeout=5).tolist() == [6]
+        finally:
+            os.write(write_fd, b"1" if ok else b"0")
+            os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 1)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    assert result == b"1"
+    assert batcher._workers == parent_workers
+    assert batcher.predict(np.ones(1), timeout=5).tolist() == [2]
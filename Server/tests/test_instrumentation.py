@@ -0,0 +1,35 @@
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from instrumentation import install_metrics, registry, stage  # noqa: E402
+
+
+def make_app(service):
+    app = flask.Flask(service)
+    install_metrics(app, service)
+
+    @app.route("/work")
+    def work():
+        with stage(f"{service}.work"):
+            return "done"
+
+    return app
+
+
+def test_each_app_keeps_its_service_label():
+    # Like AnalysisService, which imports the X-ray, Lab and Interpreter apps into one process
+    apps = {name: make_app(name) for name in ("xray", "lab", "analysis")}
+    for name, app in apps.items():
+        client = app.test_client()
+        response = client.get("/work")
+        assert f"{name}.work;dur=" in response.headers["Server-Timing"]
+        assert client.get("/metrics?format=json").get_json()["service"] == name
+        text = client.get("/metrics").get_data(as_text=True)
+        assert f'service="{name}",stage="{name}.work"' in text
+        assert f'service="{name}",stage="request.work"' in text
+
+
+def test_registry_defaults_to_the_shared_label():
+    # Scripts that read the registry directly, outside any app
+    assert registry.snapshot()["service"] == "mediscope"
@@ -0,0 +1,126 @@
+import threading
+
+import pytest
+
+import jobs
+from jobs import DONE, FAILED, JobQueue, QueueFull, validate_callback_url
+
+
+def test_back_pressure_and_results():
+    queue = JobQueue("test-jobs", max_workers=1, max_pending=1, db_path=None)
+    release = threading.Event()
+    first = queue.submit("slow", lambda: release.wait(5) and "first")
+    second = queue.submit("slow", lambda: "second")
+    with pytest.raises(QueueFull):
+        queue.submit("slow", lambda: "third")
+    release.set()
+    assert queue.wait(first["job_id"], 5)["result"] == "first"
+    assert queue.wait(second["job_id"], 5)["status"] == DONE
+    stats = queue.stats()
+    assert (stats["submitted"], stats["rejected"], stats["in_flight"]) == (2, 1, 0)
+    # Capacity is back once the jobs finished
+    assert queue.wait(queue.submit("fast", lambda: 1)["job_id"], 5)["result"] == 1
+    queue.shutdown()
+
+
+def test_failed_job_keeps_the_error():
+    queue = JobQueue("test-jobs", max_workers=1, max_pending=0, db_path=None)
+
+    def boom():
+        raise ValueError("bad image")
+
+    job = queue.wait(queue.submit("boom", boom)["job_id"], 5)
+    assert (job["status"], job["error"]) == (FAILED, "bad image")
+    assert queue.get("unknown") is None
+    queue.shutdown()
+
+
+def test_shared_sqlite_store(tmp_path):
+    db = str(tmp_path / "jobs.db")
+    queue = JobQueue("test-jobs", max_workers=1, max_pending=0, db_path=db)
+    job_id = queue.submit("sum", sum, [1, 2])["job_id"]
+    assert queue.wait(job_id, 5)["result"] == 3
+    # Another process (another JobQueue on the same file) sees the finished record
+    assert JobQueue("test-jobs", db_path=db).get(job_id)["status"] == DONE
+    queue.shutdown()
+
+
+def test_callbacks_disabled_without_allow_list(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ())
+    assert "disabled" in validate_callback_url("http://gateway.internal/cb")
+
+
+@pytest.mark.parametrize("url, error", [
+    ("file:///etc/passwd", "http(s)"),
+    ("http://evil.example/cb", "not allowed"),
+    ("http://169.254.169.254/latest/meta-data", "forbidden address"),
+    ("http://[fe80::1]/cb", "forbidden address"),
+    ("http://0.0.0.0/cb", "forbidden address"),
+])
+def test_callback_url_rejected(monkeypatch, url, error):
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ("127.0.0.1", "169.254.169.254", "fe80::1", "0.0.0.0"))
+    assert error in validate_callback_url(url)
+
+
+def test_allow_listed_callback_accepted(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ("127.0.0.1",))
+    assert validate_callback_url("http://127.0.0.1:8099/cb") is None
+
+
+def test_callback_rechecked_when_sent(monkeypatch):
+    # Allowed at submission, removed from the allow-list before the job finishes: nothing is sent
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ("127.0.0.1",))
+    sent = []
+    monkeypatch.setattr(jobs.requests, "post", lambda *a, **k: sent.append(a))
+    queue = JobQueue("test-jobs", max_workers=1, max_pending=0, db_path=None)
+    release = threading.Event()
+    job_id = queue.submit("cb", release.wait, 5, callback_url="http://127.0.0.1:9/cb")["job_id"]
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ())
+    release.set()
+    queue.wait(job_id, 5)
+    queue.shutdown()
+    assert sent == []
+    assert queue.stats()["callbacks_failed"] == 1
+
+
+def test_in_flight_jobs_survive_store_eviction():
+    # A store that holds a single record: queued and running jobs must still be visible
+    queue = JobQueue("test-jobs", max_workers=1, max_pending=2, db_path=None, max_records=1)
+    release = threading.Event()
+    running = queue.submit("slow", lambda: release.wait(5) and "running")
+    queued = [queue.submit("fast", lambda i=i: i) for i in range(2)]
+    queue.store.max_entries = 1  # as if JOB_MAX_RECORDS were below the queue's capacity
+    queue.store.set("other", {"status": DONE})
+    assert queue.get(running["job_id"])["status"] in ("queued", "running")
+    assert [queue.get(job["job_id"])["status"] for job in queued] == ["queued", "queued"]
+    queue.store.max_entries = 10  # finished records are evictable again; keep them for the asserts
+    release.set()
+    assert queue.wait(running["job_id"], 5)["result"] == "running"
+    assert [queue.wait(job["job_id"], 5)["result"] for job in queued] == [0, 1]
+    queue.shutdown()
+
+
+def test_store_has_room_for_every_in_flight_job():
+    assert JobQueue("test-jobs", max_workers=2, max_pending=8, db_path=None, max_records=1).store.max_entries == 10
+
+
+def test_slow_callback_does_not_hold_a_job_worker(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ("127.0.0.1",))
+    release, senders = threading.Event(), []
+
+    def post(*args, **kwargs):
+        senders.append(threading.current_thread().name)
+        release.wait(5)
+        raise jobs.requests.ConnectionError("receiver gone")
+
+    monkeypatch.setattr(jobs.requests, "post", post)
+    queue = JobQueue("test-jobs", max_workers=1, max_pending=1, db_path=None)
+    first = queue.submit("cb", lambda: 1, callback_url="http://127.0.0.1:9/cb")
+    second = queue.submit("next", lambda: 2)
+    # The only job worker moves on while the first callback is still blocked
+    assert queue.wait(second["job_id"], 5)["result"] == 2
+    assert queue.wait(first["job_id"], 0)["status"] == DONE
+    release.set()
+    queue.shutdown()
+    assert senders and senders[0].startswith("test-jobs-callback")
+    assert queue.stats()["callbacks_failed"] == 1
@@ -0,0 +1,178 @@
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+fitz = pytest.importorskip("fitz")
+
+from lab_extraction import ExtractionPipeline  # noqa: E402
+
+# What FakeReader answers for a scanned page at the default 200 DPI
+SCANNED_PAGE = "image 1600x2200"
+REPORT_TEXT = "Hemoglobin 13.5 g/dL (13.0 - 17.0)\nWBC 7.2 x10^3/uL (4.0 - 11.0)"
+
+
+class FakeReader:
+    """Stands in for easyocr.Reader; answers with what it was given."""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _describe(self, image):
+        if isinstance(image, str):
+            with open(image, "rb") as f:
+                return f"file {os.path.splitext(image)[1]} {len(f.read())} bytes"
+        return f"image {image.shape[1]}x{image.shape[0]}"
+
+    def readtext(self, image, detail=0, batch_size=1):
+        with self._lock:
+            self.calls.append(("readtext", 1))
+        return [self._describe(image)]
+
+    def readtext_batched(self, images, detail=0, batch_size=1):
+        with self._lock:
+            self.calls.append(("readtext_batched", len(images)))
+        return [[self._describe(image)] for image in images]
+
+
+def make_pdf(*pages):
+    """A PDF with one page per argument: text on the page's text layer, or None for a scanned page."""
+    doc = fitz.open()
+    for text in pages:
+        # 8 x 11 inches: a whole number of pixels at any DPI
+        page = doc.new_page(width=576, height=792)
+        if text is None:
+            # An image-only page, like a scan: no text layer at all
+            scan = Image.fromarray(np.full((200, 150), 200, dtype=np.uint8), "L")
+            buf = io.BytesIO()
+            scan.save(buf, format="PNG")
+            page.insert_image(page.rect, stream=buf.getvalue())
+        else:
+            page.insert_text((72, 72), text)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+@pytest.fixture
+def reader():
+    return FakeReader()
+
+
+@pytest.fixture
+def pipeline(reader, tmp_path):
+    pipeline = ExtractionPipeline(lambda: reader, max_workers=2, spool_dir=str(tmp_path))
+    yield pipeline
+    pipeline.shutdown()
+
+
+def test_text_layer_pages_skip_ocr(pipeline, reader):
+    text = pipeline.extract(make_pdf(REPORT_TEXT, REPORT_TEXT.replace("13.5", "12.1")), "report.pdf")
+    pages = text.split("\n\n")
+    assert "Hemoglobin 13.5" in pages[0] and "Hemoglobin 12.1" in pages[1]
+    assert reader.calls == []
+
+
+def test_scanned_page_is_ocred_in_page_order(pipeline, reader):
+    text = pipeline.extract(make_pdf(None, REPORT_TEXT), "report.pdf")
+    first, rest = text.split("\n", 1)
+    # 8 x 11 inches at 200 DPI
+    assert first == SCANNED_PAGE
+    assert "Hemoglobin 13.5" in rest
+    assert reader.calls == [("readtext", 1)]
+
+
+def test_large_pages_are_rasterized_under_the_pixel_cap(reader):
+    pipeline = ExtractionPipeline(lambda: reader, max_workers=1, max_page_pixels=500_000)
+    try:
+        width, height = map(int, pipeline.extract(make_pdf(None), "scan.pdf").split()[1].split("x"))
+    finally:
+        pipeline.shutdown()
+    assert width * height <= 500_000
+
+
+def test_batched_pipeline_ocrs_scanned_pages_together(reader):
+    pipeline = ExtractionPipeline(lambda: reader, max_workers=1, batch_size=4, batch_wait_ms=200)
+    try:
+        text = pipeline.extract(make_pdf(None, None), "scans.pdf")
+    finally:
+        pipeline.shutdown()
+    assert text == f"{SCANNED_PAGE}\n{SCANNED_PAGE}\n"
+    assert reader.calls == [("readtext_batched", 2)]
+
+
+def test_pdf_from_path(pipeline, reader, tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(make_pdf(REPORT_TEXT, None))
+    assert pipeline.extract(str(path)).endswith(f"\n{SCANNED_PAGE}\n")
+
+
+def test_image_bytes_are_decoded_in_memory(pipeline, reader, tmp_path):
+    buf = io.BytesIO()
+    Image.new("RGB", (40, 30), "white").save(buf, format="PNG")
+    assert pipeline.extract(buf.getvalue(), "scan.png") == "image 40x30"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_undecodable_image_is_spooled_and_removed(pipeline, reader, tmp_path):
+    assert pipeline.extract(b"not really a bmp", "scan.bmp") == "file .bmp 16 bytes"
+    # The temp file is removed once OCR finishes (shutdown waits for the worker's callbacks)
+    pipeline.shutdown()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_extract_many_returns_errors_in_place(pipeline):
+    results = pipeline.extract_many([(make_pdf(REPORT_TEXT), "a.pdf"), (b"%PDF-1.7 broken", "b.pdf")])
+    assert "Hemoglobin 13.5" in results[0]
+    assert isinstance(results[1], Exception)
+
+
+def test_scanned_pages_are_rasterized_within_the_window(reader):
+    # Rasterized pages waiting for OCR stay within pages_in_flight, however long the scan is
+    pipeline = ExtractionPipeline(lambda: reader, max_workers=2, pages_in_flight=2)
+    lock = threading.Lock()
+    waiting, peak = [0], [0]
+    rasterize, ocr = pipeline._rasterize, pipeline._ocr
+
+    def counted_rasterize(page):
+        image = rasterize(page)
+        with lock:
+            waiting[0] += 1
+            peak[0] = max(peak[0], waiting[0])
+        return image
+
+    def counted_ocr(image):
+        time.sleep(0.02)
+        text = ocr(image)
+        with lock:
+            waiting[0] -= 1
+        return text
+
+    pipeline._rasterize, pipeline._ocr = counted_rasterize, counted_ocr
+    try:
+        text = pipeline.extract(make_pdf(*[None] * 6), "scan.pdf")
+    finally:
+        pipeline.shutdown()
+    assert text == f"{SCANNED_PAGE}\n" * 6
+    assert peak[0] <= 2
+
+
+def test_submit_leaves_scanned_pages_to_the_pool(reader):
+    # The request thread only opens the document; reading and rasterizing happen in page tasks
+    pipeline = ExtractionPipeline(lambda: reader, max_workers=1, pages_in_flight=1)
+    release = threading.Event()
+    rasterize = pipeline._rasterize
+    pipeline._rasterize = lambda page: release.wait(5) and rasterize(page)
+    try:
+        join = pipeline.submit(make_pdf(None, None, None), "scan.pdf")
+        assert reader.calls == []
+        release.set()
+        assert join() == f"{SCANNED_PAGE}\n" * 3
+    finally:
+        release.set()
+        pipeline.shutdown()
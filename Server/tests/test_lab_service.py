@@ -0,0 +1,147 @@
+import io
+import json
+import os
+
+import pytest
+
+from gemini_client import GeminiClient
+from result_cache import LRUTTLCache
+from stub_servers import StubConfig, start_stub_servers
+
+pytest.importorskip("easyocr")
+pytest.importorskip("google.generativeai")
+pytest.importorskip("flask_cors")
+
+# Nothing may load the real EasyOCR weights at import; each test drives the warm-up itself
+os.environ["OCR_PRELOAD"] = "off"
+import LabMicroservice as lab  # noqa: E402
+
+
+class FlakyReader:
+    """Stands in for easyocr.Reader: the first `failures` constructions raise, like a timed-out weights download."""
+
+    failures = 0
+
+    def __init__(self, languages):
+        if FlakyReader.failures:
+            FlakyReader.failures -= 1
+            raise OSError("weights download timed out")
+
+    def readtext(self, image, detail=0):
+        return []
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(lab.easyocr, "Reader", FlakyReader)
+    monkeypatch.setattr(lab, "ocr_reader", None)
+    monkeypatch.setattr(lab, "ocr_warmup_pid", None)
+    monkeypatch.setattr(lab, "ocr_warmup_failed_at", None)
+    monkeypatch.setattr(lab, "ocr_state", {"loaded": False, "warmed": False, "error": None, "attempts": 0})
+    return lab.app.test_client()
+
+
+def probe(client):
+    response = client.get("/ready")
+    if lab.ocr_warmup_thread is not None:
+        lab.ocr_warmup_thread.join(5)
+    return response
+
+
+def test_off_means_process_up(client, monkeypatch):
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json()["loaded"] is False
+    assert lab.ocr_reader is None
+
+
+def test_failed_warmup_is_retried(client, monkeypatch):
+    monkeypatch.setattr(lab, "OCR_PRELOAD", "background")
+    monkeypatch.setattr(lab, "OCR_WARMUP_RETRY_S", 60)
+    FlakyReader.failures = 1
+
+    probe(client)
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.get_json()["error"] == "weights download timed out"
+
+    # Once the interval has passed, the next probe starts the second attempt
+    monkeypatch.setattr(lab, "OCR_WARMUP_RETRY_S", 0)
+    probe(client)
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.get_json()["attempts"] == 2
+
+
+def test_retry_waits_for_the_interval(client, monkeypatch):
+    monkeypatch.setattr(lab, "OCR_PRELOAD", "background")
+    monkeypatch.setattr(lab, "OCR_WARMUP_RETRY_S", 60)
+    FlakyReader.failures = 1
+
+    probe(client)
+    assert probe(client).status_code == 503
+    assert lab.ocr_state["attempts"] == 1
+
+
+# ------------------ /parse ------------------
+SUMMARY = "Hemoglobin is normal. यह ठीक है।\nNo follow-up needed."
+
+
+@pytest.fixture
+def stub_gemini(monkeypatch):
+    """Points the service's Gemini client at a stub streaming SUMMARY three characters at a time."""
+    config = StubConfig(jitter=0.0, gemini_latency_ms=0, ttft_ms=0, chunk_ms=0, reply_text=SUMMARY,
+                        stream_chunk_chars=3)
+    gemini, translate = start_stub_servers(config, gemini_port=0, translate_port=0)
+    host, port = gemini.server_address[:2]
+    monkeypatch.setattr(lab, "gemini", GeminiClient("stub", base_url=f"http://{host}:{port}"))
+    monkeypatch.setattr(lab, "summary_cache", LRUTTLCache())
+    yield config
+    gemini.shutdown()
+    translate.shutdown()
+
+
+def text_pdf():
+    fitz = pytest.importorskip("fitz")
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Hemoglobin 13.5 g/dL (13.0 - 17.0)")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def sse_events(body):
+    events = []
+    for frame in body.split("\n\n"):
+        if frame:
+            event, data = frame.split("\n", 1)
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_parse_streams_the_summary(stub_gemini):
+    client = lab.app.test_client()
+    response = client.post("/parse?stream=true", data={"files": (io.BytesIO(text_pdf()), "cbc.pdf")})
+    assert response.mimetype == "text/event-stream"
+    events = sse_events(response.get_data(as_text=True))
+
+    names = [name for name, _ in events]
+    assert names[0] == "diagnostics" and names[-1] == "done"
+    assert set(names[1:-1]) == {"chunk"} and len(names) - 2 == -(-len(SUMMARY) // 3)
+    assert events[0][1]["diagnostics"]["cbc.pdf"]["status"] == "success"
+    assert "".join(data["text"] for name, data in events if name == "chunk") == SUMMARY
+    assert events[-1][1]["summary"] == SUMMARY
+
+    # The streamed summary was cached whole; the JSON path answers the same without another call
+    assert client.post("/parse", data={"files": (io.BytesIO(text_pdf()), "cbc.pdf")}).get_json()["summary"] == SUMMARY
+    assert stub_gemini.counters["stream"] == 1 and stub_gemini.counters["generate"] == 0
+
+
+# ------------------ Request limits ------------------
+@pytest.mark.parametrize("path", ["/parse", "/jobs/parse"])
+def test_body_over_the_limit_is_a_json_413(monkeypatch, path):
+    monkeypatch.setitem(lab.app.config, "MAX_CONTENT_LENGTH", 1000)
+    monkeypatch.setattr(lab, "MAX_REQUEST_BYTES", 1000)
+    response = lab.app.test_client().post(path, data={"files": (io.BytesIO(b"\0" * 2000), "cbc.pdf")})
+    assert response.status_code == 413
+    assert response.get_json() == {"error": "Request body exceeds 1000 bytes."}
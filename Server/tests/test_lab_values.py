@@ -0,0 +1,57 @@
+from lab_values import extract_lab_values, format_table, remaining_text
+
+REPORT = """
+=== report.pdf ===
+COMPLETE BLOOD COUNT
+Hemoglobin 10.2 g/dL 13.0 - 17.0
+WBC Count 7.5 10^3/uL 4.0-11.0
+Platelet Count 210 10^3/uL
+PSA 9.8 ng/mL 0-4
+Troponin I 2.3 ng/mL <0.04
+INR 3.1
+Sodium 131 mmol/L 135 - 145
+Hemoglobin 9.8 g/dL 13.0 - 17.0
+IMPRESSION: Findings consistent with acute myocardial injury. Correlate clinically.
+"""
+
+
+def by_name(values):
+    return {v.analyte: v for v in values}
+
+
+def test_known_analytes_parsed_and_flagged():
+    values = by_name(extract_lab_values(REPORT))
+    assert list(values) == ["Hemoglobin", "WBC Count", "Platelet Count", "Sodium"]
+    assert (values["Hemoglobin"].value, values["Hemoglobin"].flag) == (10.2, "L")
+    assert values["Sodium"].flag == "L"
+    assert values["WBC Count"].flag == ""
+
+
+def test_row_does_not_run_into_next_line():
+    # Platelet Count prints no range; it must not take PSA's "0-4" from the next line
+    platelets = by_name(extract_lab_values(REPORT))["Platelet Count"]
+    assert platelets.reference_source == "default"
+    assert (platelets.low, platelets.high, platelets.flag) == (150, 450, "")
+
+
+def test_cells_on_separate_ocr_lines():
+    text = "Hemoglobin\n10.2\ng/dL\n13.0 - 17.0\nGlucose Fasting\n 130 mg/dl\nup to 100\nComment: repeat"
+    values = by_name(extract_lab_values(text))
+    assert (values["Hemoglobin"].unit, values["Hemoglobin"].reference()) == ("g/dL", "13-17")
+    assert (values["Glucose (Fasting)"].high, values["Glucose (Fasting)"].flag) == (100, "H")
+
+
+def test_nothing_outside_the_table_is_lost():
+    values = extract_lab_values(REPORT)
+    rest = remaining_text(REPORT, values)
+    for kept in ("PSA 9.8 ng/mL 0-4", "Troponin I 2.3 ng/mL <0.04", "INR 3.1",
+                 "Hemoglobin 9.8 g/dL", "acute myocardial injury"):
+        assert kept in rest
+    # Rows that made it into the table are not repeated
+    assert "Sodium" not in rest
+    assert "WBC" not in rest
+
+
+def test_default_ranges_are_marked():
+    table = format_table(extract_lab_values("TSH 5.6 uIU/mL"))
+    assert "0.4-4 (default) | H" in table
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from model_cache import ModelCache
+
+BODY = bytes(range(256)) * 4096  # 1 MB
+SHA = hashlib.sha256(BODY).hexdigest()
+
+
+class ModelServer:
+    """Local stand-in for the model host: serves `body` with an ETag and honours Range / If-Range."""
+
+    def __init__(self, body=BODY, etag='"v1"', delay=0.0):
+        self.body = body
+        self.etag = etag
+        self.delay = delay
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                body, status = server.body, 200
+                byte_range = self.headers.get("Range")
+                if_range = self.headers.get("If-Range")
+                if byte_range and (if_range is None or if_range == server.etag):
+                    start = int(byte_range.split("=")[1].rstrip("-"))
+                    if start >= len(body):
+                        self.send_response(416)
+                        self.end_headers()
+                        return
+                    body, status = body[start:], 206
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", server.etag)
+                self.end_headers()
+                for i in range(0, len(body), 64 * 1024):
+                    time.sleep(server.delay)
+                    self.wfile.write(body[i:i + 64 * 1024])
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        host, port = self.httpd.server_address[:2]
+        self.url = f"http://{host}:{port}/final_best_model.keras"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    server = ModelServer()
+    yield server
+    server.close()
+
+
+def cache_files(tmp_path):
+    return sorted(p.name for p in tmp_path.iterdir() if not p.name.endswith(".lock"))
+
+
+def test_verified_hit_skips_the_network(tmp_path, server):
+    cache = ModelCache(str(tmp_path))
+    path = cache.fetch(server.url, "model.keras", SHA)
+    assert open(path, "rb").read() == BODY
+    assert cache_files(tmp_path) == ["model.keras", "model.keras.sha256"]
+
+    assert cache.fetch(server.url, "model.keras", SHA) == path
+    # Unpinned: the sidecar written at download time is what gets verified
+    assert ModelCache(str(tmp_path)).fetch(server.url, "model.keras") == path
+    assert len(server.requests) == 1
+
+
+def test_truncated_part_is_resumed_with_range(tmp_path, server):
+    (tmp_path / "model.keras.part").write_bytes(BODY[:300_000])
+    (tmp_path / "model.keras.part.validator").write_text('"v1"\n')
+
+    path = ModelCache(str(tmp_path)).fetch(server.url, "model.keras", SHA)
+    assert open(path, "rb").read() == BODY
+    assert server.requests[0]["Range"] == "bytes=300000-"
+    assert server.requests[0]["If-Range"] == '"v1"'
+    assert cache_files(tmp_path) == ["model.keras", "model.keras.sha256"]
+
+
+def test_part_from_a_changed_file_starts_over(tmp_path, server):
+    # The partial bytes belong to an older upload; If-Range makes the server send the whole new file
+    (tmp_path / "model.keras.part").write_bytes(b"x" * 300_000)
+    (tmp_path / "model.keras.part.validator").write_text('"v0"\n')
+
+    path = ModelCache(str(tmp_path)).fetch(server.url, "model.keras", SHA)
+    assert open(path, "rb").read() == BODY
+    assert server.requests[0]["If-Range"] == '"v0"'
+
+
+def test_part_without_a_validator_is_not_resumed(tmp_path, server):
+    (tmp_path / "model.keras.part").write_bytes(b"x" * 300_000)
+    path = ModelCache(str(tmp_path)).fetch(server.url, "model.keras", SHA)
+    assert open(path, "rb").read() == BODY
+    assert "Range" not in server.requests[0]
+
+
+def test_sha_mismatch_discards_the_download(tmp_path, server):
+    cache = ModelCache(str(tmp_path))
+    assert cache.fetch(server.url, "model.keras", "0" * 64) is None
+    assert cache_files(tmp_path) == []
+
+
+def test_corrupt_cached_file_is_evicted_and_fetched_again(tmp_path, server):
+    cache = ModelCache(str(tmp_path))
+    path = cache.fetch(server.url, "model.keras")
+    with open(path, "r+b") as f:
+        f.write(b"corrupt")
+    assert open(cache.fetch(server.url, "model.keras"), "rb").read() == BODY
+    assert len(server.requests) == 2
+
+
+def test_offline_mode_serves_cached_files_only(tmp_path, server):
+    ModelCache(str(tmp_path)).fetch(server.url, "model.keras", SHA)
+    offline = ModelCache(str(tmp_path), offline=True)
+    assert offline.fetch(server.url, "model.keras", SHA) == str(tmp_path / "model.keras")
+    assert offline.fetch(server.url, "other.keras") is None
+    assert len(server.requests) == 1
+
+
+def test_offline_miss_never_touches_the_network(tmp_path, server):
+    assert ModelCache(str(tmp_path), offline=True).fetch(server.url, "model.keras", SHA) is None
+    assert server.requests == []
+    assert cache_files(tmp_path) == []
+
+
+def test_concurrent_fetches_download_once(tmp_path):
+    # Like gunicorn workers all loading the model at boot
+    server = ModelServer(delay=0.005)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            paths = list(pool.map(lambda i: ModelCache(str(tmp_path)).fetch(server.url, "model.keras"), range(4)))
+    finally:
+        server.close()
+    assert len(set(paths)) == 1 and open(paths[0], "rb").read() == BODY
+    assert len(server.requests) == 1
+    assert (tmp_path / "model.keras.sha256").read_text().strip() == SHA
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+def test_concurrent_processes_download_once(tmp_path):
+    server = ModelServer(delay=0.005)
+    try:
+        pids = []
+        for _ in range(3):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    path = ModelCache(str(tmp_path)).fetch(server.url, "model.keras", SHA)
+                    status = 0 if path and open(path, "rb").read() == BODY else 1
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+        statuses = [os.waitpid(pid, 0)[1] for pid in pids]
+    finally:
+        server.close()
+    assert statuses == [0, 0, 0]
+    assert len(server.requests) == 1
@@ -0,0 +1,188 @@
+import asyncio
+import json
+
+import pytest
+
+from orchestrator import AnalysisPipeline, stub_components
+
+FILM = (b"\x89PNG fake film bytes", "chest.png")
+LAB_FILES = [(b"%PDF-1.7 report", "cbc.pdf"), (b"jpeg bytes", "lipids.jpg")]
+
+
+def failing(message):
+    def fn(*args):
+        raise RuntimeError(message)
+    return fn
+
+
+@pytest.fixture
+def make_pipeline():
+    pipelines = []
+
+    def make(delay_ms=0.0, **overrides):
+        components = stub_components(delay_ms)
+        for name, fn in overrides.items():
+            setattr(components, name, fn)
+        pipeline = AnalysisPipeline(components, max_workers=4)
+        pipelines.append(pipeline)
+        return pipeline
+
+    yield make
+    for pipeline in pipelines:
+        pipeline.shutdown()
+
+
+def test_both_branches(make_pipeline):
+    result = make_pipeline().analyze_sync([FILM], LAB_FILES, username="Asha", language="hindi")
+
+    xray = result["xray"]
+    assert xray["message"] == "Prediction successful"
+    assert xray["prediction"] == stub_components().predict_xray(FILM[0])["prediction"]
+    assert xray["interpretation"].startswith("👋 Hello Asha")
+    assert "(report, hindi)" in xray["interpretation"]
+
+    lab = result["lab"]
+    assert set(lab["diagnostics"]) == {"cbc.pdf", "lipids.jpg"}
+    assert lab["summary"].startswith("Stub summary")
+    assert set(result["timings_ms"]) == {
+        "xray_predict_0", "xray_interpret", "lab_extract", "lab_summarize", "lab_interpret", "total"
+    }
+
+
+def two_hop_content(micro_response):
+    """What /interpret builds in the gateway flow: Flask jsonify -> Server.js -> json.loads + dumps."""
+    flask = pytest.importorskip("flask")
+    with flask.Flask("service").app_context():
+        body = flask.jsonify(micro_response).get_data(as_text=True)
+    # JSON.stringify keeps the parsed key order and writes whole numbers without ".0"
+    relayed = json.loads(body, parse_float=lambda text: int(float(text)) if float(text).is_integer() else float(text))
+    return json.dumps(relayed, indent=2)
+
+
+def capture_interpret(calls):
+    def interpret(username, content, mode="report", language="english"):
+        calls["lab" if '"summary"' in content else "xray"] = content
+        return "ok"
+    return interpret
+
+
+def test_interpreter_prompt_matches_the_gateway_flow(make_pipeline):
+    calls = {}
+    predict_xray = lambda image_bytes: {"prediction": [[1.0, 2.5e-05]], "raw_output": "[[1.0e+00 2.5e-05]]"}
+    result = make_pipeline(predict_xray=predict_xray, interpret=capture_interpret(calls)).analyze_sync(
+        [FILM], LAB_FILES[:1]
+    )
+    assert calls["lab"] == (
+        '{\n'
+        '  "diagnostics": {\n'
+        '    "cbc.pdf": {\n'
+        '      "status": "success",\n'
+        '      "text_length": 15\n'
+        '    }\n'
+        '  },\n'
+        '  "message": "Parsed successfully (uploaded)",\n'
+        f'  "summary": {json.dumps(result["lab"]["summary"])}\n'
+        '}'
+    )
+    assert calls["xray"] == (
+        '{\n'
+        '  "message": "Prediction successful",\n'
+        '  "prediction": [\n'
+        '    [\n'
+        '      1,\n'
+        '      2.5e-05\n'
+        '    ]\n'
+        '  ],\n'
+        '  "raw_output": "[[1.0e+00 2.5e-05]]"\n'
+        '}'
+    )
+    for branch in ("xray", "lab"):
+        micro_response = {k: v for k, v in result[branch].items() if k != "interpretation"}
+        assert calls[branch] == two_hop_content(micro_response)
+
+
+def test_batch_prompt_matches_the_gateway_flow(make_pipeline):
+    calls = {}
+    films = [FILM, (b"another film", "lateral.png")]
+    result = make_pipeline(interpret=capture_interpret(calls)).analyze_sync(films)
+    micro_response = {k: v for k, v in result["xray"].items() if k != "interpretation"}
+    assert calls["xray"] == two_hop_content(micro_response)
+
+
+def test_several_films_give_a_batch_response(make_pipeline):
+    films = [FILM, (b"another film", "lateral.png")]
+    xray = make_pipeline().analyze_sync(films)["xray"]
+    assert xray["message"] == "Batch prediction complete"
+    assert (xray["count"], xray["failed"]) == (2, 0)
+    # Same per-item shape as /predict_batch
+    stub = stub_components().predict_xray
+    assert xray["results"] == [
+        {"index": 0, "name": "chest.png", "status": "success", **stub(FILM[0])},
+        {"index": 1, "name": "lateral.png", "status": "success", **stub(b"another film")},
+    ]
+
+
+def test_only_requested_branches_run(make_pipeline):
+    result = make_pipeline().analyze_sync(lab_files=LAB_FILES)
+    assert "xray" not in result and "summary" in result["lab"]
+
+
+def test_branches_run_concurrently(make_pipeline):
+    # X-ray is 2 stages and lab 3; run one after the other they would take 5 x 100 ms
+    result = make_pipeline(delay_ms=100).analyze_sync([FILM], LAB_FILES)
+    assert result["timings_ms"]["total"] < 450
+
+
+@pytest.mark.parametrize("stage, failed, other", [
+    ("predict_xray", "xray", "lab"),
+    ("extract_lab", "lab", "xray"),
+    ("summarize_lab", "lab", "xray"),
+])
+def test_a_failing_branch_does_not_cancel_the_other(make_pipeline, stage, failed, other):
+    result = make_pipeline(**{stage: failing(f"{stage} broke")}).analyze_sync([FILM], LAB_FILES)
+    assert result[failed] == {"error": f"{stage} broke"}
+    assert "interpretation" in result[other]
+
+
+def test_failed_interpretation_is_reported_per_branch(make_pipeline):
+    def interpret(username, content, mode="report", language="english"):
+        if "summary" in json.loads(content):
+            raise RuntimeError("Gemini unavailable")
+        return "ok"
+
+    result = make_pipeline(interpret=interpret).analyze_sync([FILM], LAB_FILES)
+    assert result["lab"] == {"error": "Gemini unavailable"}
+    assert result["xray"]["interpretation"] == "ok"
+
+
+def test_one_unreadable_film_is_a_failed_item(make_pipeline):
+    stub = stub_components().predict_xray
+
+    def predict_xray(image_bytes):
+        if image_bytes == b"corrupt":
+            raise ValueError("cannot identify image file")
+        return stub(image_bytes)
+
+    result = make_pipeline(predict_xray=predict_xray).analyze_sync([FILM, (b"corrupt", "bad.png")], LAB_FILES)
+    xray = result["xray"]
+    assert xray["failed"] == 1
+    assert xray["results"][0]["status"] == "success"
+    assert xray["results"][1] == {"index": 1, "name": "bad.png", "status": "failed", "error": "cannot identify image file"}
+    assert "interpretation" in xray and "interpretation" in result["lab"]
+
+
+def test_a_single_unreadable_film_fails_the_xray_branch(make_pipeline):
+    # Like /predict, which answers 500 for the one image it was given
+    result = make_pipeline(predict_xray=failing("cannot identify image file")).analyze_sync([FILM], LAB_FILES)
+    assert result["xray"] == {"error": "cannot identify image file"}
+    assert "interpretation" in result["lab"]
+
+
+def test_analyze_inside_a_running_loop(make_pipeline):
+    pipeline = make_pipeline()
+
+    async def main():
+        return await asyncio.gather(pipeline.analyze([FILM]), pipeline.analyze(lab_files=LAB_FILES))
+
+    xray, lab = asyncio.run(main())
+    assert "interpretation" in xray["xray"] and "interpretation" in lab["lab"]
@@ -0,0 +1,55 @@
+import os
+import threading
+
+import pytest
+
+from result_cache import SQLiteCache
+
+
+def test_constructor_opens_no_connection(tmp_path):
+    path = tmp_path / "cache" / "results.db"
+    cache = SQLiteCache(str(path))
+    # Built at import in the gunicorn master: nothing may be open before the fork
+    assert not path.exists()
+    assert getattr(cache._local, "conn", None) is None
+    cache.set("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+
+
+def test_one_connection_per_thread(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "results.db"))
+    cache.set("k", [1, 2])
+    main = cache._conn()
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append((cache.get("k"), cache._conn())))
+    thread.start()
+    thread.join()
+    assert seen[0][0] == [1, 2]
+    assert seen[0][1] is not main
+    assert cache._conn() is main
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+def test_forked_child_opens_its_own_connection(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "results.db"))
+    cache.set("parent", 1)
+    parent_conn = cache._conn()
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            ok = cache.get("parent") == 1 and cache._conn() is not parent_conn
+            cache.set("child", 2)
+        finally:
+            os.write(write_fd, b"1" if ok else b"0")
+            os._exit(0)
+    os.close(write_fd)
+    result = os.read(read_fd, 1)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    assert result == b"1"
+    assert cache._conn() is parent_conn
+    assert cache.get("child") == 2
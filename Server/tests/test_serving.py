@@ -0,0 +1,37 @@
+import sys
+
+import pytest
+
+import serving
+
+
+@pytest.fixture
+def cpus(monkeypatch):
+    monkeypatch.setattr(serving, "available_cpus", lambda: 8)
+    for name in ("SERVING_WORKERS", "WEB_CONCURRENCY", "SERVING_COMPUTE_THREADS"):
+        monkeypatch.delenv(name, raising=False)
+
+
+@pytest.fixture
+def gunicorn(monkeypatch):
+    monkeypatch.setitem(sys.modules, "gunicorn", object())
+
+
+def test_app_run_is_one_process_with_the_whole_machine(cpus, monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    assert not serving.under_gunicorn()
+    assert serving.worker_processes() == 1
+    assert serving.compute_threads() == 8
+    assert serving.compute_threads(default=4) == 4
+
+
+def test_gunicorn_splits_the_cpus_across_workers(cpus, gunicorn, monkeypatch):
+    assert serving.worker_processes() == 4
+    assert serving.compute_threads(default=4) == 2
+    monkeypatch.setenv("SERVING_WORKERS", "2")
+    assert serving.compute_threads() == 4
+
+
+def test_compute_threads_override(cpus, monkeypatch):
+    monkeypatch.setenv("SERVING_COMPUTE_THREADS", "3")
+    assert serving.compute_threads(default=4) == 3
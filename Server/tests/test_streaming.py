@@ -0,0 +1,140 @@
+import json
+import random
+
+import pytest
+
+from gemini_client import OK, QUOTA, GeminiClient
+from result_cache import LRUTTLCache
+from streaming import GreetingFilter, SentenceBuffer, sse_event
+from stub_servers import StubConfig, start_stub_servers
+from text_pipeline import strip_greetings
+
+FLASH, PRO = "gemini-flash-latest", "gemini-pro-latest"
+
+# A reply with a leading greeting, a greeting line mid-text and sentences that end mid-line
+REPLY = (
+    "Hello! 😊\n"
+    "Dear Asha,\n"
+    "Your hemoglobin is 13.5 g/dL. That is normal!  Keep it up.\n"
+    "\n"
+    "Hi again, one more thing:\n"
+    "Drink water 💧 and rest. यह ठीक है। Done?\n"
+)
+
+
+def filtered(chunks):
+    greetings = GreetingFilter()
+    return "".join(greetings.feed(chunk) for chunk in chunks) + greetings.flush()
+
+
+def split_at(text, cuts):
+    bounds = [0, *cuts, len(text)]
+    return [text[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+@pytest.fixture
+def stub():
+    """Starts a stub Gemini server streaming REPLY; returns (client, config)."""
+    servers = []
+
+    def start(**config_kwargs):
+        config = StubConfig(jitter=0.0, ttft_ms=0, chunk_ms=0, reply_text=REPLY, **config_kwargs)
+        gemini, translate = start_stub_servers(config, gemini_port=0, translate_port=0)
+        servers.extend([gemini, translate])
+        host, port = gemini.server_address[:2]
+        return GeminiClient("stub", base_url=f"http://{host}:{port}", models=[FLASH, PRO]), config
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+# ------------------ GreetingFilter ------------------
+def test_greeting_filter_matches_strip_greetings_at_every_split():
+    expected = strip_greetings(REPLY)
+    assert expected.startswith("Your hemoglobin") and "Hi again" not in expected
+    for cut in range(len(REPLY) + 1):
+        assert filtered(split_at(REPLY, [cut])) == expected, cut
+
+
+def test_greeting_filter_matches_strip_greetings_on_random_chunks():
+    rng = random.Random(1)
+    atoms = ["hi", "Hello", "HEY", "dear", "Dear x", " ", "\n", "\t", "\r\n", "!", "ok", "a", "1.", "😊", "hiya",
+             "\n\n", "History", "he"]
+    for _ in range(20000):
+        text = "".join(rng.choice(atoms) for _ in range(rng.randint(0, 14)))
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 5))))
+        assert filtered(split_at(text, cuts)) == strip_greetings(text), (text, cuts)
+
+
+def test_greeting_filter_emits_before_the_stream_ends():
+    greetings = GreetingFilter()
+    assert greetings.feed("Hello! Your res") == "Your res"
+    assert greetings.feed("ults are fine.\nDrink") == "ults are fine.\nDrink"
+    assert greetings.feed(" water.  ") == " water."
+    assert greetings.flush() == ""
+
+
+# ------------------ SentenceBuffer ------------------
+def test_sentence_buffer_releases_whole_sentences():
+    sentences = SentenceBuffer()
+    assert sentences.feed("Your hemoglobin is 13") == []
+    assert sentences.feed(".5 g/dL. That is nor") == ["Your hemoglobin is 13.5 g/dL. "]
+    assert sentences.feed("mal!\nयह ठीक है। Do") == ["That is normal!\n", "यह ठीक है। "]
+    assert sentences.flush() == ["Do"]
+    assert sentences.flush() == []
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 13])
+def test_sentence_buffer_keeps_every_character(size):
+    sentences, released = SentenceBuffer(), []
+    for chunk in split_at(REPLY, range(size, len(REPLY), size)):
+        released += sentences.feed(chunk)
+    released += sentences.flush()
+    whole = SentenceBuffer()
+    assert released == whole.feed(REPLY) + whole.flush()
+    assert "".join(released) == REPLY
+
+
+# ------------------ GeminiStream ------------------
+@pytest.mark.parametrize("size", [1, 3, 7, 40])
+def test_stream_chunks_rejoin_to_the_reply(stub, size):
+    client, config = stub(stream_chunk_chars=size)
+    stream = client.stream("hello")
+    chunks = list(stream)
+    assert len(chunks) == -(-len(REPLY) // size)
+    assert "".join(chunks) == REPLY
+    assert (stream.result.status, stream.result.model, stream.result.text) == (OK, FLASH, REPLY)
+    assert filtered(chunks) == strip_greetings(REPLY)
+
+
+def test_stream_is_cached_whole(stub):
+    client, config = stub(stream_chunk_chars=4)
+    cache = LRUTTLCache(max_entries=8, ttl_seconds=60)
+    assert "".join(client.stream("hello", cache=cache, cache_key="k")) == REPLY
+    stream = client.stream("hello", cache=cache, cache_key="k")
+    assert list(stream) == [REPLY]
+    assert stream.result.model == "cache"
+    assert config.counters["stream"] == 1
+
+
+def test_stream_falls_back_before_the_first_chunk(stub):
+    client, config = stub(stream_chunk_chars=8, down_models=[FLASH])
+    stream = client.stream("hello")
+    assert "".join(stream) == REPLY
+    assert stream.result.model == PRO
+    assert config.calls_by_model == {FLASH: 1, PRO: 1}
+
+
+def test_stream_quota_yields_nothing(stub):
+    client, config = stub(quota_rate=1.0)
+    stream = client.stream("hello")
+    assert list(stream) == []
+    assert stream.result.status == QUOTA
+    assert config.calls_by_model == {FLASH: 1}
+
+
+def test_sse_event_frame():
+    frame = sse_event("chunk", {"text": "यह ठीक है।\n"})
+    assert frame.startswith("event: chunk\ndata: ") and frame.endswith("\n\n")
+    assert json.loads(frame.split("data: ", 1)[1]) == {"text": "यह ठीक है।\n"}
@@ -0,0 +1,26 @@
+import random
+
+import pytest
+
+from bench_postprocess import legacy_clean, make_outputs
+from text_pipeline import PromptTemplate, strip_greetings
+
+
+@pytest.mark.parametrize("name", sorted(make_outputs()))
+def test_strip_greetings_matches_legacy_on_bench_inputs(name):
+    text = make_outputs()[name]
+    assert strip_greetings(text) == legacy_clean(text)
+
+
+def test_strip_greetings_matches_legacy_on_random_inputs():
+    rng = random.Random(1)
+    atoms = ["hi", "Hello", "HEY", "dear", "Dear x", " ", "\n", "\t", "\r\n", "!", "ok", "a", "1.", "😊", "hiya", "\n\n"]
+    for _ in range(20000):
+        text = "".join(rng.choice(atoms) for _ in range(rng.randint(0, 14)))
+        assert strip_greetings(text) == legacy_clean(text), repr(text)
+
+
+def test_prompt_template_needs_exactly_one_slot():
+    assert PromptTemplate("a {content} b").render("{x}", "!") == "a {x} b!"
+    with pytest.raises(ValueError):
+        PromptTemplate("no slot")
@@ -0,0 +1,121 @@
+import pytest
+
+from result_cache import build_cache
+from translation import OfflineBackend, TranslationBackend, TranslationService
+
+PARAGRAPH = "Drink plenty of water. Get enough rest.\nPlease consult a general physician."
+
+
+class RecordingBackend(TranslationBackend):
+    """Tags segments like OfflineBackend(tag=True) and records every batch; raises when `broken`."""
+
+    def __init__(self, name, broken=False):
+        self.name = name
+        self.broken = broken
+        self.batches = []
+
+    def translate_batch(self, segments, dest):
+        self.batches.append(list(segments))
+        if self.broken:
+            raise ConnectionError(f"{self.name} unreachable")
+        return [f"<{self.name}:{dest}> {segment}" for segment in segments]
+
+
+def service(*backends, cache=True):
+    primary, *fallbacks = backends
+    cache = build_cache("test-translation-cache", 64, 60) if cache else None
+    return TranslationService(primary, cache, fallbacks=fallbacks)
+
+
+def test_repeated_paragraphs_hit_the_segment_cache():
+    backend = RecordingBackend("primary")
+    translation = service(backend)
+
+    text, ok = translation.translate(f"{PARAGRAPH}\n\n{PARAGRAPH}", "hindi")
+    assert ok
+    # Each distinct sentence is sent once, even when it repeats within the text
+    assert backend.batches == [["Drink plenty of water.", "Get enough rest.", "Please consult a general physician."]]
+    assert text.count("<primary:hi> Drink plenty of water.") == 2
+
+    # A later response sharing the paragraph only sends what is new
+    text, ok = translation.translate(f"Your results look normal.\n{PARAGRAPH}", "hindi")
+    assert ok and backend.batches[1] == ["Your results look normal."]
+    assert text.startswith("<primary:hi> Your results look normal.\n<primary:hi> Drink")
+    stats = translation.stats()
+    assert (stats["requests"], stats["segments"], stats["cached_segments"], stats["backend_calls"]) == (2, 7, 3, 2)
+
+
+def test_cache_is_per_language():
+    backend = RecordingBackend("primary")
+    translation = service(backend)
+    translation.translate(PARAGRAPH, "hindi")
+    translation.translate(PARAGRAPH, "telugu")
+    assert len(backend.batches) == 2 and backend.batches[0] == backend.batches[1]
+
+
+def test_layout_numbers_and_english_are_kept():
+    backend = RecordingBackend("primary")
+    translation = service(backend)
+    assert translation.translate(PARAGRAPH, "English") == (PARAGRAPH, True)
+    text, ok = translation.translate("  Rest well.\n\n- 13.5\n😊\n", "hindi")
+    assert text == "  <primary:hi> Rest well.\n\n- 13.5\n😊\n"
+    assert backend.batches == [["Rest well."]]
+
+
+def test_fallbacks_are_tried_in_order():
+    first, second, third = RecordingBackend("first", broken=True), RecordingBackend("second"), RecordingBackend("third")
+    translation = service(first, second, third)
+
+    text, ok = translation.translate(PARAGRAPH, "hindi")
+    assert ok and text.startswith("<second:hi> Drink plenty of water.")
+    assert len(first.batches) == 1 and first.batches == second.batches and third.batches == []
+    stats = translation.stats()
+    assert (stats["backend_calls"], stats["failures"], stats["fallbacks"]) == (2, 1, 1)
+    assert stats["fallback_backends"] == ["second", "third"]
+
+    # What the fallback translated is cached; the broken primary isn't asked again for it
+    assert translation.translate(PARAGRAPH, "hindi") == (text, True)
+    assert len(first.batches) == 1
+
+
+def test_recovered_primary_only_gets_uncached_segments():
+    primary, fallback = RecordingBackend("primary", broken=True), RecordingBackend("fallback")
+    translation = service(primary, fallback)
+    translation.translate("Rest well.", "hindi")
+    primary.broken = False
+    translation.translate("Rest well. Sleep early.", "hindi")
+    assert primary.batches[-1] == ["Sleep early."]
+    # Segments the fallback translated during the outage stay cached under its name
+    assert translation.translate("Rest well.", "hindi")[0] == "<fallback:hi> Rest well."
+
+
+def test_every_backend_failing_returns_the_text_untranslated():
+    first, second = RecordingBackend("first", broken=True), RecordingBackend("second", broken=True)
+    translation = service(first, second)
+    assert translation.translate(PARAGRAPH, "telugu") == (PARAGRAPH, False)
+    assert translation.stats()["failures"] == 2
+
+    # Nothing was cached, so the next call tries again from the primary
+    first.broken = False
+    text, ok = translation.translate(PARAGRAPH, "telugu")
+    assert ok and text.startswith("<first:te>")
+
+
+@pytest.mark.parametrize("cache", [True, False])
+def test_offline_backend_returns_the_input_unchanged(cache):
+    translation = service(OfflineBackend(), cache=cache)
+    text = f"{PARAGRAPH}\n\n- 13.5 g/dL 😊\n"
+    assert translation.translate(text, "hindi") == (text, True)
+    assert translation.translate(text, "hindi") == (text, True)
+
+
+def test_offline_backend_can_tag_segments():
+    assert OfflineBackend(tag=True).translate_batch(["Rest well."], "hi") == ["[hi] Rest well."]
+
+
+def test_native_backend_output_passes_through():
+    backend = RecordingBackend("gemini")
+    backend.native = True
+    translation = service(backend)
+    assert translation.translate(PARAGRAPH, "hindi", generated=True) == (PARAGRAPH, True)
+    assert backend.batches == []
@@ -0,0 +1,155 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import gemini_client
+from gemini_client import FORBIDDEN, OK, QUOTA, GeminiClient
+from result_cache import build_cache
+from stub_servers import StubConfig, start_stub_servers
+from upstream import TokenBucket
+
+# GeminiClient against the fault-injecting stub Gemini server: coalescing, circuit breaking,
+# 429 handling, hedging, rate limiting and what the response cache keeps
+
+FLASH, PRO = "gemini-flash-latest", "gemini-pro-latest"
+
+
+@pytest.fixture
+def stub():
+    """Starts a stub Gemini server; returns (client, config) built from the given options."""
+    servers = []
+
+    def start(client_kwargs=None, **config_kwargs):
+        config = StubConfig(jitter=0.0, **config_kwargs)
+        gemini, translate = start_stub_servers(config, gemini_port=0, translate_port=0)
+        servers.extend([gemini, translate])
+        host, port = gemini.server_address[:2]
+        client = GeminiClient("stub", base_url=f"http://{host}:{port}", models=[FLASH, PRO], **(client_kwargs or {}))
+        return client, config
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_identical_prompts_share_one_upstream_call(stub):
+    client, config = stub(gemini_latency_ms=300)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda i: client.generate("same prompt"), range(16)))
+    assert all(r.status == OK for r in results)
+    assert config.calls_by_model.get(FLASH) == 1
+
+
+def test_breaker_skips_a_failing_model(stub):
+    client, config = stub({"breaker_failures": 3, "breaker_cooldown": 60}, gemini_latency_ms=10, down_models=[FLASH])
+    results = [client.generate(f"prompt {i}") for i in range(10)]
+    assert all(r.status == OK and r.model == PRO for r in results)
+    assert config.calls_by_model.get(FLASH) == 3
+    assert client.stats()["breakers"][FLASH]["state"] == "open"
+
+
+def test_quota_storm_is_answered_locally(stub):
+    client, config = stub(gemini_latency_ms=10, quota_rate=1.0, retry_delay_s=5)
+    start = time.perf_counter()
+    results = [client.generate(f"prompt {i}") for i in range(20)]
+    # The first 429 opens the breaker until Gemini's retryDelay; the rest never go upstream
+    assert all(r.status == QUOTA for r in results)
+    assert sum(config.calls_by_model.values()) == 1
+    assert time.perf_counter() - start < 1.0
+    assert 4.0 < client.stats()["breakers"][FLASH]["retry_in_s"] <= 5.0
+
+
+def test_slow_primary_is_hedged(stub):
+    client, config = stub({"hedge_after": 0.2}, gemini_latency_ms=50, slow_models=[FLASH], slow_ms=2000)
+    start = time.perf_counter()
+    result = client.generate("hedge me")
+    assert result.status == OK and result.model == PRO
+    assert time.perf_counter() - start < 1.0
+
+
+def test_hedging_is_off_by_default(stub):
+    client, config = stub(gemini_latency_ms=10, slow_models=[FLASH], slow_ms=500)
+    result = client.generate("wait for me")
+    assert result.status == OK and result.model == FLASH
+    assert PRO not in config.calls_by_model
+    assert client.stats()["hedge_after_s"] is None
+
+
+def test_shared_client_does_not_hedge_unless_configured(monkeypatch):
+    monkeypatch.setattr(gemini_client, "_client", None)
+    monkeypatch.delenv("GEMINI_HEDGE_AFTER_MS", raising=False)
+    assert gemini_client.get_client("stub").hedge_after == 0
+    monkeypatch.setattr(gemini_client, "_client", None)
+    monkeypatch.setenv("GEMINI_HEDGE_AFTER_MS", "1500")
+    assert gemini_client.get_client("stub").hedge_after == 1.5
+
+
+def test_rate_limit_answers_locally_past_the_burst(stub):
+    client, config = stub({"rate_limiter": TokenBucket(0.01, 2), "rate_wait": 0}, gemini_latency_ms=10)
+    results = [client.generate(f"prompt {i}") for i in range(6)]
+    assert sum(r.status == OK for r in results) == 2
+    assert len([r for r in results if r.status == QUOTA and r.error == "Local rate limit"]) == 4
+    assert sum(config.calls_by_model.values()) == 2
+
+
+# ------------------ Response cache ------------------
+@pytest.fixture
+def cache():
+    return build_cache("test-llm-cache", 64, 60)
+
+
+def fresh_client(client):
+    """A second client on the same stub, with none of the first one's breaker state."""
+    return GeminiClient("stub", base_url=client.base_url, models=[FLASH, PRO])
+
+
+def test_quota_is_never_cached(stub, cache):
+    client, config = stub(gemini_latency_ms=0, quota_rate=1.0)
+    assert client.generate("hello", cache=cache, cache_key="k").status == QUOTA
+    stream = client.stream("hello again", cache=cache, cache_key="k")
+    assert list(stream) == [] and stream.result.status == QUOTA
+    assert cache.stats()["sets"] == 0
+
+    # Once the quota is back the same request goes upstream, and only then is it cached
+    config.quota_rate = 0.0
+    client = fresh_client(client)
+    assert client.generate("hello", cache=cache, cache_key="k").model == FLASH
+    assert client.generate("hello", cache=cache, cache_key="k").model == "cache"
+    assert config.counters["generate"] == 2 and cache.stats()["sets"] == 1
+
+
+def test_forbidden_is_never_cached(stub, cache):
+    client, config = stub(gemini_latency_ms=0, forbidden_models=[FLASH])
+    result = client.generate("hello", cache=cache, cache_key="k")
+    assert (result.status, result.status_code) == (FORBIDDEN, 403)
+    stream = client.stream("hello", cache=cache, cache_key="k")
+    assert list(stream) == [] and stream.result.status == FORBIDDEN
+    # A rejected key answers for every model; the fallback isn't asked
+    assert config.calls_by_model == {FLASH: 1}
+    assert cache.stats()["sets"] == 0
+
+    config.forbidden_models.clear()
+    client = fresh_client(client)
+    assert client.generate("hello", cache=cache, cache_key="k").model == FLASH
+    assert cache.stats()["sets"] == 1
+
+
+def test_cache_key_covers_model_prompt_and_language(stub, cache):
+    client, config = stub(gemini_latency_ms=0)
+    prompt = "Explain these lab results."
+    hindi = prompt + "\nWrite the entire answer in Hindi (keep emojis and markdown).\n"
+
+    # The caller's key is the same every time; the client scopes it to the models and the prompt
+    assert client.generate(prompt, models=[FLASH], cache=cache, cache_key="k").model == FLASH
+    assert client.generate(prompt, models=[PRO], cache=cache, cache_key="k").model == PRO
+    assert client.generate(hindi, models=[FLASH], cache=cache, cache_key="k").model == FLASH
+    assert client.generate(prompt + " ", models=[FLASH], cache=cache, cache_key="k").model == FLASH
+    assert config.counters["generate"] == 4
+
+    for text in (prompt, hindi):
+        assert client.generate(text, models=[FLASH], cache=cache, cache_key="k").model == "cache"
+        assert "".join(client.stream(text, models=[FLASH], cache=cache, cache_key="k")) == \
+            client.generate(text, models=[FLASH], cache=cache, cache_key="k").text
+    assert client.generate(prompt, models=[FLASH], cache=cache, cache_key="other").model == FLASH
+    assert config.counters["generate"] == 5 and config.counters["stream"] == 0
@@ -0,0 +1,157 @@
+import importlib.util
+
+import numpy as np
+import pytest
+
+import xray_backends
+from quantize_model import label_agreement
+from xray_backends import (
+    ARTIFACT_NAMES,
+    BACKENDS,
+    INPUT_SHAPE,
+    KerasBackend,
+    TFLiteBackend,
+    artifact_version,
+    convert_model,
+    load_backend,
+)
+
+
+# ------------------ Artifact versions (no TensorFlow needed) ------------------
+class FakeBackend:
+    def __init__(self, path):
+        with open(path) as f:
+            self.built_from = f.read()
+
+
+@pytest.fixture
+def fake_conversion(monkeypatch):
+    conversions = []
+
+    def convert(model, backend_name, path):
+        conversions.append(model)
+        with open(path, "w") as f:
+            f.write(model)
+        return path
+
+    monkeypatch.setattr(xray_backends, "convert_model", convert)
+    monkeypatch.setitem(BACKENDS, "onnx", FakeBackend)
+    return conversions
+
+
+def test_artifact_reused_for_the_same_weights(tmp_path, fake_conversion):
+    path = str(tmp_path / "model.onnx")
+    assert load_backend("onnx", lambda: "weights-a", path, model_version="sha-a").built_from == "weights-a"
+    assert artifact_version(path) == "sha-a"
+    # Same version: the Keras loader is not called again
+    backend = load_backend("onnx", lambda: pytest.fail("reconverted"), path, model_version="sha-a")
+    assert backend.built_from == "weights-a"
+    assert fake_conversion == ["weights-a"]
+
+
+def test_artifact_rebuilt_when_the_weights_change(tmp_path, fake_conversion):
+    path = str(tmp_path / "model.onnx")
+    load_backend("onnx", lambda: "weights-a", path, model_version="sha-a")
+    assert load_backend("onnx", lambda: "weights-b", path, model_version="sha-b").built_from == "weights-b"
+    assert artifact_version(path) == "sha-b"
+
+
+def test_unknown_version_reuses_the_artifact(tmp_path, fake_conversion):
+    path = str(tmp_path / "model.onnx")
+    load_backend("onnx", lambda: "weights-a", path, model_version="sha-a")
+    # Artifact-only deployment, or offline with no cached Keras file: the Keras model can't be fetched
+    backend = load_backend("onnx", lambda: pytest.fail("reconverted"), path, model_version=lambda: None)
+    assert backend.built_from == "weights-a"
+    assert artifact_version(path) == "sha-a"
+
+
+def test_unstamped_artifact_is_reused_and_left_unstamped(tmp_path, fake_conversion):
+    path = str(tmp_path / "model.onnx")
+    load_backend("onnx", lambda: "weights-a", path)
+    backend = load_backend("onnx", lambda: pytest.fail("reconverted"), path, model_version="sha-b")
+    assert backend.built_from == "weights-a"
+    assert artifact_version(path) is None
+
+
+def test_first_build_is_stamped_once_the_weights_are_known(tmp_path, fake_conversion):
+    path = str(tmp_path / "model.onnx")
+    # The weights aren't cached yet: the version is only known once the loader has fetched them
+    versions = iter([None, "sha-b"])
+    backend = load_backend("onnx", lambda: "weights-b", path, model_version=lambda: next(versions))
+    assert backend.built_from == "weights-b"
+    assert artifact_version(path) == "sha-b"
+
+
+def test_untracked_artifact_is_reused(tmp_path, fake_conversion):
+    path = str(tmp_path / "model.onnx")
+    load_backend("onnx", lambda: "weights-a", path)
+    assert load_backend("onnx", lambda: "weights-b", path).built_from == "weights-a"
+
+
+def test_label_agreement_thresholds_a_single_output():
+    expected = np.array([[0.9], [0.2], [0.6], [0.4]])
+    assert label_agreement(expected + 0.05, expected) == 1.0
+    # 0.6 -> 0.45 crosses the threshold; 0.9 -> 0.55 doesn't
+    assert label_agreement(np.array([[0.55], [0.2], [0.45], [0.4]]), expected) == 0.75
+    assert label_agreement(np.array([[0.55], [0.2], [0.45], [0.4]]), expected, threshold=0.4) == 1.0
+
+
+def test_label_agreement_uses_argmax_for_several_outputs():
+    expected = np.array([[0.9, 0.1], [0.3, 0.7]])
+    assert label_agreement(np.array([[0.6, 0.4], [0.6, 0.4]]), expected) == 0.5
+
+
+# ------------------ Backend parity (needs TensorFlow) ------------------
+@pytest.fixture(scope="module")
+def tiny_model():
+    tf = pytest.importorskip("tensorflow")
+    tf.keras.utils.set_random_seed(0)
+    return tf.keras.Sequential([
+        tf.keras.layers.Input(INPUT_SHAPE),
+        tf.keras.layers.Conv2D(4, 3, strides=4, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(1, activation="sigmoid"),
+    ])
+
+
+BACKEND_REQUIREMENTS = {"onnx": ("tf2onnx", "onnxruntime")}
+
+
+@pytest.mark.parametrize("name", sorted(BACKENDS))
+def test_backend_matches_keras(tiny_model, tmp_path, name):
+    for module in BACKEND_REQUIREMENTS.get(name, ()):
+        if importlib.util.find_spec(module) is None:
+            pytest.skip(f"{module} not installed")
+    inputs = np.random.default_rng(0).random((5,) + INPUT_SHAPE, dtype=np.float32)
+    expected = KerasBackend(tiny_model).predict(inputs)
+
+    backend = load_backend(name, lambda: tiny_model, str(tmp_path / ARTIFACT_NAMES[name]))
+    # A full batch, then single samples (the batch dimension changes between calls)
+    np.testing.assert_allclose(backend.predict(inputs), expected, atol=1e-5)
+    single = np.concatenate([backend.predict(inputs[i:i + 1]) for i in range(len(inputs))])
+    np.testing.assert_allclose(single, expected, atol=1e-5)
+
+
+def test_tflite_pads_to_fixed_batch_sizes(tiny_model, tmp_path):
+    inputs = np.random.default_rng(1).random((11,) + INPUT_SHAPE, dtype=np.float32)
+    expected = KerasBackend(tiny_model).predict(inputs)
+    backend = TFLiteBackend(convert_model(tiny_model, "tflite", str(tmp_path / "model.tflite")), batch_sizes=(1, 4))
+    resizes = []
+    resize = backend._resize
+    backend._resize = lambda size: (resizes.append(size), resize(size))
+
+    # 3, 2 and 4 all run padded at size 4, 11 is split 4 + 4 + 3: one resize for all of them
+    for n in (3, 2, 4, 11):
+        np.testing.assert_allclose(backend.predict(inputs[:n]), expected[:n], atol=1e-5)
+    assert resizes == [4]
+    np.testing.assert_allclose(backend.predict(inputs[:1]), expected[:1], atol=1e-5)
+    assert resizes == [4, 1]
+
+
+def test_savedmodel_replaces_an_existing_artifact(tiny_model, tmp_path):
+    path = str(tmp_path / "savedmodel")
+    (tmp_path / "savedmodel").mkdir()
+    (tmp_path / "savedmodel" / "stale.txt").write_text("partial")
+    convert_model(tiny_model, "savedmodel", path)
+    assert not (tmp_path / "savedmodel" / "stale.txt").exists()
+    assert not (tmp_path / "savedmodel.part").exists()
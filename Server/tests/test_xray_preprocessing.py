@@ -0,0 +1,61 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from bench_preprocessing import legacy_preprocess
+from xray_preprocessing import TARGET_SIZE, allocate_batch, preprocess_image, preprocess_into
+
+MODES = ("L", "LA", "RGB", "RGBA", "P", "I;16", "I", "CMYK", "1")
+
+
+def encode(mode, side=300, fmt="PNG"):
+    """A noisy gradient film in `mode`, encoded losslessly (TIFF where PNG can't hold the mode)."""
+    rng = np.random.default_rng(side)
+    y, x = np.mgrid[0:side, 0:side]
+    gray = np.clip((x + y) * (255.0 / (2 * side)) + rng.normal(0, 12, (side, side)), 0, 255).astype(np.uint8)
+    image = Image.fromarray(gray, "L")
+    if mode == "I;16":
+        image = Image.fromarray(gray.astype(np.uint16) * 257)
+    elif mode == "I":
+        image = Image.fromarray(gray.astype(np.int32) * 100)
+    elif mode == "P":
+        image = Image.merge("RGB", (image, image.transpose(Image.Transpose.FLIP_LEFT_RIGHT), image)).quantize(64)
+    elif mode != "L":
+        image = image.convert(mode)
+    if fmt == "PNG" and mode in ("I", "CMYK"):
+        fmt = "TIFF"
+    buf = io.BytesIO()
+    image.save(buf, format=fmt)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_matches_legacy_pipeline(mode):
+    data = encode(mode)
+    assert Image.open(io.BytesIO(data)).mode == mode
+    got = preprocess_image(data)
+    assert got.shape == TARGET_SIZE[::-1] + (3,) and got.dtype == np.float32
+    np.testing.assert_allclose(got, legacy_preprocess(data), atol=1e-6)
+
+
+@pytest.mark.parametrize("mode", ("L", "RGB"))
+def test_small_jpeg_matches_legacy_pipeline(mode):
+    # Under 2x the target the JPEG decoder can't scale down, so draft mode changes nothing
+    data = encode(mode, fmt="JPEG")
+    np.testing.assert_allclose(preprocess_image(data), legacy_preprocess(data), atol=1e-6)
+
+
+def test_large_jpeg_stays_close_to_legacy_pipeline():
+    # Draft mode decodes at reduced scale, so it is only close to a full decode + resize
+    data = encode("L", side=1600, fmt="JPEG")
+    assert np.abs(preprocess_image(data) - legacy_preprocess(data)).mean() < 0.02
+
+
+def test_preprocess_into_batch_rows_from_a_stream():
+    batch = allocate_batch(2)
+    preprocess_into(io.BytesIO(encode("RGB")), batch[0])
+    preprocess_into(encode("L"), batch[1])
+    np.testing.assert_allclose(batch[0], legacy_preprocess(encode("RGB")), atol=1e-6)
+    np.testing.assert_allclose(batch[1], legacy_preprocess(encode("L")), atol=1e-6)
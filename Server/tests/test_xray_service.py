@@ -0,0 +1,186 @@
+import base64
+import importlib
+import io
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import xray_backends
+from result_cache import build_cache
+
+# The X-ray Flask app with a stub InferenceBackend in place of the model: load_backend is
+# replaced before the module is imported, so nothing is downloaded or converted
+
+
+class StubBackend(xray_backends.InferenceBackend):
+    """Answers [mean, 1 - mean] of each image's pixels and records the batch sizes it ran."""
+
+    name = "stub"
+
+    def __init__(self):
+        self.batches = []
+        self.broken = False
+
+    def predict(self, batch):
+        if self.broken:
+            raise RuntimeError("forward pass failed")
+        batch = np.asarray(batch)
+        self.batches.append(len(batch))
+        means = batch.reshape(len(batch), -1).mean(axis=1)
+        return np.stack([means, 1 - means], axis=1)
+
+
+@pytest.fixture(scope="module")
+def xray(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("MODEL_CACHE_DIR", str(tmp_path_factory.mktemp("models")))
+        mp.setenv("MEDISCOPE_OFFLINE", "1")
+        mp.setattr(xray_backends, "load_backend", lambda *args, **kwargs: StubBackend())
+        sys.modules.pop("XrayMicroservice", None)
+        module = importlib.import_module("XrayMicroservice")
+    yield module
+    module.jobs.shutdown()
+    module.batcher.shutdown()
+    module.decode_pool.shutdown()
+
+
+@pytest.fixture
+def backend(xray, monkeypatch):
+    backend = StubBackend()
+    monkeypatch.setattr(xray, "backend", backend)
+    monkeypatch.setattr(xray, "prediction_cache", build_cache("test-xray-cache", 64, 60))
+    return backend
+
+
+@pytest.fixture
+def client(xray, backend):
+    return xray.app.test_client()
+
+
+def png(level, size=(200, 240)):
+    buf = io.BytesIO()
+    Image.new("L", size, level).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def expected(level):
+    mean = np.float32(level) * np.float32(1.0 / 255.0)
+    return pytest.approx([float(mean), float(1 - mean)], abs=1e-6)
+
+
+# ------------------ /predict_batch ------------------
+def test_batch_upload_runs_one_forward_pass(client, backend):
+    files = [(io.BytesIO(png(level)), f"film_{level}.png") for level in (0, 128, 255)]
+    response = client.post("/predict_batch", data={"files": files})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body["message"], body["count"], body["failed"]) == ("Batch prediction complete", 3, 0)
+    for i, (item, level) in enumerate(zip(body["results"], (0, 128, 255))):
+        assert (item["index"], item["name"], item["status"]) == (i, f"film_{level}.png", "success")
+        assert item["prediction"][0] == expected(level)
+    assert backend.batches == [3]
+
+
+def test_batch_json_payloads_report_failures_per_item(client, backend):
+    payloads = [
+        {"view": "frontal", "image_base64": base64.b64encode(png(64)).decode()},
+        {"view": "lateral"},
+        {"image_base64": base64.b64encode(b"not an image").decode()},
+    ]
+    response = client.post("/predict_batch", json={"payloads": payloads})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body["count"], body["failed"]) == (3, 2)
+    first, missing, corrupt = body["results"]
+    assert (first["name"], first["status"]) == ("frontal", "success")
+    assert first["prediction"][0] == expected(64)
+    assert missing == {"index": 1, "name": "lateral", "status": "failed", "error": "Missing 'image_base64' in payload."}
+    assert (corrupt["name"], corrupt["status"]) == ("image_2", "failed")
+    assert backend.batches == [1]
+
+
+def test_batch_serves_seen_images_from_the_cache(client, backend):
+    first = client.post("/predict_batch", data={"files": [(io.BytesIO(png(10)), "a.png")]}).get_json()
+    files = [(io.BytesIO(png(10)), "a.png"), (io.BytesIO(png(20)), "b.png")]
+    second = client.post("/predict_batch", data={"files": files}).get_json()
+    assert second["results"][0] == first["results"][0]
+    assert second["results"][1]["prediction"][0] == expected(20)
+    # Only the new image went through the model
+    assert backend.batches == [1, 1]
+
+
+def test_batch_forward_failure_fails_the_uncached_items(client, backend):
+    client.post("/predict_batch", data={"files": [(io.BytesIO(png(10)), "seen.png")]})
+    backend.broken = True
+    files = [(io.BytesIO(png(10)), "seen.png"), (io.BytesIO(png(30)), "new.png")]
+    body = client.post("/predict_batch", data={"files": files}).get_json()
+    assert body["failed"] == 1
+    assert body["results"][0]["status"] == "success"
+    assert body["results"][1] == {"index": 1, "name": "new.png", "status": "failed", "error": "forward pass failed"}
+
+
+def test_batch_rejects_bad_requests(client, xray, monkeypatch):
+    assert client.post("/predict_batch", json={"payload": {}}).status_code == 400
+    assert client.post("/predict_batch", json={"payloads": []}).get_json() == {"error": "No images provided."}
+    monkeypatch.setattr(xray, "MAX_IMAGES_PER_REQUEST", 2)
+    files = [(io.BytesIO(png(level)), f"{level}.png") for level in (1, 2, 3)]
+    response = client.post("/predict_batch", data={"files": files})
+    assert response.status_code == 413
+    assert response.get_json() == {"error": "Too many images (3); the limit is 2."}
+
+
+# ------------------ /predict ------------------
+@pytest.mark.parametrize("content_type", ["image/png", "image/jpeg", "application/octet-stream"])
+def test_predict_raw_body(client, content_type):
+    # The type only picks the raw-body path; the bytes are decoded by content
+    response = client.post("/predict", data=png(100), content_type=content_type)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["message"] == "Prediction successful"
+    assert body["prediction"][0] == expected(100)
+
+
+@pytest.mark.parametrize("part", ["file", "image"])
+def test_predict_multipart(client, part):
+    response = client.post("/predict", data={part: (io.BytesIO(png(200)), "film.png")})
+    assert response.status_code == 200
+    assert response.get_json()["prediction"][0] == expected(200)
+
+
+def test_every_format_gives_the_same_answer_and_shares_the_cache(client, backend):
+    raw = client.post("/predict", data=png(50), content_type="image/png").get_json()
+    multipart = client.post("/predict", data={"file": (io.BytesIO(png(50)), "film.png")}).get_json()
+    legacy = client.post("/predict", json={"payload": {"image_base64": base64.b64encode(png(50)).decode()}}).get_json()
+    assert raw == multipart == legacy
+    assert backend.batches == [1]
+
+
+@pytest.mark.parametrize("kwargs, error", [
+    ({"data": b"", "content_type": "image/png"}, "Empty image body."),
+    ({"data": {"other": (io.BytesIO(b"x"), "x.png")}}, "Missing 'file' part in multipart request."),
+    ({"json": {"image": "..."}}, "Invalid request format. Expected JSON with 'payload' key."),
+    ({"json": {"payload": {}}}, "Missing 'image_base64' in payload."),
+])
+def test_predict_rejects_bad_requests(client, backend, kwargs, error):
+    response = client.post("/predict", **kwargs)
+    assert (response.status_code, response.get_json()) == (400, {"error": error})
+    assert backend.batches == []
+
+
+def test_predict_undecodable_image(client, backend):
+    response = client.post("/predict", data=b"not an image", content_type="image/png")
+    assert response.status_code == 500
+    assert "error" in response.get_json()
+    assert backend.batches == []
+
+
+def test_predict_body_over_the_limit_is_a_json_413(client, xray, monkeypatch):
+    monkeypatch.setitem(xray.app.config, "MAX_CONTENT_LENGTH", 1000)
+    monkeypatch.setattr(xray, "MAX_REQUEST_BYTES", 1000)
+    for kwargs in ({"data": b"\0" * 2000, "content_type": "image/png"},
+                   {"data": {"file": (io.BytesIO(b"\0" * 2000), "film.png")}}):
+        response = client.post("/predict", **kwargs)
+        assert response.status_code == 413
+        assert response.get_json() == {"error": "Request body exceeds 1000 bytes."}
@@ -0,0 +1,46 @@
+# Prompt templates and response post-processing, prepared once at import time
+import re
+
+# Greeting cleanup, same rules as the old two re.sub passes:
+#   1. at the very start: a leading hi/hello/hey plus the non-letters after it, then a
+#      greeting line right behind it
+#   2. any later line starting with hi/hello/hey/dear, with the line break before it
+# _LINE_GREETING starts with a literal "\n", so the regex engine jumps between line breaks.
+# Its second branch swallows multi-line blank runs that don't lead into a greeting; the
+# old pattern retried every newline of such a run, which was quadratic in its length.
+# Plain greedy quantifiers only (no possessive/atomic syntax, which needs Python 3.11):
+# everything after them is optional or must start with a letter, so backtracking never
+# changes the match.
+_LEADING_GREETING = re.compile(r"(?i)\s*(?:(?:hi|hello|hey)[^a-zA-Z]*)?(?:(?:hi|hello|hey|dear)[^\n]*\n?)?")
+_LINE_GREETING = re.compile(r"(?i)\n(?:\s*((?:hi|hello|hey|dear)[^\n]*\n?)|[^\S\n]*\n\s*)")
+
+
+class PromptTemplate:
+    """A prompt with one `{content}` slot, pre-split so rendering is two string concatenations.
+
+    Unlike str.format, braces inside the template or the content need no escaping.
+    """
+
+    def __init__(self, text, slot="{content}"):
+        if text.count(slot) != 1:
+            raise ValueError(f"Template must contain {slot} exactly once")
+        self.prefix, self.suffix = text.split(slot)
+
+    def render(self, content, extra=""):
+        # `extra` is appended after the template (e.g. a language instruction)
+        return self.prefix + content + self.suffix + extra
+
+
+def strip_greetings(text):
+    """Removes a leading hi/hello/hey and lines starting with hi/hello/hey/dear, in one pass.
+
+    Output is identical to the old two `re.sub` passes; see bench_postprocess.py.
+    """
+    pos = _LEADING_GREETING.match(text).end()
+    kept = []
+    for m in _LINE_GREETING.finditer(text, pos):
+        if m.lastindex:  # a greeting line; blank-run matches are left in place
+            kept.append(text[pos:m.start()])
+            pos = m.end()
+    kept.append(text[pos:])
+    return "".join(kept).strip()
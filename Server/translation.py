@@ -0,0 +1,289 @@
+# Translation layer: segment-level cache, batched backend calls, pluggable backends
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+from result_cache import build_cache, make_key
+
+logger = logging.getLogger("MEDISCOPE_Translation")
+
+LANGUAGE_MAP = {"english": "en", "telugu": "te", "hindi": "hi"}
+
+# Sentence ends (terminal punctuation + whitespace) and line breaks separate segments;
+# the separators are kept so the translated text has the original layout
+_SEPARATOR = re.compile(r"((?<=[.!?।])\s+|\n+)")
+_HAS_LETTERS = re.compile(r"[^\W\d_]")
+
+
+def split_segments(text):
+    """Alternating [segment, separator, segment, ...] list; joining it gives back `text`."""
+    return _SEPARATOR.split(text)
+
+
+# ------------------ Backends ------------------
+class TranslationBackend:
+    """Translates a batch of segments into one language per call."""
+
+    name = "base"
+    # True when the LLM can be asked to answer in the target language directly
+    native = False
+
+    def translate_batch(self, segments, dest):
+        raise NotImplementedError
+
+    def prompt_instruction(self, language):
+        return ""
+
+
+class GoogleTransBackend(TranslationBackend):
+    """googletrans, with all uncached segments sent as one newline-joined request."""
+
+    name = "googletrans"
+
+    def __init__(self, service_urls=None):
+        from googletrans import Translator
+
+        self._translator_cls = Translator
+        self.service_urls = service_urls
+        # googletrans keeps per-instance token/session state; give each thread its own
+        self._local = threading.local()
+
+    def _translator(self):
+        translator = getattr(self._local, "translator", None)
+        if translator is None:
+            kwargs = {"service_urls": self.service_urls} if self.service_urls else {}
+            translator = self._local.translator = self._translator_cls(**kwargs)
+        return translator
+
+    def translate_batch(self, segments, dest):
+        translator = self._translator()
+        lines = translator.translate("\n".join(segments), dest=dest).text.split("\n")
+        if len(lines) == len(segments):
+            return lines
+        # The service merged or split lines; translate item by item instead
+        return [t.text for t in translator.translate(list(segments), dest=dest)]
+
+
+class GeminiBackend(TranslationBackend):
+    """Gemini answers in the target language itself; leftover text is translated in one JSON call."""
+
+    name = "gemini"
+    native = True
+
+    def __init__(self, client, languages=None):
+        self.client = client
+        self.names = {code: name for name, code in (languages or LANGUAGE_MAP).items()}
+
+    def prompt_instruction(self, language):
+        if language.lower() == "english":
+            return ""
+        return f"\nWrite the entire answer in {language.title()} (keep emojis and markdown).\n"
+
+    def translate_batch(self, segments, dest):
+        prompt = (
+            f"Translate each string in this JSON array into {self.names.get(dest, dest).title()}. "
+            "Reply with only a JSON array of the translations, in the same order.\n\n"
+            + json.dumps(list(segments), ensure_ascii=False)
+        )
+        result = self.client.generate(prompt)
+        if not result.ok:
+            raise RuntimeError(f"Gemini translation failed: {result.status}")
+        text = result.text.strip()
+        # Models often wrap JSON in a ``` fence
+        text = text[text.find("["):text.rfind("]") + 1]
+        translated = json.loads(text)
+        if not isinstance(translated, list) or len(translated) != len(segments):
+            raise RuntimeError("Gemini translation returned a mismatched array")
+        return [str(t) for t in translated]
+
+
+class HttpBackend(TranslationBackend):
+    """A LibreTranslate-compatible server: POST {url}/translate with the whole batch as `q`."""
+
+    name = "http"
+
+    def __init__(self, url, api_key=None, timeout=15.0):
+        import requests
+
+        self.url = url.rstrip("/") + "/translate"
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def translate_batch(self, segments, dest):
+        body = {"q": list(segments), "source": "auto", "target": dest, "format": "text"}
+        if self.api_key:
+            body["api_key"] = self.api_key
+        response = self.session.post(self.url, json=body, timeout=self.timeout)
+        response.raise_for_status()
+        translated = response.json().get("translatedText")
+        if not isinstance(translated, list) or len(translated) != len(segments):
+            raise RuntimeError("Translation server returned a mismatched batch")
+        return [str(t) for t in translated]
+
+
+class OfflineBackend(TranslationBackend):
+    """No-network stand-in for tests and load runs: returns each segment unchanged.
+
+    With `tag`, each segment is prefixed with its language code so load runs can see what was translated.
+    """
+
+    name = "offline"
+
+    def __init__(self, delay_ms=0.0, tag=False):
+        self.delay = max(float(delay_ms), 0.0) / 1000.0
+        self.tag = tag
+
+    def translate_batch(self, segments, dest):
+        if self.delay:
+            time.sleep(self.delay)  # one simulated round trip per batch
+        if self.tag:
+            return [f"[{dest}] {segment}" for segment in segments]
+        return list(segments)
+
+
+# ------------------ Service ------------------
+class TranslationService:
+    """Splits text into segments, serves repeats from the cache and translates the rest in one batch.
+
+    When a backend raises, the batch goes to each of `fallbacks` in order; if every
+    one fails the text is returned untranslated. Safe to share between threads: the
+    cache is thread-safe and backends keep per-thread clients where the underlying
+    library needs it.
+    """
+
+    def __init__(self, backend, cache=None, languages=None, fallbacks=()):
+        self.backend = backend
+        self.backends = [backend, *fallbacks]
+        self.cache = cache
+        self.languages = languages or LANGUAGE_MAP
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "segments": 0, "cached_segments": 0, "backend_calls": 0, "failures": 0,
+                          "fallbacks": 0}
+
+    @property
+    def native(self):
+        return self.backend.native
+
+    def prompt_instruction(self, language):
+        return self.backend.prompt_instruction(language)
+
+    def _count(self, **deltas):
+        with self._lock:
+            for counter, delta in deltas.items():
+                self._counters[counter] += delta
+
+    def _key(self, backend, dest, segment):
+        return make_key("translation", backend.name, dest, segment)
+
+    def _cached(self, dest, segment):
+        # A fallback's translation is cached under its own name; the primary's wins when both exist
+        for backend in self.backends:
+            cached = self.cache.get(self._key(backend, dest, segment))
+            if cached is not None:
+                return cached
+        return None
+
+    def _translate_pending(self, batch, dest, translations):
+        """Sends `batch` to each backend in turn until one succeeds; False if they all raise."""
+        for attempt, backend in enumerate(self.backends):
+            try:
+                self._count(backend_calls=1, fallbacks=1 if attempt else 0)
+                results = backend.translate_batch(batch, dest)
+            except Exception as e:
+                logger.warning(f"⚠️ Translation to {dest} failed ({backend.name}): {e}")
+                self._count(failures=1)
+                continue
+            for core, translated in zip(batch, results):
+                translations[core] = translated
+                if self.cache is not None:
+                    self.cache.set(self._key(backend, dest, core), translated)
+            return True
+        return False
+
+    def translate(self, text, language, generated=False):
+        """Returns (text, ok). English passes through untouched.
+
+        `generated=True` marks text the model already wrote in `language`
+        (native backends only), which is passed through as well.
+        """
+        if language.lower() == "english" or not text.strip():
+            return text, True
+        if generated and self.backend.native:
+            return text, True
+        dest = self.languages.get(language.lower(), "en")
+
+        parts = split_segments(text)
+        # Segment text (even indexes) -> translation; whitespace around each segment is kept as is
+        pending = {}
+        translations = {}
+        for segment in parts[::2]:
+            core = segment.strip()
+            if not core or not _HAS_LETTERS.search(core) or core in translations or core in pending:
+                continue
+            cached = self._cached(dest, core) if self.cache is not None else None
+            if cached is not None:
+                translations[core] = cached
+            else:
+                pending[core] = None
+
+        self._count(requests=1, segments=len(translations) + len(pending), cached_segments=len(translations))
+
+        ok = self._translate_pending(list(pending), dest, translations) if pending else True
+
+        out = []
+        for i, part in enumerate(parts):
+            core = part.strip() if i % 2 == 0 else ""
+            if core in translations:
+                lead = part[:len(part) - len(part.lstrip())]
+                trail = part[len(part.rstrip()):]
+                out.append(lead + translations[core] + trail)
+            else:
+                out.append(part)
+        return "".join(out), ok
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["backend"] = self.backend.name
+        counters["fallback_backends"] = [backend.name for backend in self.backends[1:]]
+        counters["cache"] = self.cache.stats() if self.cache is not None else None
+        return counters
+
+
+def _build_backend(name, client=None, languages=None):
+    if name == "gemini":
+        return GeminiBackend(client, languages)
+    if name == "http":
+        return HttpBackend(
+            os.getenv("TRANSLATION_URL", "http://127.0.0.1:8091"),
+            os.getenv("TRANSLATION_API_KEY") or None,
+            float(os.getenv("TRANSLATION_TIMEOUT", 15)),
+        )
+    if name == "offline":
+        return OfflineBackend(float(os.getenv("TRANSLATION_OFFLINE_DELAY_MS", 0)),
+                              os.getenv("TRANSLATION_OFFLINE_TAG", "0") == "1")
+    service_urls = [u for u in os.getenv("GOOGLETRANS_SERVICE_URLS", "").split(",") if u]
+    return GoogleTransBackend(service_urls or None)
+
+
+def build_translation_service(client=None, languages=None):
+    """TranslationService from TRANSLATION_BACKEND and TRANSLATION_CACHE_*.
+
+    TRANSLATION_BACKEND is googletrans | gemini | http | offline, or a comma-separated
+    fallback order such as "gemini,googletrans".
+    """
+    names = [n.strip() for n in os.getenv("TRANSLATION_BACKEND", "googletrans").lower().split(",") if n.strip()]
+    backends = [_build_backend(name, client, languages) for name in names or ["googletrans"]]
+
+    cache = build_cache(
+        "translation-cache",
+        int(os.getenv("TRANSLATION_CACHE_MAX_ENTRIES", 8192)),
+        float(os.getenv("TRANSLATION_CACHE_TTL", 7 * 24 * 3600)),
+        os.getenv("TRANSLATION_CACHE_DB") or None,
+    )
+    logger.info(f"🌐 Translation backends: {', '.join(backend.name for backend in backends)}")
+    return TranslationService(backends[0], cache, languages, fallbacks=backends[1:])
@@ -0,0 +1,161 @@
+# Upstream control for LLM calls: token-bucket rate limit, per-model circuit breakers, single-flight
+import time
+import logging
+import threading
+
+from instrumentation import count
+
+logger = logging.getLogger("MEDISCOPE_Upstream")
+
+
+class TokenBucket:
+    """`rate` tokens per second, bursts up to `burst`. A rate of 0 disables limiting."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = max(float(rate), 0.0)
+        self.burst = max(float(burst if burst is not None else max(1.0, self.rate)), 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=0.0):
+        """Takes one token, waiting up to `timeout` seconds for a refill. Returns False if none came."""
+        if not self.enabled:
+            return True
+        end = time.monotonic() + max(timeout, 0.0)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > end:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Per-upstream breaker.
+
+    closed: calls go through; `failure_threshold` consecutive failures open it.
+    open: calls are refused until `cooldown` seconds pass (a 429 Retry-After can set it).
+    half-open: one probe per cooldown goes through; success closes the breaker, failure re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, cooldown=30.0):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = float(cooldown)
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        # Status that opened the breaker (e.g. "quota"); callers answer with it while open
+        self.reason = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if now < self.opened_until:
+                return False
+            # One probe per cooldown window, so a probe that never reports back can't wedge the breaker
+            if self.state == self.OPEN:
+                logger.info(f"🔌 {self.name} breaker half-open; sending a probe")
+            self.state = self.HALF_OPEN
+            self.opened_until = now + self.cooldown
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info(f"✅ {self.name} breaker closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.reason = None
+
+    def record_failure(self, reason, cooldown=None):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._open(reason, cooldown)
+
+    def trip(self, reason, cooldown=None):
+        """Opens immediately (quota exhausted, key rejected)."""
+        with self.lock:
+            self._open(reason, cooldown)
+
+    def _open(self, reason, cooldown):
+        if self.state != self.OPEN:
+            logger.warning(f"⛔ {self.name} breaker open ({reason})")
+            count(f"upstream.breaker_open.{self.name}")
+        self.state = self.OPEN
+        self.reason = reason
+        self.opened_until = time.monotonic() + (self.cooldown if cooldown is None else float(cooldown))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "reason": self.reason,
+                "retry_in_s": round(max(0.0, self.opened_until - time.monotonic()), 1) if self.state != self.CLOSED else 0,
+            }
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution of `fn` and its result."""
+
+    class _Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """Returns (result, shared). Followers raise TimeoutError after `timeout` seconds."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            count("upstream.coalesced")
+            if not call.done.wait(timeout):
+                raise TimeoutError("Timed out waiting for a shared upstream call")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
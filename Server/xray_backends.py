@@ -0,0 +1,359 @@
+# Inference backends for the X-ray model
+import os
+import logging
+import threading
+
+import numpy as np
+
+from serving import compute_threads
+from xray_preprocessing import TARGET_SIZE
+
+logger = logging.getLogger("MEDISCOPE_Backends")
+
+BACKEND_DIR = os.environ.get("XRAY_BACKEND_DIR", "/tmp/mediscope_backends")
+INPUT_SHAPE = (TARGET_SIZE[1], TARGET_SIZE[0], 3)
+
+ARTIFACT_NAMES = {
+    "tflite": "final_best_model.tflite",
+    "onnx": "final_best_model.onnx",
+    "savedmodel": "final_best_model_savedmodel",
+}
+
+# Post-training quantized TFLite variants ("float" is the unquantized model)
+QUANTIZED_VARIANTS = ("dynamic", "float16", "int8")
+
+# Fixed batch sizes the TFLite backend runs at (smaller batches are zero-padded up to the next one)
+TFLITE_BATCH_SIZES = tuple(int(b) for b in os.environ.get("XRAY_TFLITE_BATCH_SIZES", "1,2,4,8,16").split(",") if b.strip())
+
+
+def default_artifact_path(backend_name, variant="float"):
+    if variant and variant != "float":
+        return os.path.join(BACKEND_DIR, f"final_best_model_{variant}.tflite")
+    return os.path.join(BACKEND_DIR, ARTIFACT_NAMES[backend_name])
+
+
+# ------------------ Artifact versions ------------------
+# Each converted artifact records the source weights it was built from in "<artifact>.source"
+def _source_stamp_path(path):
+    return path.rstrip(os.sep) + ".source"
+
+
+def artifact_version(path):
+    try:
+        with open(_source_stamp_path(path)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def stamp_artifact(path, version):
+    stamp = _source_stamp_path(path)
+    with open(stamp + ".part", "w") as f:
+        f.write(f"{version}\n")
+    os.replace(stamp + ".part", stamp)
+
+
+def _remove_artifact(path):
+    import shutil
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _num_threads():
+    # Defaults to this worker process's share of the CPUs under gunicorn (see serving.compute_threads), else 4
+    return int(os.environ.get("XRAY_NUM_THREADS") or compute_threads(default=4))
+
+
+# ------------------ Backends ------------------
+class InferenceBackend:
+    """Common interface: predict() takes an N x H x W x 3 float32 batch, returns N rows."""
+
+    name = "base"
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+    def warmup(self, batch_sizes=(1,)):
+        for size in sorted(set(batch_sizes)):
+            self.predict(np.zeros((size,) + INPUT_SHAPE, dtype=np.float32))
+        logger.info(f"🔥 {self.name} backend warmed up (batch sizes {sorted(set(batch_sizes))})")
+
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch):
+        return np.asarray(self.model.predict_on_batch(np.asarray(batch, dtype=np.float32)))
+
+
+class SavedModelBackend(InferenceBackend):
+    """Runs the serving signature of a SavedModel as a graph-compiled tf.function."""
+
+    name = "savedmodel"
+
+    def __init__(self, path):
+        import tensorflow as tf
+
+        self._tf = tf
+        self.path = path
+        loaded = tf.saved_model.load(path)
+        self._loaded = loaded  # keep the trackable alive for the signature
+        self._fn = loaded.signatures["serving_default"]
+        self._input_name = list(self._fn.structured_input_signature[1].keys())[0]
+
+    def predict(self, batch):
+        outputs = self._fn(**{self._input_name: self._tf.constant(batch, dtype=self._tf.float32)})
+        return next(iter(outputs.values())).numpy()
+
+
+class TFLiteBackend(InferenceBackend):
+    """TFLite interpreter (XNNPACK is applied by default to float ops on CPU).
+
+    Resizing the input re-allocates the interpreter's tensors, so batches are zero-padded up to
+    the next size in `batch_sizes` (larger ones are split): the interpreter is only resized when a
+    batch lands on a different size, never for every batch length. A single interpreter keeps one
+    copy of the weights per process.
+    """
+
+    name = "tflite"
+
+    def __init__(self, path, num_threads=None, batch_sizes=TFLITE_BATCH_SIZES):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads or _num_threads())
+        self.batch_sizes = tuple(sorted(set(int(b) for b in batch_sizes)))
+        self._batch_size = None
+        self._resize(self.batch_sizes[0])
+        # The interpreter holds mutable tensor state; one invocation at a time
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        index = self.interpreter.get_input_details()[0]["index"]
+        self.interpreter.resize_tensor_input(index, (batch_size,) + INPUT_SHAPE)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def _bucket(self, n):
+        return next((size for size in self.batch_sizes if size >= n), self.batch_sizes[-1])
+
+    @staticmethod
+    def _quantize(batch, details):
+        scale, zero_point = details["quantization"]
+        if not scale:
+            return batch.astype(details["dtype"], copy=False)
+        info = np.iinfo(details["dtype"])
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(details["dtype"])
+
+    @staticmethod
+    def _dequantize(values, details):
+        scale, zero_point = details["quantization"]
+        if not scale:
+            return values.astype(np.float32, copy=False)
+        return (values.astype(np.float32) - zero_point) * scale
+
+    def _invoke(self, batch):
+        n = batch.shape[0]
+        size = self._bucket(n)
+        if size != self._batch_size:
+            self._resize(size)
+        if n < size:
+            padded = np.zeros((size,) + batch.shape[1:], dtype=np.float32)
+            padded[:n] = batch
+            batch = padded
+        # Full-integer models take/return int8 tensors; map them through the tensor's scale/zero point
+        self.interpreter.set_tensor(self._input["index"], self._quantize(batch, self._input))
+        self.interpreter.invoke()
+        return self._dequantize(self.interpreter.get_tensor(self._output["index"])[:n], self._output).copy()
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        largest = self.batch_sizes[-1]
+        with self._lock:
+            if batch.shape[0] <= largest:
+                return self._invoke(batch)
+            return np.concatenate([self._invoke(batch[i:i + largest]) for i in range(0, batch.shape[0], largest)])
+
+
+class ONNXBackend(InferenceBackend):
+    name = "onnx"
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        self.path = path
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or _num_threads()
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self._input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+# ------------------ Conversion ------------------
+def convert_model(model, backend_name, path):
+    """Convert a loaded Keras model into the artifact format of `backend_name`."""
+    import tensorflow as tf
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    logger.info(f"🔧 Converting Keras model to {backend_name} at {path} ...")
+
+    if backend_name == "tflite":
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        with open(path + ".part", "wb") as f:
+            f.write(converter.convert())
+        os.replace(path + ".part", path)
+
+    elif backend_name == "savedmodel":
+        # A SavedModel is a directory: write it next to the target and rename it into place, so a
+        # crash mid-write never leaves a partial model under the real name
+        spec = tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name="image")
+        serve = tf.function(lambda image: {"prediction": model(image, training=False)}, input_signature=[spec])
+        part = path.rstrip(os.sep) + ".part"
+        _remove_artifact(part)
+        tf.saved_model.save(model, part, signatures={"serving_default": serve.get_concrete_function()})
+        _remove_artifact(path)
+        os.replace(part, path)
+
+    elif backend_name == "onnx":
+        import tf2onnx
+
+        spec = (tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name="image"),)
+        tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=path + ".part")
+        os.replace(path + ".part", path)
+
+    else:
+        raise ValueError(f"Cannot convert to unknown backend '{backend_name}'")
+
+    logger.info(f"✅ {backend_name} artifact written to {path}")
+    return path
+
+
+def quantize_model(model, variant, path, calibration_batches=None):
+    """Write a post-training quantized TFLite variant of `model`.
+
+    variant: "dynamic" (int8 weights, float activations), "float16" (fp16 weights) or
+    "int8" (full integer; needs `calibration_batches`, an iterable of N x H x W x 3 arrays).
+    """
+    import tensorflow as tf
+
+    if variant not in QUANTIZED_VARIANTS:
+        raise ValueError(f"Unknown quantization variant '{variant}'. Choose from: {', '.join(QUANTIZED_VARIANTS)}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        if calibration_batches is None:
+            raise ValueError("int8 quantization needs calibration images (XRAY_CALIBRATION_DIR / --calibration)")
+        batches = list(calibration_batches)
+
+        def representative_dataset():
+            for batch in batches:
+                for sample in batch:
+                    yield [np.asarray(sample[None], dtype=np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    logger.info(f"🔧 Quantizing Keras model ({variant}) to {path} ...")
+    with open(path + ".part", "wb") as f:
+        f.write(converter.convert())
+    os.replace(path + ".part", path)
+    logger.info(f"✅ {variant} variant written to {path}")
+    return path
+
+
+def load_calibration_batches(image_dir, limit=200, batch_size=16):
+    """Preprocess up to `limit` images from `image_dir` into float32 batches."""
+    from xray_preprocessing import allocate_batch, preprocess_into
+
+    paths = sorted(
+        os.path.join(image_dir, name) for name in os.listdir(image_dir)
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".tiff"))
+    )[:limit]
+    if not paths:
+        raise ValueError(f"No calibration images found in {image_dir}")
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        batch = allocate_batch(len(chunk))
+        for i, path in enumerate(chunk):
+            with open(path, "rb") as f:
+                preprocess_into(f.read(), batch[i])
+        yield batch
+
+
+# ------------------ Factory ------------------
+BACKENDS = {
+    "savedmodel": SavedModelBackend,
+    "tflite": TFLiteBackend,
+    "onnx": ONNXBackend,
+}
+
+
+def load_backend(backend_name, keras_loader, artifact_path=None, variant="float", calibration_dir=None,
+                 model_version=None):
+    """Build the backend named `backend_name` ("keras", "tflite", "onnx" or "savedmodel").
+
+    Non-Keras backends load their converted artifact directly when it already exists,
+    so the full Keras model is only loaded (via `keras_loader`) the first time.
+    A quantized `variant` ("dynamic", "float16", "int8") always runs on the tflite backend.
+
+    `model_version` identifies the source weights (e.g. the Keras file's SHA-256). It is a string
+    or a callable, called again after `keras_loader` ran since that may download the weights.
+    An artifact is rebuilt only when both its stamp and the current version are known and differ.
+    If either is unknown (no `model_version`, an artifact-only deployment, offline with no cached
+    Keras file, an unstamped artifact), the existing artifact is reused.
+    """
+    backend_name = (backend_name or "keras").lower()
+    variant = (variant or "float").lower()
+    if variant != "float":
+        if variant not in QUANTIZED_VARIANTS:
+            raise ValueError(f"Unknown XRAY_MODEL_VARIANT '{variant}'. Choose from: float, {', '.join(QUANTIZED_VARIANTS)}")
+        if backend_name != "tflite":
+            logger.info(f"💡 Quantized variant '{variant}' requested; using the tflite backend.")
+        backend_name = "tflite"
+
+    if backend_name == "keras":
+        return KerasBackend(keras_loader())
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown XRAY_BACKEND '{backend_name}'. Choose from: keras, {', '.join(BACKENDS)}")
+
+    path = artifact_path or default_artifact_path(backend_name, variant)
+    version = model_version() if callable(model_version) else model_version
+    built_from = artifact_version(path) if version is not None and os.path.exists(path) else None
+    if built_from is not None and built_from != version:
+        logger.info(f"♻️ {path} was built from other weights ({built_from} != {version}); rebuilding")
+        _remove_artifact(path)
+    if not os.path.exists(path):
+        model = keras_loader()
+        if variant != "float":
+            calibration = load_calibration_batches(calibration_dir) if variant == "int8" and calibration_dir else None
+            quantize_model(model, variant, path, calibration)
+        else:
+            convert_model(model, backend_name, path)
+        version = model_version() if callable(model_version) else model_version
+        if version is not None:
+            stamp_artifact(path, version)
+
+    backend = BACKENDS[backend_name](path)
+    logger.info(f"✅ Using {backend_name} backend from {path}")
+    return backend
@@ -0,0 +1,54 @@
+# X-ray image preprocessing
+import io
+
+import numpy as np
+from PIL import Image
+
+# Model's expected input size (160x160 for this model)
+TARGET_SIZE = (160, 160)
+_SCALE = np.float32(1.0 / 255.0)
+
+
+def _open(source):
+    # Accepts raw bytes or any seekable binary stream (e.g. a multipart part's spool)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def allocate_batch(count, size=TARGET_SIZE):
+    """Preallocated float32 NHWC buffer for `count` preprocessed images."""
+    return np.empty((count, size[1], size[0], 3), dtype=np.float32)
+
+
+def preprocess_into(source, out, size=TARGET_SIZE):
+    """Decode, resize and normalize one image into `out` (H x W x 3, float32).
+
+    - JPEGs are decoded with PIL's draft mode: the DCT scaler reduces the film by the
+      largest factor (1/2, 1/4 or 1/8) that still keeps it at least the target size,
+      instead of decoding it at full resolution.
+    - Grayscale images are resized on a single channel and broadcast to RGB.
+    - Normalization writes uint8 -> float32 straight into `out`; no float64 temp.
+    """
+    image = _open(source)
+
+    if image.format == "JPEG":
+        # draft() only reconfigures the decoder; it must run before load()
+        image.draft("L" if image.mode == "L" else "RGB", size)
+
+    if image.mode in ("L", "LA"):
+        if image.mode == "LA":
+            image = image.convert("L")
+        gray = np.asarray(image.resize(size))
+        np.multiply(gray[:, :, None], _SCALE, out=out, casting="unsafe")
+    else:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        rgb = np.asarray(image.resize(size))
+        np.multiply(rgb, _SCALE, out=out, casting="unsafe")
+    return out
+
+
+def preprocess_image(source, size=TARGET_SIZE):
+    """Preprocess one image into a fresh (H x W x 3) float32 array."""
+    return preprocess_into(source, np.empty((size[1], size[0], 3), dtype=np.float32), size)